@@ -0,0 +1,311 @@
+"""Definition of a local caching HTTP server, used to share the files downloaded by
+many launchers, typically a fleet of launchers on a local network.
+
+The server speaks the URL layout of upstream servers, prefixed with their host, for
+example `http://localhost:8080/resources.download.minecraft.net/ab/ab...` serves the
+same file as `https://resources.download.minecraft.net/ab/ab...`. Launchers are then
+pointed to the server by overriding the base URL of upstream hosts, see
+`cache_url_overrides` and `http.url_overrides`.
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from uuid import uuid4
+import hashlib
+import shutil
+import json
+import time
+import re
+import os
+
+from .standard import Context
+from .http import http_request, HttpError
+
+from typing import Iterable, Optional, Tuple, Dict, Union, BinaryIO
+
+
+# Upstream hosts that are cached by default.
+CACHED_HOSTS = (
+    "piston-meta.mojang.com",
+    "piston-data.mojang.com",
+    "launchermeta.mojang.com",
+    "launcher.mojang.com",
+    "resources.download.minecraft.net",
+    "libraries.minecraft.net",
+    "files.minecraftforge.net",
+    "maven.minecraftforge.net",
+    "maven.neoforged.net",
+    "meta.fabricmc.net",
+    "maven.fabricmc.net",
+    "meta.quiltmc.org",
+    "maven.quiltmc.org",
+    "meta.legacyfabric.net",
+    "repo.legacyfabric.net",
+    "repo1.maven.org",
+)
+
+# Known content-addressed layouts, where the path contains the SHA-1 of the file: 
+# resources are stored as '/<xx>/<sha1>' and piston objects and packages are stored
+# as '/v1/objects/<sha1>/<name>' or '/v1/packages/<sha1>/<name>'. Other paths may
+# contain hashes that are not the SHA-1 of the file, like the product hash of the 
+# Java runtimes manifest.
+_CONTENT_ADDRESSED_PATHS = (
+    re.compile(r"^/([0-9a-f]{2})/(\1[0-9a-f]{38})$"),
+    re.compile(r"^/v1/(objects|packages)/([0-9a-f]{40})/[^/]+$"),
+)
+
+
+def cache_url_overrides(cache_url: str, hosts: Iterable[str] = CACHED_HOSTS) -> Dict[str, str]:
+    """Return the base URL overrides to use in order to download the given upstream
+    hosts through the cache server at the given URL, the returned dictionary can be
+    used to update `http.url_overrides`.
+
+    :param cache_url: The base URL of the cache server.
+    :param hosts: The upstream hosts to download through the cache server.
+    :return: The base URL overrides.
+    """
+    cache_url = cache_url.rstrip("/")
+    return {f"https://{host}/": f"{cache_url}/{host}/" for host in hosts}
+
+
+class CacheServer(ThreadingHTTPServer):
+    """A caching HTTP server, backed by the object store of a context's main directory
+    (see `Context.objects_dir`), files are stored in the object store by their SHA-1.
+
+    Files with a known content-addressed path, containing their SHA-1, are considered
+    immutable, they are served from the object store if present, and checked against
+    this SHA-1 when fetched. Other files
+    are recorded in an index directory, and revalidated once older than the maximum 
+    age, with a conditional request if upstream gave an ETag or Last-Modified header,
+    so unchanged files are not fetched again. If the upstream server can't be reached 
+    the outdated file is still served.
+    """
+
+    daemon_threads = True
+
+    # Default duration in seconds of the cache for files that are not immutable.
+    MAX_AGE = 600
+
+    def __init__(self, address: Tuple[str, int], context: Context, *,
+        max_age: float = MAX_AGE,
+        hosts: Iterable[str] = CACHED_HOSTS,
+        scheme: str = "https"
+    ) -> None:
+        """Construct and bind the server, use `serve_forever` to run it.
+
+        :param address: The host and port to bind the server to.
+        :param context: The context whose object store is used.
+        :param max_age: Duration in seconds of the cache for files that are not immutable.
+        :param hosts: Upstream hosts that can be requested through this server.
+        :param scheme: Scheme used to request upstream hosts, mostly useful for tests.
+        """
+        super().__init__(address, _CacheRequestHandler)
+        self.context = context
+        self.index_dir = context.cache_index_dir
+        self.max_age = max_age
+        self.hosts = set(hosts)
+        self.scheme = scheme
+
+    def fetch(self, host: str, path: str) -> Tuple[Path, str]:
+        """Return the file and content type of the given upstream host and path, the file
+        is fetched from upstream if not cached or outdated.
+
+        :raises HttpError: If the file can't be fetched from upstream.
+        :raises ValueError: If the fetched file doesn't match the SHA-1 in its path.
+        """
+
+        url = f"{self.scheme}://{host}{path}"
+        content_sha1 = _content_sha1(path.split("?", 1)[0])
+
+        record_file = self.index_dir / f"{hashlib.sha1(url.encode()).hexdigest()}.json"
+        record = None
+
+        if content_sha1 is not None:
+            blob = self.blob_file(content_sha1)
+            if blob.is_file():
+                return blob, "application/octet-stream"
+        else:
+            try:
+                with record_file.open("rt") as fp:
+                    record = json.load(fp)
+                blob = self.blob_file(record["sha1"])
+                if blob.is_file() and time.time() - record["time"] < self.max_age:
+                    return blob, record["type"]
+            except (OSError, ValueError, KeyError, TypeError):
+                record = None
+
+        # Outdated files are revalidated, if still present.
+        headers = {}
+        if record is not None and self.blob_file(record["sha1"]).is_file():
+            if record.get("etag") is not None:
+                headers["If-None-Match"] = record["etag"]
+            if record.get("last_modified") is not None:
+                headers["If-Modified-Since"] = record["last_modified"]
+
+        try:
+            # The URL is not overridden, the server must not request itself.
+            res = http_request("GET", url, headers=headers, raw_url=True, cache=False, stream=True)
+        except HttpError as error:
+            if record is not None:
+                blob = self.blob_file(record["sha1"])
+                if error.res.status == 304 and blob.is_file():
+                    # Not modified, the outdated file is fresh again.
+                    record["time"] = time.time()
+                    _write_atomic(record_file, json.dumps(record).encode())
+                    return blob, record["type"]
+                # Serve the outdated file if upstream can't be reached.
+                if (error.res.status == 0 or error.res.status >= 500) and blob.is_file():
+                    return blob, record["type"]
+            raise
+
+        with res:
+
+            file = res.file
+            assert file is not None
+            sha1_hash = hashlib.sha1()
+            for chunk in iter(lambda: file.read(65536), b""):
+                sha1_hash.update(chunk)
+            
+            sha1 = sha1_hash.hexdigest()
+            if content_sha1 is not None and sha1 != content_sha1:
+                raise ValueError(f"invalid sha1 for '{url}', got {sha1}")
+
+            content_type = "application/octet-stream"
+            etag, last_modified = None, None
+            for header_name, header_value in res.headers.items():
+                header_name = header_name.lower()
+                if header_name == "content-type":
+                    content_type = header_value
+                elif header_name == "etag":
+                    etag = header_value
+                elif header_name == "last-modified":
+                    last_modified = header_value
+
+            blob = self.blob_file(sha1)
+            if not blob.is_file():
+                file.seek(0)
+                _write_atomic(blob, file)
+
+        if content_sha1 is None:
+            record = {"url": url, "sha1": sha1, "type": content_type, "time": time.time(), 
+                "etag": etag, "last_modified": last_modified}
+            _write_atomic(record_file, json.dumps(record).encode())
+
+        return blob, content_type
+
+    def blob_file(self, sha1: str) -> Path:
+        """Return the path of the given SHA-1 in the object store.
+        """
+        return self.context.objects_dir / sha1[:2] / sha1
+
+
+def _content_sha1(path: str) -> Optional[str]:
+    """Return the SHA-1 of the file at the given path if it's a known content-addressed
+    path, none otherwise.
+    """
+    for pattern in _CONTENT_ADDRESSED_PATHS:
+        match = pattern.match(path)
+        if match is not None:
+            return match.group(2)
+    return None
+
+
+def _write_atomic(file: Path, data: Union[bytes, BinaryIO]) -> None:
+    """Write the given data, or the content of the given file, to a temporary file that
+    is then renamed to the given file, so concurrent requests are never reading a 
+    partial file.
+    """
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = file.with_name(f"{file.name}.{uuid4().hex}.tmp")
+    try:
+        if isinstance(data, bytes):
+            tmp_file.write_bytes(data)
+        else:
+            with tmp_file.open("wb") as fp:
+                shutil.copyfileobj(data, fp)
+        os.replace(tmp_file, file)
+    except:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+
+class _CacheRequestHandler(BaseHTTPRequestHandler):
+    """Internal request handler of the cache server, requested paths are formatted as
+    `/<host>/<path>` and single byte ranges are supported.
+    """
+
+    server: CacheServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.serve(True)
+
+    def do_HEAD(self) -> None:
+        self.serve(False)
+
+    def serve(self, body: bool) -> None:
+
+        # Requests may use the absolute form of the target.
+        target = self.path
+        if not target.startswith("/"):
+            target = "/" + target.partition("://")[2].partition("/")[2]
+
+        host, _, path = target.lstrip("/").partition("/")
+        if host not in self.server.hosts:
+            self.send_empty(404)
+            return
+
+        try:
+            file, content_type = self.server.fetch(host, f"/{path}")
+        except HttpError as error:
+            self.send_empty(error.res.status if error.res.status >= 400 else 502)
+            return
+        except (OSError, ValueError):
+            self.send_empty(502)
+            return
+
+        size = file.stat().st_size
+        start, end = 0, size
+
+        range_header = self.headers.get("Range")
+        if range_header is not None and range_header.startswith("bytes=") and "," not in range_header:
+            range_start, _, range_end = range_header[6:].partition("-")
+            try:
+                start = int(range_start)
+                end = size if not range_end else min(size, int(range_end) + 1)
+            except ValueError:
+                start, end = 0, size
+            if start >= size or start >= end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        if body:
+            with file.open("rb") as fp:
+                fp.seek(start)
+                remaining = end - start
+                while remaining:
+                    data = fp.read(min(remaining, 65536))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
+
+    def send_empty(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
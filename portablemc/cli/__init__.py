@@ -10,17 +10,21 @@ as part of the public API.**
 from subprocess import Popen
 from pathlib import Path
 import socket
+import time
 import sys
 import io
 
-from .parse import register_arguments, RootNs, SearchNs, StartNs, LoginNs, LogoutNs, AuthBaseNs, ShowCompletionNs
+from .parse import register_arguments, RootNs, SearchNs, StartNs, LoginNs, LogoutNs, AuthBaseNs, \
+    ServeCacheNs, ShowCompletionNs
 
 from .util import format_locale_date, format_time, format_number, anonymize_email
 from .output import Output, HumanOutput, MachineOutput, OutputTable
 from .lang import get as _, lang
 
 from portablemc.util import LibrarySpecifier
-from portablemc.http import HttpError
+from portablemc.http import HttpError, HttpCache, url_overrides, override_url
+import portablemc.http
+from portablemc.cache import CacheServer, cache_url_overrides
 from portablemc.auth import AuthDatabase, AuthSession, MicrosoftAuthSession, \
     YggdrasilAuthSession, AuthError
 
@@ -32,9 +36,9 @@ from portablemc.standard import Context, Version, VersionManifest, SimpleWatcher
     JvmLoadingEvent, JvmLoadedEvent, JarFoundEvent, \
     AssetsResolveEvent, LibrariesResolvingEvent, LibrariesResolvedEvent, \
     LoggerFoundEvent, \
-    StreamRunner, XmlStreamEvent
+    StreamRunner, XmlStreamEvent, VERSION_MANIFEST_URL, JVM_META_URL
 
-from portablemc.fabric import FabricVersion, FabricResolveEvent
+from portablemc.fabric import FabricVersion, FabricResolveEvent, FABRIC_API, QUILT_API, LEGACYFABRIC_API
 from portablemc.forge import ForgeVersion, ForgeResolveEvent, ForgePostProcessingEvent, \
     ForgePostProcessedEvent, ForgeInstallError, _FORGE_REPO, _NEO_FORGE_REPO
 
@@ -58,6 +62,20 @@ DEFAULT_JVM_ARGS = [
     "-XX:G1HeapRegionSize=32M"
 ]
 
+# Mutable metadata, listing versions and loaders, that is always revalidated by the 
+# HTTP cache, so that new versions are visible as soon as published.
+HTTP_CACHE_REVALIDATED_URLS = [
+    VERSION_MANIFEST_URL,
+    JVM_META_URL,
+    FABRIC_API.api_url,
+    QUILT_API.api_url,
+    LEGACYFABRIC_API.api_url,
+    "https://files.minecraftforge.net/net/minecraftforge/forge/promotions_slim.json",
+    f"{_FORGE_REPO}/maven-metadata.xml",
+    f"{_NEO_FORGE_REPO}/maven-metadata.xml",
+    "https://maven.neoforged.net/api/maven/",
+]
+
 CommandHandler = Callable[[Any], Any]
 CommandTree = Dict[str, Union[CommandHandler, "CommandTree"]]
 
@@ -87,6 +105,13 @@ def main(args: Optional[List[str]] = None):
     ns.socket_error_tips = []
     socket.setdefaulttimeout(ns.timeout)
 
+    if ns.cache_url is not None:
+        url_overrides.update(cache_url_overrides(ns.cache_url))
+    
+    # Policies apply to the requested URLs, that may be overridden.
+    http_cache_policies = {override_url(url): 0.0 for url in HTTP_CACHE_REVALIDATED_URLS}
+    portablemc.http.http_cache = HttpCache(ns.context.http_cache_dir, policies=http_cache_policies, offline=ns.offline)
+
     # Find the command handler and run it.
     command_handlers = get_command_handlers()
     command_attr = "subcommand"
@@ -130,6 +155,7 @@ def get_command_handlers() -> CommandTree:
         "start": cmd_start,
         "login": cmd_login,
         "logout": cmd_logout,
+        "serve-cache": cmd_serve_cache,
         "show": {
             "about": cmd_show_about,
             "auth": cmd_show_auth,
@@ -244,9 +270,16 @@ def cmd_search_handler(ns: SearchNs, kind: str, table: OutputTable):
         else:
             alias = False
 
-        for version_data in ns.version_manifest.all_versions():
+        if alias:
+            # Aliases are resolved to exact identifiers, found without scanning.
+            alias_data = ns.version_manifest.get_version(search)
+            versions_data = [] if alias_data is None else [alias_data]
+        else:
+            versions_data = ns.version_manifest.all_versions()
+
+        for version_data in versions_data:
             version_id = version_data["id"]
-            if search is None or (alias and search == version_id) or (not alias and search in version_id):
+            if search is None or alias or search in version_id:
                 version = ns.context.get_version(version_id)
                 table.add(
                     version_data["type"], 
@@ -328,6 +361,12 @@ def cmd_start(ns: StartNs):
     version.demo = ns.demo
     version.resolution = ns.resolution
     version.jvm_path = ns.jvm
+    version.verify_hashes = ns.verify_hashes
+    version.max_download_rate = ns.max_rate
+    version.max_host_download_rate = ns.max_host_rate
+    for prefix, mirror in ns.mirror or []:
+        version.mirrors.setdefault(prefix, []).append(mirror)
+    version.download_pipeline = ns.pipeline
 
     if ns.server is not None:
         version.set_quick_play_multiplayer(ns.server, ns.server_port or 25565)
@@ -524,6 +563,16 @@ def cmd_logout(ns: LogoutNs):
         sys.exit(EXIT_FAILURE)
 
 
+def cmd_serve_cache(ns: ServeCacheNs):
+
+    with CacheServer((ns.host, ns.port), ns.context, max_age=ns.max_age) as server:
+        ns.out.task("INFO", "serve_cache.serving", 
+            dir=ns.context.objects_dir, 
+            url=f"http://{ns.host}:{server.server_port}/")
+        ns.out.finish()
+        server.serve_forever()
+
+
 def cmd_show_about(ns: RootNs):
     
     from .. import LAUNCHER_VERSION, LAUNCHER_AUTHORS, LAUNCHER_URL, LAUNCHER_COPYRIGHT
@@ -789,6 +838,9 @@ def prompt_microsoft_authenticate(ns: AuthBaseNs, email: str) -> Optional[Micros
     
 class StartWatcher(SimpleWatcher):
 
+    # Minimum interval in seconds between two renders of the download progress.
+    RENDER_INTERVAL = 0.1
+
     def __init__(self, ns: RootNs) -> None:
 
         def progress_task(key: str, **kwargs) -> None:
@@ -856,11 +908,12 @@ class StartWatcher(SimpleWatcher):
         self.speeds: List[float]
         self.sizes: List[int]
         self.size = 0
+        self.last_render = 0.0
 
     def download_start(self, e: DownloadStartEvent):
 
         if self.ns.verbose:
-            self.ns.out.task("INFO", "download.threads_count", count=e.threads_count)
+            self.ns.out.task("INFO", "download.threads_count", count=e.threads_count, concurrency=e.concurrency)
             self.ns.out.finish()
 
         self.entries_count = e.entries_count
@@ -868,12 +921,23 @@ class StartWatcher(SimpleWatcher):
         self.speeds = [0.0] * e.threads_count
         self.sizes = [0] * e.threads_count
         self.size = 0
+        self.last_render = 0.0
         self.ns.out.task("..", "download.start")
 
     def download_progress(self, e: DownloadProgressEvent) -> None:
 
         self.speeds[e.thread_id] = e.speed
-        self.sizes[e.thread_id] = e.size
+        if e.done:
+            self.size += e.size
+            self.sizes[e.thread_id] = 0
+        else:
+            self.sizes[e.thread_id] = e.size
+
+        # Rendering is throttled, but the last progress is always rendered.
+        now = time.monotonic()
+        if now - self.last_render < self.RENDER_INTERVAL and e.count != self.entries_count:
+            return
+        self.last_render = now
 
         speed = sum(self.speeds)
         total_count = str(self.entries_count)
@@ -885,9 +949,6 @@ class StartWatcher(SimpleWatcher):
             size=f"{format_number(self.size + sum(self.sizes))}B",
             speed=f"{format_number(speed)}B/s")
 
-        if e.done:
-            self.size += e.size
-
     def download_complete(self, e: DownloadCompleteEvent) -> None:
         self.ns.out.task("OK", None)
         self.ns.out.finish()
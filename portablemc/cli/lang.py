@@ -44,6 +44,10 @@ lang = {
         "saves, screenshots (and resources for legacy versions), it also store "
         "runtime binaries and authentication.",
     "args.timeout": "Set a global timeout (in decimal seconds) for network requests.",
+    "args.cache_url": "Download files and metadata from Mojang, Forge, Fabric and Quilt "
+        "servers through the cache server at the given URL (see serve-cache).",
+    "args.offline": "Never access the network, metadata previously requested are used "
+        "from the cache even if outdated.",
     "args.output": "Set the output format of the launcher, defaults to human-color, human if not a TTY.",
     "args.output.comp.human-color": "Human readable output with color.",
     "args.output.comp.human": "Human readable output.",
@@ -104,6 +108,21 @@ lang = {
     "args.start.jvm_args": "Change the default JVM arguments.",
     "args.start.no_fix": "Flag that globally disable fixes (proxy for old versions), "
         "enabled by default.",
+    "args.start.verify_hashes": "Check the SHA-1 of all installed files, instead of only "
+        "their size, invalid files are downloaded again.",
+    "args.start.max_rate": "Limit the total download bandwidth, in bytes per second, "
+        "with an optional k, m or g unit (e.g. 500k, 2m).",
+    "args.start.max_rate.invalid": "invalid rate '{given}', expected <bytes per second>[k|m|g]",
+    "args.start.max_host_rate": "Limit the download bandwidth from each host, in bytes "
+        "per second, with an optional k, m or g unit (e.g. 500k, 2m).",
+    "args.start.mirror": "Add a mirror for all downloads starting with the given URL, "
+        "the mirror URL replaces this prefix. The fastest URL is used, and downloads "
+        "fail over to other URLs on errors. Can be given multiple times, in order of "
+        "preference (e.g. https://libraries.minecraft.net/=https://mirror.example/libraries/).",
+    "args.start.mirror.invalid": "invalid mirror '{given}', expected <url>=<mirror url>",
+    "args.start.pipeline": "Request up to the given number of small files, such as assets, "
+        "at once on each connection (HTTP/1.1 pipelining). Files that fail are downloaded "
+        "again individually.",
     "args.start.fabric_prefix": "Change the prefix of the version ID when starting with Fabric (<prefix>-<vanilla-version>-<loader-version>).",
     "args.start.legacyfabric_prefix": "Change the prefix of the version ID when starting with LegacyFabric (<prefix>-<vanilla-version>-<loader-version>).",
     "args.start.quilt_prefix": "Change the prefix of the version ID when starting with Quilt (<prefix>-<vanilla-version>-<loader-version>).",
@@ -133,6 +152,16 @@ lang = {
     "args.login": "Login into your account and save the session.",
     # Args logout
     "args.logout": "Logout and invalidate a session.",
+    # Args serve-cache
+    "args.serve_cache": "Run a caching HTTP server to share downloads between launchers.",
+    "args.serve_cache._": "Run a caching HTTP server, backed by the main directory's object "
+        "store, that can be used by other launchers with the --cache-url argument. Files "
+        "are requested with the upstream host prepended to their path, for example "
+        "http://<host>:<port>/libraries.minecraft.net/<path>.",
+    "args.serve_cache.host": "The host to bind the server to (default to 127.0.0.1, use 0.0.0.0 to serve other machines).",
+    "args.serve_cache.port": "The port to bind the server to (default to 8080).",
+    "args.serve_cache.max_age": "Duration in seconds before fetching again files that are "
+        "not content-addressed, like version manifests (default to 600).",
     # Args show
     "args.show": "Show, debug and generate data unrelated to the game.",
     "args.show.about": "Display authors, version and license of PortableMC.",
@@ -191,6 +220,8 @@ lang = {
     "logout.microsoft.pending": "Logging out {email} from Microsoft...",
     "logout.success": "Logged out {email}",
     "logout.unknown_session": "No session for {email}",
+    # Command serve-cache
+    "serve_cache.serving": "Serving {dir} on {url}, press Ctrl+C to stop",
     # Command start
     "start.global_version": "Global version: {kind} {version} {remaining}",
     "start.version.invalid_id": "Invalid version id, expected: {expected}",
@@ -245,12 +276,15 @@ lang = {
     f"start.forge.install_error.{ForgeInstallError.INSTALL_PROFILE_NOT_FOUND}": "Install profile not found in the forge installer.",
     f"start.forge.install_error.{ForgeInstallError.VERSION_METADATA_NOT_FOUND}": "Version metadata not found in the forge installer.",
     # Pretty download
-    "download.threads_count": "Download threads count: {count}",
+    "download.threads_count": "Download threads count: {count} (initially active: {concurrency})",
     "download.start": "Download starting...",
     "download.progress": "Download: {count}/{total_count} {size:>8} @ {speed}",
     "download.error": "{name}: {message}",
     f"download.error.{DownloadResultError.CONNECTION}": "Connection error",
     f"download.error.{DownloadResultError.NOT_FOUND}": "Not found",
+    f"download.error.{DownloadResultError.THROTTLED}": "Throttled by the server",
+    f"download.error.{DownloadResultError.SERVER_ERROR}": "Server error",
+    f"download.error.{DownloadResultError.HTTP_ERROR}": "Unexpected HTTP status",
     f"download.error.{DownloadResultError.INVALID_SIZE}": "Invalid size",
     f"download.error.{DownloadResultError.INVALID_SHA1}": "Invalid SHA1",
     # Auth common
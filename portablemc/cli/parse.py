@@ -20,6 +20,8 @@ class RootNs:
     main_dir: Optional[Path]
     work_dir: Optional[Path]
     timeout: float
+    cache_url: Optional[str]
+    offline: bool
     out_kind: str
     verbose: int
     # Initialized by main function after argument parsing.
@@ -47,6 +49,11 @@ class StartNs(AuthBaseNs):
     jvm: Optional[Path]
     jvm_args: Optional[str]
     no_fix: bool
+    verify_hashes: bool
+    max_rate: Optional[int]
+    max_host_rate: Optional[int]
+    mirror: Optional[List[Tuple[str, str]]]
+    pipeline: Optional[int]
     fabric_prefix: str
     legacyfabric_prefix: str
     quilt_prefix: str
@@ -71,6 +78,11 @@ class LoginNs(AuthBaseNs):
 class LogoutNs(AuthBaseNs):
     email_or_username: str
 
+class ServeCacheNs(RootNs):
+    host: str
+    port: int
+    max_age: float
+
 class ShowCompletionNs(RootNs):
     shell: str
 
@@ -98,6 +110,8 @@ def register_arguments() -> ArgumentParser:
     parser.add_argument("--main-dir", help=_("args.main_dir"), type=type_path_dir)
     parser.add_argument("--work-dir", help=_("args.work_dir"), type=type_path_dir)
     parser.add_argument("--timeout", help=_("args.timeout"), type=float)
+    parser.add_argument("--cache-url", help=_("args.cache_url"), metavar="URL")
+    parser.add_argument("--offline", help=_("args.offline"), action="store_true")
 
     output_choices = get_outputs()
     output_default = "human-color" if sys.stdout.isatty() else "human"
@@ -117,6 +131,7 @@ def register_subcommands(subparsers) -> None:
     register_login_arguments(subparsers.add_parser("login", help=_("args.login"), add_help=False))
     register_logout_arguments(subparsers.add_parser("logout", help=_("args.logout"), add_help=False))
     register_show_arguments(subparsers.add_parser("show", help=_("args.show"), add_help=False))
+    register_serve_cache_arguments(subparsers.add_parser("serve-cache", help=_("args.serve_cache"), add_help=False))
 
 
 def register_search_arguments(parser: ArgumentParser) -> None:
@@ -144,6 +159,11 @@ def register_start_arguments(parser: ArgumentParser) -> None:
     parser.add_argument("--jvm", help=_("args.start.jvm"), type=type_path)
     parser.add_argument("--jvm-args", help=_("args.start.jvm_args"), metavar="ARGS")
     parser.add_argument("--no-fix", help=_("args.start.no_fix"), action="store_true")
+    parser.add_argument("--verify-hashes", help=_("args.start.verify_hashes"), action="store_true")
+    parser.add_argument("--max-rate", help=_("args.start.max_rate"), type=type_rate, metavar="RATE")
+    parser.add_argument("--max-host-rate", help=_("args.start.max_host_rate"), type=type_rate, metavar="RATE")
+    parser.add_argument("--mirror", help=_("args.start.mirror"), action="append", type=type_mirror, metavar="URL=MIRROR")
+    parser.add_argument("--pipeline", help=_("args.start.pipeline"), type=int, metavar="DEPTH")
     parser.add_argument("--fabric-prefix", help=_("args.start.fabric_prefix"), default="fabric", metavar="PREFIX")
     parser.add_argument("--quilt-prefix", help=_("args.start.quilt_prefix"), default="quilt", metavar="PREFIX")
     parser.add_argument("--legacyfabric-prefix", help=_("args.start.legacyfabric_prefix"), default="legacyfabric", metavar="PREFIX")
@@ -180,6 +200,14 @@ def register_logout_arguments(parser: ArgumentParser) -> None:
     parser.add_argument("email_or_username", type=type_email_or_username)
 
 
+def register_serve_cache_arguments(parser: ArgumentParser) -> None:
+    parser.description = _("args.serve_cache._")
+    register_common_help(parser)
+    parser.add_argument("--host", help=_("args.serve_cache.host"), default="127.0.0.1")
+    parser.add_argument("--port", help=_("args.serve_cache.port"), type=int, default=8080)
+    parser.add_argument("--max-age", help=_("args.serve_cache.max_age"), type=float, default=600, metavar="SECONDS")
+
+
 def register_show_arguments(parser: ArgumentParser) -> None:
     register_common_help(parser)
     subparsers = parser.add_subparsers(title="subcommands", dest="show_subcommand")
@@ -238,6 +266,25 @@ def type_resolution(s: str) -> Tuple[int, int]:
     else:
         raise ArgumentTypeError(_("args.start.resolution.invalid", given=s))
 
+def type_rate(s: str) -> int:
+    units = {"k": 1000, "m": 1000000, "g": 1000000000}
+    factor = units.get(s[-1:].lower(), 1)
+    try:
+        rate = int(float(s[:-1] if factor != 1 else s) * factor)
+    except ValueError:
+        rate = 0
+    if rate > 0:
+        return rate
+    else:
+        raise ArgumentTypeError(_("args.start.max_rate.invalid", given=s))
+
+def type_mirror(s: str) -> Tuple[str, str]:
+    prefix, sep, mirror = s.partition("=")
+    if sep and prefix and mirror:
+        return (prefix, mirror)
+    else:
+        raise ArgumentTypeError(_("args.start.mirror.invalid", given=s))
+
 def type_email_or_username(s: str) -> str:
     return s
 
@@ -1,23 +1,50 @@
 """Definition of the optimized download task.
 """
 
-from http.client import HTTPConnection, HTTPSConnection, HTTPException
-from threading import Thread
+from http.client import HTTPConnection, HTTPSConnection, HTTPResponse, HTTPException
+from http.client import BadStatusLine, IncompleteRead, RemoteDisconnected
+from threading import Thread, Condition, Lock
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
 from pathlib import Path
-from queue import Queue
+from uuid import uuid4
+from queue import Queue, Empty
+from collections import deque
 import urllib.parse
+import random
 import hashlib
+import asyncio
+import io
+import socket
+import stat
+import json
 import time
-import ssl
+import os
 
-from typing import Optional, Dict, List, Tuple, Union, Iterator
+from typing import Optional, Dict, List, Set, Tuple, Union, Iterator, AsyncIterator, Deque
+
+from .util import calc_input_sha1, calc_file_sha1, link_file, FileLock
+from .http import override_url, ssl_context
 
 
 class DownloadEntry:
     """A download entry for the download task.
+
+    Entries with higher priority are downloaded first, entries with the same priority 
+    are downloaded by descending size. Entries can also be part of a named group, the
+    download yields a group result once all entries of a group are done.
+
+    Mirror URLs of the same file can be given, ordered by preference, the URL with the
+    lowest measured latency is selected, and the download fails over to other URLs on
+    errors.
     """
+
+    PRIORITY_LOW = -1
+    PRIORITY_NORMAL = 0
+    PRIORITY_HIGH = 1
     
-    __slots__ = "url", "size", "sha1", "dst", "name", "executable"
+    __slots__ = "url", "size", "sha1", "dst", "name", "executable", "priority", "group", "mirrors"
 
     def __init__(self, 
         url: str, 
@@ -25,7 +52,10 @@ class DownloadEntry:
         size: Optional[int] = None, 
         sha1: Optional[str] = None, 
         name: Optional[str] = None,
-        executable: bool = False
+        executable: bool = False,
+        priority: int = PRIORITY_NORMAL,
+        group: Optional[str] = None,
+        mirrors: Optional[List[str]] = None
     ) -> None:
         self.url = url
         self.dst = dst
@@ -33,6 +63,9 @@ class DownloadEntry:
         self.sha1 = sha1
         self.name = url if name is None else name
         self.executable = executable
+        self.priority = priority
+        self.group = group
+        self.mirrors = [] if mirrors is None else mirrors
 
     def __repr__(self) -> str:
         return f"<DownloadEntry {self.name}>"
@@ -54,16 +87,30 @@ class _DownloadEntry:
     unsupported URL schemes.
     """
 
-    __slots__ = "https", "host", "port", "entry"
+    __slots__ = "https", "host", "port", "entry", "segment", "reuse", "blob", "mirrors"
 
-    def __init__(self, https: bool, host: str, port: Optional[int], entry: DownloadEntry) -> None:
+    # Minimum size of a single read.
+    MIN_READ_SIZE = 16384
+
+    def __init__(self, 
+        https: bool, 
+        host: str, 
+        port: Optional[int], 
+        entry: DownloadEntry, 
+        segment: "Optional[_DownloadSegment]" = None
+    ) -> None:
         self.https = https
         self.host = host
         self.port = port
         self.entry = entry
+        self.segment = segment
+        self.reuse = False
+        self.blob: Optional[Path] = None
+        # Alternative URLs that have not been tried yet.
+        self.mirrors: List[str] = []
     
     @classmethod
-    def from_entry(cls, entry: DownloadEntry) -> "_DownloadEntry":
+    def from_entry(cls, entry: DownloadEntry, segment: "Optional[_DownloadSegment]" = None) -> "_DownloadEntry":
 
         # We only support HTTP/HTTPS
         url_parsed = urllib.parse.urlparse(entry.url)
@@ -72,9 +119,56 @@ class _DownloadEntry:
         
         return cls(
             url_parsed.scheme == "https",
-            url_parsed.netloc,
+            url_parsed.hostname or "",
             url_parsed.port,
-            entry)
+            entry,
+            segment)
+    
+    def redirect(self, url: str, mirrors: Optional[List[str]] = None) -> "_DownloadEntry":
+        """Return the same entry to be downloaded from the given redirected url, the
+        remaining mirrors can be changed.
+        """
+
+        entry = self.entry
+        redirect_entry = DownloadEntry(
+            urllib.parse.urljoin(entry.url, url), 
+            entry.dst, 
+            size=entry.size, 
+            sha1=entry.sha1, 
+            name=entry.name,
+            executable=entry.executable,
+            priority=entry.priority,
+            group=entry.group,
+            mirrors=entry.mirrors)
+        
+        raw_entry = _DownloadEntry.from_entry(redirect_entry, self.segment)
+        raw_entry.reuse = self.reuse
+        raw_entry.blob = self.blob
+        raw_entry.mirrors = self.mirrors if mirrors is None else mirrors
+        return raw_entry
+    
+    def target(self) -> Path:
+        """Return the path where the entry is actually downloaded to, this is the blob
+        file in the store if relevant, the destination otherwise.
+        """
+        return self.entry.dst if self.blob is None else self.blob
+
+    def read_size(self, buffer_cap: int) -> int:
+        """Return the size of reads for this entry given the buffer capacity, reads are
+        only as large as the entry, or the segment, when its size is known.
+        """
+        if self.segment is not None:
+            size = self.segment.end + 1 - self.segment.start
+        elif self.entry.size is not None:
+            size = self.entry.size
+        else:
+            return buffer_cap
+        return max(self.MIN_READ_SIZE, min(buffer_cap, size))
+
+    def open_file(self, sync: "_DownloadSync") -> "Union[_DownloadFile, _DownloadSegment]":
+        """Return the file object where this entry's download is written.
+        """
+        return _DownloadFile(self, sync) if self.segment is None else self.segment
 
 
 class DownloadResult:
@@ -104,6 +198,9 @@ class DownloadResultError(DownloadResult):
 
     CONNECTION = "connection"
     NOT_FOUND = "not_found"
+    THROTTLED = "throttled"
+    SERVER_ERROR = "server_error"
+    HTTP_ERROR = "http_error"
     INVALID_SIZE = "invalid_size"
     INVALID_SHA1 = "invalid_sha1"
 
@@ -115,22 +212,430 @@ class DownloadResultError(DownloadResult):
         self.origin = origin
 
 
+class DownloadResultGroup(DownloadResult):
+    """Subclass of result when all entries of a group have a final result, the thread 
+    and entry are the ones of the last entry of the group, the number of entries of the
+    group that have failed is given. This result is not counted as an entry's result.
+    """
+    __slots__ = "group", "errors_count"
+    def __init__(self, thread_id: int, entry: DownloadEntry, group: str, errors_count: int) -> None:
+        super().__init__(thread_id, entry)
+        self.group = group
+        self.errors_count = errors_count
+
+
+class RetryPolicy:
+    """The policy used to retry the download of an entry after an error, the delay 
+    before each retry grows exponentially and is randomized (full jitter) so threads 
+    retrying at the same time don't hit the server together. A delay requested by the
+    server with a `Retry-After` header is honored, up to the maximum delay.
+
+    The retry budget is the total number of retries allowed for a whole download, it's
+    shared by all threads, so a failing server doesn't get retried for every entry.
+    Entries that are not found, or get another client error, are never retried.
+    """
+
+    __slots__ = "max_tries", "base_delay", "max_delay", "jitter", "budget"
+
+    # Error codes that are retried.
+    RETRY_CODES = (
+        DownloadResultError.CONNECTION,
+        DownloadResultError.THROTTLED,
+        DownloadResultError.SERVER_ERROR,
+        DownloadResultError.INVALID_SIZE,
+        DownloadResultError.INVALID_SHA1,
+    )
+
+    def __init__(self, *,
+        max_tries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        jitter: bool = True,
+        budget: Optional[int] = None
+    ) -> None:
+        """
+        :param max_tries: Maximum number of tries for a single entry.
+        :param base_delay: Delay in seconds before the first retry, doubled on each retry.
+        :param max_delay: Maximum delay in seconds before a retry.
+        :param jitter: Set to false to disable the randomization of delays.
+        :param budget: Maximum number of retries for a whole download, unlimited if none.
+        """
+        self.max_tries = max_tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.budget = budget
+
+    def delay(self, try_num: int, retry_after: Optional[float] = None) -> float:
+        """Return the delay in seconds before retrying after the given try.
+
+        :param try_num: The number of the try that has failed, starting at 1.
+        :param retry_after: The delay requested by the server, if any.
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (try_num - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+
+class VerifyIndex:
+    """A persistent index of verified files, used to avoid checking every file on every
+    verification. Each file is recorded with its size, modification time, inode, the 
+    SHA-1 it has been verified against (if any) and the modification time of its parent
+    directory when recorded.
+
+    A recorded file is considered unchanged without being accessed if its directory's
+    modification time is unchanged, directories are only checked once per index. If the
+    directory has been modified, the file is checked again with its status, and the
+    verified SHA-1 is kept if the status is unchanged.
+    """
+
+    __slots__ = "file", "files", "dirs", "dirty"
+
+    def __init__(self, file: Optional[Path] = None) -> None:
+        """Construct the index and load it from the given file, if given.
+        """
+        self.file = file
+        self.files: Dict[str, list] = {}
+        self.dirs: Dict[str, Optional[int]] = {}
+        self.dirty = False
+        if file is not None:
+            self.load()
+
+    def load(self) -> None:
+        """Load the index from its file, ignoring any error (the index is then empty).
+        """
+        assert self.file is not None, "no index file"
+        try:
+            with self.file.open("rt") as fp:
+                data = json.load(fp)
+            files = data["files"]
+            if isinstance(files, dict):
+                self.files = files
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def save(self) -> None:
+        """Save the index to its file if it has been modified, the file is atomically 
+        replaced. Like when loading, any error is ignored (the index is then kept
+        modified), the index may not be writable in a read-only directory.
+        """
+        assert self.file is not None, "no index file"
+        if not self.dirty:
+            return
+        tmp_file = self.file.with_name(f"{self.file.name}.{uuid4().hex}.tmp")
+        try:
+            self.file.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_file.open("wt") as fp:
+                json.dump({"files": self.files}, fp, separators=(",", ":"))
+            os.replace(tmp_file, self.file)
+        except OSError:
+            try:
+                tmp_file.unlink()
+            except OSError:
+                pass
+            return
+        self.dirty = False
+
+    def _dir_mtime(self, dir: Path) -> Optional[int]:
+        key = str(dir)
+        try:
+            return self.dirs[key]
+        except KeyError:
+            try:
+                mtime = dir.stat().st_mtime_ns
+            except OSError:
+                mtime = None
+            self.dirs[key] = mtime
+            return mtime
+
+    def verify(self, file: Path, size: Optional[int], sha1: Optional[str]) -> bool:
+        """Verify that the given file exists and has the given size, if known. If the 
+        file is known to have been verified against another SHA-1 than the given one,
+        the verification fails.
+        """
+
+        dir_mtime = self._dir_mtime(file.parent)
+        if dir_mtime is None:
+            return False
+
+        key = str(file)
+        record = self.files.get(key)
+
+        if record is not None and record[4] == dir_mtime:
+            if (size is None or record[0] == size) and (sha1 is None or record[3] is None or record[3] == sha1):
+                return True
+        
+        try:
+            st = file.stat()
+        except OSError:
+            if self.files.pop(key, None) is not None:
+                self.dirty = True
+            return False
+        
+        if not stat.S_ISREG(st.st_mode) or (size is not None and st.st_size != size):
+            return False
+
+        # The verified SHA-1 is kept if the file is unchanged.
+        verified_sha1 = None
+        if record is not None and record[:3] == [st.st_size, st.st_mtime_ns, st.st_ino]:
+            verified_sha1 = record[3]
+            if sha1 is not None and verified_sha1 is not None and verified_sha1 != sha1:
+                return False
+        
+        self.files[key] = [st.st_size, st.st_mtime_ns, st.st_ino, verified_sha1, dir_mtime]
+        self.dirty = True
+        return True
+
+    def update(self, files: "List[Tuple[Path, Optional[str]]]") -> None:
+        """Record the given files, with the SHA-1 they have been verified against, if
+        any. Directories' modification times are checked again because these files are
+        expected to have been just written.
+        """
+
+        self.dirs.clear()
+        for file, sha1 in files:
+            dir_mtime = self._dir_mtime(file.parent)
+            try:
+                st = file.stat()
+            except OSError:
+                continue
+            self.files[str(file)] = [st.st_size, st.st_mtime_ns, st.st_ino, sha1, dir_mtime]
+            self.dirty = True
+
+
+class DownloadJournal:
+    """A persistent journal of a download, used to resume it if the process is killed
+    before verified and downloaded files are saved to the index. The planned entries 
+    are recorded when the download starts, and each downloaded entry is then appended
+    to the journal as soon as it's completed.
+
+    An entry recorded as downloaded, with the same size and SHA-1, is known to be valid
+    and an entry only planned is known to be missing, so their files don't need to be
+    checked again. The journal should be cleared once the download's files are saved
+    to the index.
+
+    The journal file may be shared by multiple processes, it's only written by the 
+    process holding its lock from the start of a download to its end, the download of
+    other processes is not journaled meanwhile.
+    """
+
+    __slots__ = "file", "entries", "fp", "lock"
+
+    PLANNED = "plan"
+    DONE = "done"
+
+    def __init__(self, file: Path) -> None:
+        """Construct the journal and load it from the given file, if existing.
+        """
+        self.file = file
+        self.entries: Dict[str, list] = {}
+        self.fp = None
+        self.lock: Optional[FileLock] = None
+        self.load()
+
+    def load(self) -> None:
+        """Load the journal from its file, ignoring invalid lines, the last line may be
+        truncated if the process has been killed while writing it.
+        """
+        try:
+            with self.file.open("rt") as fp:
+                for line in fp:
+                    try:
+                        state, dst, size, sha1 = json.loads(line)
+                    except (ValueError, TypeError):
+                        continue
+                    if state in (self.PLANNED, self.DONE) and isinstance(dst, str):
+                        self.entries[dst] = [state, size, sha1]
+        except OSError:
+            pass
+
+    def state(self, entry: DownloadEntry) -> Optional[str]:
+        """Return the recorded state of the given entry, planned or done, none if not 
+        recorded or recorded with another size or SHA-1.
+        """
+        record = self.entries.get(str(entry.dst))
+        if record is not None and record[1:] == [entry.size, entry.sha1]:
+            return record[0]
+        return None
+
+    def plan(self, entries: List[DownloadEntry]) -> None:
+        """Start the journal of a new download of the given entries, entries previously
+        recorded as done are kept. The file is atomically replaced.
+        """
+
+        self.close()
+        for entry in entries:
+            self.entries[str(entry.dst)] = [self.PLANNED, entry.size, entry.sha1]
+
+        if not self._acquire():
+            return
+
+        tmp_file = self.file.with_name(f"{self.file.name}.{uuid4().hex}.tmp")
+        with tmp_file.open("wt") as fp:
+            for dst, (state, size, sha1) in self.entries.items():
+                fp.write(json.dumps([state, dst, size, sha1], separators=(",", ":")))
+                fp.write("\n")
+        os.replace(tmp_file, self.file)
+        self.fp = self.file.open("at")
+
+    def record(self, entry: DownloadEntry) -> None:
+        """Record the given entry as done, the line is flushed to the system right away
+        so it's not lost if the process is killed.
+        """
+        self.entries[str(entry.dst)] = [self.DONE, entry.size, entry.sha1]
+        if self.fp is not None:
+            self.fp.write(json.dumps([self.DONE, str(entry.dst), entry.size, entry.sha1], separators=(",", ":")))
+            self.fp.write("\n")
+            self.fp.flush()
+
+    def close(self) -> None:
+        """Close the journal file if opened and release its lock, the journal is kept.
+        """
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+        if self.lock is not None:
+            self.lock.release()
+            self.lock = None
+
+    def clear(self) -> None:
+        """Close and remove the journal, once its entries are no longer needed, unless 
+        another process is writing it.
+        """
+        self.close()
+        self.entries.clear()
+        if self._acquire():
+            try:
+                self.file.unlink()
+            except FileNotFoundError:
+                pass
+            self.close()
+
+    def _acquire(self) -> bool:
+        """Acquire the lock of the journal file without blocking, return false if held 
+        by another process, or if it can't be created.
+        """
+        lock = FileLock(self.file.with_name(f"{self.file.name}.lock"))
+        try:
+            if not lock.acquire(False):
+                return False
+        except OSError:
+            return False
+        self.lock = lock
+        return True
+
+
 class DownloadList:
     """A download list, composed of entries that can be downloaded all at once in batch
     with multithreading.
-    """
 
-    __slots__ = "entries", "count", "size"
+    The engine used to download entries can be selected, the default engine run each
+    download slot in its own OS thread, the asyncio engine run all download slots in a
+    single thread with an asyncio event loop.
+
+    Files are downloaded to a temporary file in the same directory and atomically 
+    renamed to their destination once checked. The fsync policy can be selected to 
+    flush each file to the disk before renaming it, or to flush all files of the list, 
+    and their directories, in a single batch at the end of the download. By default 
+    files are not flushed and this is left to the operating system.
+
+    By default, each entry is locked with a lock file while downloaded, so multiple
+    processes downloading the same file in the same directory are not downloading it 
+    twice, entries added with verification are reused if already downloaded by another
+    process once the lock is acquired.
+
+    A store directory can be given, in such case entries with a known sha1 are all 
+    downloaded to a single blob file named by their sha1 in this store, and then linked
+    to their destination (see `util.link_file`). Entries having the same content are
+    therefore downloaded once and stored once.
+
+    A verification index can be given, in such case it's used to verify entries when
+    added and it's updated with downloaded entries (see `VerifyIndex`).
+
+    A journal can also be given, in such case entries to verify that the journal knows
+    to be downloaded or missing are not checked, the entries of each download are 
+    planned in the journal and recorded once downloaded (see `DownloadJournal`).
 
-    def __init__(self):
+    By default, the verification of entries only checks their size, if hashes should be
+    verified, the sha1 of verified entries are checked later in parallel, with a call to 
+    `check_hashes`, only entries with an invalid sha1 are then added.
+
+    The bandwidth can be limited, in bytes per second, both globally and for each host,
+    the limits are shared by all threads of a download.
+
+    Mirrors can be given for any URL prefix, each mirror being another prefix to use 
+    instead, they are appended in order to the mirrors of each added entry with an URL
+    starting with this prefix. Base URLs overridden for all HTTP requests are also 
+    applied to added entries (see `http.url_overrides`).
+
+    Failed entries are retried with the given retry policy (see `RetryPolicy`), the
+    retry budget of the policy applies to each call to `download`.
+
+    With the thread engine, small entries of the same host can be pipelined: up to the
+    given number of requests are sent on a single connection before reading their 
+    responses, this avoids a round trip per entry. Entries that fail in a pipeline are
+    downloaded again individually.
+    """
+
+    ENGINE_THREAD = "thread"
+    ENGINE_ASYNCIO = "asyncio"
+
+    # Entries larger than this size are split in segments of at least this size.
+    SEGMENT_SIZE = 8 * 1024 * 1024
+    # Default minimum interval between partial progress of a thread.
+    PROGRESS_INTERVAL = 0.1
+    # Default size of the read buffer of a thread, reads are smaller for small entries.
+    BUFFER_SIZE = 1024 * 1024
+    # Entries up to this size can be pipelined.
+    PIPELINE_MAX_SIZE = 65536
+
+    FSYNC_NONE = "none"
+    FSYNC_FILE = "file"
+    FSYNC_BATCH = "batch"
+
+    __slots__ = "entries", "count", "size", "engine", "fsync", "lock", "store", "index", \
+        "verify_hashes", "pending_hashes", "max_rate", "max_host_rate", "mirrors", "retry", \
+        "pipeline", "journal"
+
+    def __init__(self, *, 
+        engine: str = ENGINE_THREAD, 
+        fsync: str = FSYNC_NONE, 
+        lock: bool = True,
+        store: Optional[Path] = None,
+        index: Optional[VerifyIndex] = None,
+        verify_hashes: bool = False,
+        max_rate: Optional[int] = None,
+        max_host_rate: Optional[int] = None,
+        mirrors: Optional[Dict[str, List[str]]] = None,
+        retry: Optional[RetryPolicy] = None,
+        pipeline: Optional[int] = None,
+        journal: Optional[DownloadJournal] = None
+    ):
         self.entries: List[_DownloadEntry] = []
         self.count = 0
         self.size = 0
+        self.engine = engine
+        self.fsync = fsync
+        self.lock = lock
+        self.store = store
+        self.index = index
+        self.verify_hashes = verify_hashes
+        self.pending_hashes: List[Tuple[DownloadEntry, Path]] = []
+        self.max_rate = max_rate
+        self.max_host_rate = max_host_rate
+        self.mirrors = {} if mirrors is None else mirrors
+        self.retry = RetryPolicy() if retry is None else retry
+        self.pipeline = pipeline
+        self.journal = journal
     
     def clear(self) -> None:
         """Clear the download entry, removing all entries and computed count/size.
         """
         self.entries.clear()
+        self.pending_hashes.clear()
         self.count = 0
         self.size = 0
 
@@ -139,292 +644,2241 @@ class DownloadList:
 
         :param entry: The entry to add.
         :param verify: Set to true in order to check if the file exists and has the same
-        size has the given entry, in such case the entry is not added.
+        size has the given entry, in such case the entry is not added. If the entry's 
+        blob is already present in the store, it's linked and the entry is not added.
         """
 
-        if verify and entry.dst.is_file() and (entry.size is None or entry.size == entry.dst.stat().st_size):
+        if verify and self._verify_entry(entry):
+            if self.verify_hashes and entry.sha1 is not None:
+                self.pending_hashes.append((entry, entry.dst))
             return
         
-        self.entries.append(_DownloadEntry.from_entry(entry))
+        raw_entry = _DownloadEntry.from_entry(entry)
+        raw_entry.reuse = verify
+        raw_entry.mirrors = list(entry.mirrors)
+
+        # The entry is downloaded from its overridden URL, if any.
+        url = override_url(entry.url)
+        if url != entry.url:
+            raw_entry = raw_entry.redirect(url)
+
+        for prefix, prefix_mirrors in self.mirrors.items():
+            if entry.url.startswith(prefix):
+                suffix = entry.url[len(prefix):]
+                raw_entry.mirrors.extend(f"{mirror}{suffix}" for mirror in prefix_mirrors)
+
+        if self.store is not None and entry.sha1 is not None:
+            blob = self.store / entry.sha1[:2] / entry.sha1
+            if blob != entry.dst:
+                # If the blob is already in the store, just link it.
+                if verify and self._verify(blob, entry.size, entry.sha1):
+                    if self.verify_hashes:
+                        self.pending_hashes.append((entry, blob))
+                    else:
+                        link_file(blob, entry.dst)
+                    return
+                raw_entry.blob = blob
+
+        self.entries.append(raw_entry)
         self.count += 1
         if entry.size is not None:
             self.size += entry.size
     
+    def check_hashes(self, threads_count: int) -> None:
+        """Check the sha1 of all entries pending hash verification, files are hashed in 
+        parallel, entries with invalid files are added to this list to be downloaded 
+        again. This has no effect if hashes verification is disabled.
+
+        :param threads_count: The number of threads used to hash files.
+        """
+
+        pending = self.pending_hashes
+        if not pending:
+            return
+        
+        self.pending_hashes = []
+
+        def check(item: Tuple[DownloadEntry, Path]) -> bool:
+            entry, file = item
+            try:
+                return calc_file_sha1(file) == entry.sha1
+            except OSError:
+                return False
+
+        with ThreadPoolExecutor(max(1, threads_count)) as executor:
+            valid_list = list(executor.map(check, pending))
+        
+        verified = []
+        for (entry, file), valid in zip(pending, valid_list):
+            if valid:
+                verified.append((file, entry.sha1))
+                if file != entry.dst:
+                    link_file(file, entry.dst)
+            else:
+                self.add(entry)
+        
+        if self.index is not None:
+            self.index.update(verified)
+
+    def set_group(self, group: str, priority: int = DownloadEntry.PRIORITY_HIGH) -> None:
+        """Move all entries currently added, including entries pending hash verification,
+        to the given group with the given priority. This is used to be notified when 
+        these entries are downloaded, while downloading them with entries added later.
+
+        :param group: The name of the group.
+        :param priority: The priority given to the entries of the group.
+        """
+        for entry in (*(raw_entry.entry for raw_entry in self.entries), *(entry for entry, _ in self.pending_hashes)):
+            entry.group = group
+            entry.priority = max(entry.priority, priority)
+    
+    def groups(self) -> Set[str]:
+        """Return the set of groups that have at least one entry to download.
+        """
+        return {raw_entry.entry.group for raw_entry in self.entries if raw_entry.entry.group is not None}
+
+    def _verify_entry(self, entry: DownloadEntry) -> bool:
+        if self.journal is not None:
+            state = self.journal.state(entry)
+            if state is not None:
+                return state == DownloadJournal.DONE
+        return self._verify(entry.dst, entry.size, entry.sha1)
+
+    def _verify(self, file: Path, size: Optional[int], sha1: Optional[str]) -> bool:
+        if self.index is not None:
+            return self.index.verify(file, size, sha1)
+        return _check_file(file, size, None)
+    
     def download(self, threads_count: int, *,
-        partial_progress: bool = False
+        partial_progress: bool = False,
+        progress_interval: float = PROGRESS_INTERVAL,
+        max_host_connections: Optional[int] = None,
+        segment_size: Optional[int] = SEGMENT_SIZE,
+        concurrency: Optional[int] = None,
+        buffer_size: int = BUFFER_SIZE
     ) -> Iterator[Tuple[int, DownloadResult]]:
         """Execute the download.
         
-        :param threads_count: The number of threads to run the download on.
+        :param threads_count: The number of threads to run the download on, when using
+        the asyncio engine, this is the number of concurrent download slots running on
+        the event loop, which is also the maximum number of opened connections.
         :param partial_progress: Set to true to be able to receive partial progress update
         on unfinished files, if this is false, DownloadResultProgress.done should be true.
+        :param progress_interval: Minimum interval in seconds between two partial progress
+        updates of a single thread, updates waiting in the results queue are also merged 
+        so only the last partial progress of each thread is yielded, results of finished 
+        entries are always yielded.
+        :param max_host_connections: Maximum number of connections opened to a single host
+        at the same time, connections are shared by all threads and idle connections are
+        reused, by default it's only limited by the number of threads.
+        :param segment_size: Entries with a known size larger than this size are split in
+        byte ranges, of at least this size, that are downloaded concurrently on multiple
+        threads and written in place, the file is checked once all segments are done. 
+        Set to none to disable segmented download.
+        :param concurrency: Set to enable the adaptive concurrency, this is the initial
+        number of threads actively downloading, the number of active threads is then
+        adjusted between 1 and `threads_count` depending on the measured throughput and
+        connection errors. By default all threads are always active.
+        :param buffer_size: Size of the read buffer of each thread, this is the maximum
+        size of a single read, smaller reads are used for entries smaller than this size.
         :return: This function returns an iterator that yields a tuple that contain the
-        total number of results and the new result that came in.
+        total number of results and the new result that came in. Once all entries of a 
+        group have a final result, a group result is also yielded.
         """
 
+        if self.engine not in (self.ENGINE_THREAD, self.ENGINE_ASYNCIO):
+            raise ValueError(f"unsupported download engine '{self.engine}'")
+        if self.fsync not in (self.FSYNC_NONE, self.FSYNC_FILE, self.FSYNC_BATCH):
+            raise ValueError(f"unsupported fsync policy '{self.fsync}'")
+        if buffer_size < _DownloadEntry.MIN_READ_SIZE:
+            raise ValueError(f"buffer size must be at least {_DownloadEntry.MIN_READ_SIZE}")
+
         # Sort our entries in order to download big files first, this is allows better
         # parallelization at start and avoid too much blocking at the end of the download.
-        # Note that entries without size are considered 1 Mio, to download early.
-        self.entries.sort(key=lambda e: e.entry.size or 1048576, reverse=True)
+        # Note that entries without size are considered 1 Mio, to download early. Entries
+        # with higher priority are downloaded first regardless of their size.
+        self.entries.sort(key=lambda e: (e.entry.priority, e.entry.size or 1048576), reverse=True)
 
         entries_count = len(self.entries)
         if not entries_count or threads_count < 1:
             return
 
+        sync = _DownloadSync(self.fsync, self.lock)
+        raw_entries = self._split_entries(threads_count, segment_size, sync)
+        if self.engine == self.ENGINE_THREAD and self.pipeline is not None and self.pipeline > 1:
+            raw_entries = _pipeline_entries(raw_entries, self.pipeline)
+
+        if self.journal is not None:
+            self.journal.plan([raw_entry.entry for raw_entry in self.entries])
+
+        progress_interval = progress_interval if partial_progress else None
+        controller = _DownloadConcurrency(threads_count if concurrency is None else concurrency,
+            threads_count, concurrency is not None)
+        bandwidth = _DownloadBandwidth(self.max_rate, self.max_host_rate)
+        mirrors = _DownloadMirrors()
+        retries = _DownloadRetries(self.retry)
+
+        if self.engine == self.ENGINE_THREAD:
+            results = self._download_thread(raw_entries, threads_count, progress_interval, max_host_connections, buffer_size, sync, controller, bandwidth, mirrors, retries)
+        else:
+            results = self._download_asyncio(raw_entries, threads_count, progress_interval, max_host_connections, buffer_size, sync, controller, bandwidth, mirrors, retries)
+        
+        # Downloaded files, recorded in the index at the end.
+        downloaded: List[Tuple[Path, Optional[str]]] = []
+
+        # Number of remaining entries and errors for each group.
+        groups: Dict[str, List[int]] = {}
+        for raw_entry in self.entries:
+            if raw_entry.entry.group is not None:
+                groups.setdefault(raw_entry.entry.group, [0, 0])[0] += 1
+
+        try:
+            for result_count, result in results:
+
+                entry = result.entry
+                done = isinstance(result, DownloadResultProgress) and result.done
+
+                if self.journal is not None and done:
+                    self.journal.record(entry)
+                if self.index is not None and done:
+                    downloaded.append((entry.dst, entry.sha1))
+                    if self.store is not None and entry.sha1 is not None:
+                        downloaded.append((self.store / entry.sha1[:2] / entry.sha1, entry.sha1))
+                
+                yield result_count, result
+
+                if entry.group is not None and (done or isinstance(result, DownloadResultError)):
+                    group = groups[entry.group]
+                    group[0] -= 1
+                    group[1] += not done
+                    if not group[0]:
+                        yield result_count, DownloadResultGroup(result.thread_id, entry, entry.group, group[1])
+        finally:
+            # Flush the files that have been downloaded, if batched.
+            sync.flush()
+            if self.index is not None:
+                self.index.update(downloaded)
+            if self.journal is not None:
+                self.journal.close()
+
+    def _split_entries(self, threads_count: int, segment_size: Optional[int], sync: "_DownloadSync") -> List[_DownloadEntry]:
+        """Internal function to split large entries in segments, each segment being 
+        downloaded as a single entry, at most one segment per thread for each entry.
+        """
+
+        if segment_size is None or segment_size < 1 or threads_count < 2:
+            return self.entries
+        
+        raw_entries = []
+        for raw_entry in self.entries:
+            size = raw_entry.entry.size
+            if size is None or size <= segment_size:
+                raw_entries.append(raw_entry)
+                continue
+            count = min(threads_count, -(-size // segment_size))
+            length = -(-size // count)
+            file = _DownloadSegmentedFile(raw_entry, count, sync)
+            for start in range(0, size, length):
+                segment = _DownloadSegment(file, start, min(start + length, size) - 1)
+                segment_entry = _DownloadEntry(raw_entry.https, raw_entry.host, raw_entry.port, raw_entry.entry, segment)
+                segment_entry.mirrors = raw_entry.mirrors
+                raw_entries.append(segment_entry)
+        
+        return raw_entries
+
+    def _download_thread(self, 
+        raw_entries: List[_DownloadEntry], 
+        threads_count: int, 
+        progress_interval: Optional[float], 
+        max_host_connections: Optional[int],
+        buffer_size: int,
+        sync: "_DownloadSync",
+        concurrency: "_DownloadConcurrency",
+        bandwidth: "_DownloadBandwidth",
+        mirrors: "_DownloadMirrors",
+        retries: "_DownloadRetries"
+    ) -> Iterator[Tuple[int, DownloadResult]]:
+        """Internal download implementation with one OS thread per download slot.
+        """
+
         threads: List[Thread] = []
 
         entries_queue = Queue()
         result_queue = Queue()
+        pool = _ConnectionPool(max_host_connections)
 
         for th_id in range(threads_count):
             th = Thread(target=_download_thread_wrapper, 
-                        args=(th_id, entries_queue, result_queue, partial_progress), 
+                        args=(th_id, entries_queue, result_queue, pool, progress_interval, buffer_size, sync, concurrency, bandwidth, mirrors, retries), 
                         daemon=True, 
                         name=f"Download Thread {th_id}")
             th.start()
             threads.append(th)
         
-        result_count = 0
-
-        for entry in self.entries:
+        for entry in raw_entries:
             entries_queue.put(entry)
 
-        crash = None
+        try:
+            yield from _download_results(len(self.entries), result_queue)
+        finally:
+            # Send 'threads_count' sentinels.
+            # We intentionally don't join thread because it takes some time for unknown 
+            # reason. And we don't care of these threads because these are daemon ones.
+            for th_id in range(threads_count):
+                entries_queue.put(None)
+            # Threads waiting for a permit must receive their sentinel.
+            concurrency.close()
+            # Idle connections are no longer used.
+            pool.close()
+
+    def _download_asyncio(self, 
+        raw_entries: List[_DownloadEntry], 
+        threads_count: int, 
+        progress_interval: Optional[float], 
+        max_host_connections: Optional[int],
+        buffer_size: int,
+        sync: "_DownloadSync",
+        concurrency: "_DownloadConcurrency",
+        bandwidth: "_DownloadBandwidth",
+        mirrors: "_DownloadMirrors",
+        retries: "_DownloadRetries"
+    ) -> Iterator[Tuple[int, DownloadResult]]:
+        """Internal download implementation running all download slots on a single 
+        asyncio event loop, itself running in a background thread.
+        """
+
+        result_queue = Queue()
+
+        th = Thread(target=_download_async_thread_wrapper,
+                    args=(list(raw_entries), len(self.entries), threads_count, result_queue, progress_interval, max_host_connections, buffer_size, sync, concurrency, bandwidth, mirrors, retries),
+                    daemon=True,
+                    name="Download Event Loop Thread")
+        th.start()
+
+        yield from _download_results(len(self.entries), result_queue)
+
+
+def _check_file(file: Path, size: Optional[int], sha1: Optional[str]) -> bool:
+    """Check if the given file exists and has the expected size and sha1, if known.
+    """
+    try:
+        if size is not None and file.stat().st_size != size:
+            return False
+        if sha1 is not None:
+            with file.open("rb") as fp:
+                return calc_input_sha1(fp, buffer_len=65536) == sha1
+        return file.is_file()
+    except OSError:
+        return False
+
+
+def _download_results(entries_count: int, result_queue: Queue) -> Iterator[Tuple[int, DownloadResult]]:
+    """Internal function that receives results from the given queue until every entry
+    has a final result, it yields the total number of results and the new result.
+    """
+
+    result_count = 0
+    
+    while result_count < entries_count:
+
+        # Wait for at least one result, then take all waiting results.
+        batch = [result_queue.get()]
+        while True:
+            try:
+                batch.append(result_queue.get_nowait())
+            except Empty:
+                break
         
-        while result_count < entries_count:
+        for result in _merge_results(batch):
 
-            result = result_queue.get()
             if isinstance(result, _DownloadThreadCrash):
-                crash = result
-                break
+                raise ValueError(f"unexpected crash from thread {result.thread_id}", result.origin)
 
             if not isinstance(result, DownloadResultProgress) or result.done:
                 result_count += 1
             
             yield result_count, result
 
-        # Send 'threads_count' sentinels.
-        # We intentionally don't join thread because it takes some time for unknown 
-        # reason. And we don't care of these threads because these are daemon ones.
-        for th_id in range(threads_count):
-            entries_queue.put(None)
 
-        if crash is not None:
-            raise ValueError(f"unexpected crash from thread {crash.thread_id}", crash.origin)
+def _merge_results(batch: list) -> list:
+    """Merge a batch of results by removing partial progress that are followed by any
+    other result from the same thread, the order of remaining results is kept.
+    """
 
+    if len(batch) == 1:
+        return batch
+
+    merged = []
+    seen_threads = set()
+    for result in reversed(batch):
+        if isinstance(result, DownloadResultProgress) and not result.done:
+            if result.thread_id in seen_threads:
+                continue
+        if isinstance(result, DownloadResult):
+            seen_threads.add(result.thread_id)
+        merged.append(result)
+    
+    merged.reverse()
+    return merged
 
-class _DownloadThreadCrash:
-    """Unexpected exception happening in a thread, this is the result of a bad logic
-    from programmer.
+
+class _DownloadSpeed:
+    """Internal smoothed speed calculation of a download slot.
     """
-    __slots__ = "thread_id", "origin",
-    def __init__(self, thread_id: int, origin: Optional[Exception]) -> None:
-        self.thread_id = thread_id
-        self.origin = origin
 
+    __slots__ = "last_time", "last_size", "current_size", "speed", "last_progress"
 
-def _download_thread_wrapper(
-    thread_id: int, 
-    entries_queue: Queue,
-    result_queue: Queue,
-    partial_progress: bool
-) -> None:
-    """Wrapper for the download thread that basically ensures that any unexpected error
-    sends a signal (DownloadThreadCrash) to the master to signal the crash.
+    # For speed calculation.
+    UPDATE_INTERVAL = 0.25
+    SMOOTHING = 0.3
+
+    def __init__(self) -> None:
+        self.last_time = 0.0
+        self.last_size = 0
+        self.current_size = 0
+        self.speed = 0.0
+        self.last_progress = 0.0
+    
+    def progress_due(self, interval: Optional[float]) -> bool:
+        """Return true if a partial progress update should be sent, given the minimum 
+        interval between two updates, none if partial progress is disabled.
+        """
+        if interval is None:
+            return False
+        now = time.monotonic()
+        if now - self.last_progress < interval:
+            return False
+        self.last_progress = now
+        return True
+    
+    def update(self, size: int) -> float:
+        """Update the speed with the given number of bytes just received and return the
+        current speed.
+        """
+
+        self.current_size += size
+
+        # Update speed calculation at given interval.
+        now = time.monotonic()
+        elapsed_time = now - self.last_time
+        if elapsed_time > self.UPDATE_INTERVAL:
+            elapsed_size = self.current_size - self.last_size
+            current_speed = elapsed_size / elapsed_time
+            self.speed = self.SMOOTHING * current_speed + (1 - self.SMOOTHING) * self.speed
+            self.last_time = now
+            self.last_size = self.current_size
+        
+        return self.speed
+
+
+class _DownloadConcurrency:
+    """Internal controller of the number of download slots that are active at the same
+    time, slots acquire a permit before downloading each entry. If adaptive, the limit
+    of permits is adjusted in the style of TCP congestion control: the throughput is
+    sampled at regular windows, while it improves the limit is doubled (slow start)
+    and then increased by one, if it stagnates the slow start ends and if it drops the
+    limit is decreased by one, connection errors halve the limit.
+
+    Asyncio slots wait for a permit on a future of their event loop, that is resolved 
+    from the thread releasing a permit.
     """
-    try:
-        _download_thread(thread_id, entries_queue, result_queue, partial_progress)
-    except Exception as e:
-        result_queue.put(_DownloadThreadCrash(thread_id, e))
-    except:
-        # Really bad error, should not happen, but do we ever know...
-        result_queue.put(_DownloadThreadCrash(thread_id, None))
-        raise
 
+    __slots__ = "cond", "limit", "max_limit", "threshold", "active", "adaptive", "closed", \
+        "window_start", "window_size", "window_errors", "last_throughput", "async_waiters"
+
+    # Duration of the throughput sampling window.
+    WINDOW = 0.5
+    # Relative throughput change considered as an improvement or a drop.
+    TOLERANCE = 0.1
+
+    def __init__(self, limit: int, max_limit: int, adaptive: bool) -> None:
+        self.cond = Condition()
+        self.limit = max(1, min(limit, max_limit))
+        self.max_limit = max_limit
+        self.threshold = max_limit
+        self.active = 0
+        self.adaptive = adaptive
+        self.closed = False
+        self.window_start = time.monotonic()
+        self.window_size = 0
+        self.window_errors = 0
+        self.last_throughput = 0.0
+        self.async_waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquire a permit, waiting for one to be released if blocking. Once closed,
+        permits are always given.
+        """
+        with self.cond:
+            while not self.closed and self.active >= self.limit:
+                if not blocking:
+                    return False
+                self.cond.wait()
+            self.active += 1
+            return True
+
+    async def acquire_async(self) -> None:
+        """Acquire a permit without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.cond:
+                if self.closed or self.active < self.limit:
+                    self.active += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self.async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self.cond:
+                    if waiter in self.async_waiters:
+                        self.async_waiters.remove(waiter)
+                    else:
+                        # The wake up is passed to another slot.
+                        self._notify(1)
+                raise
+
+    def release(self) -> None:
+        with self.cond:
+            self.active -= 1
+            self._notify(1)
+
+    def close(self) -> None:
+        """Wake up all waiting slots, so they can receive their stop sentinel.
+        """
+        with self.cond:
+            self.closed = True
+            self._notify(None)
 
-def _download_thread(
-    thread_id: int, 
-    entries_queue: Queue,
-    result_queue: Queue,
-    partial_progress: bool
-) -> None:
-    """This function is internally used for multi-threaded download.
+    def _notify(self, count: Optional[int]) -> None:
+        """Wake up the given number of waiting slots, or all if none, for both threads
+        and asyncio slots. The condition's lock must be held.
+        """
+        if count is None:
+            self.cond.notify_all()
+            count = len(self.async_waiters)
+        else:
+            self.cond.notify(count)
+        for _ in range(min(count, len(self.async_waiters))):
+            loop, future = self.async_waiters.popleft()
+            loop.call_soon_threadsafe(_set_future_done, future)
+
+    def feed(self, size: int, error: bool = False) -> None:
+        """Account the given number of bytes received, or a connection error, and adjust
+        the limit if the current window is elapsed.
+        """
 
-    :param entries_queue: Where entries to download are received.
-    :param result_queue: Where threads send progress update.
+        if not self.adaptive:
+            return
+
+        with self.cond:
+
+            self.window_size += size
+            self.window_errors += error
+
+            now = time.monotonic()
+            elapsed = now - self.window_start
+            if elapsed < self.WINDOW:
+                return
+
+            throughput = self.window_size / elapsed
+            previous = self.limit
+
+            if self.window_errors:
+                self.limit = self.threshold = max(1, self.limit // 2)
+            elif throughput > self.last_throughput * (1 + self.TOLERANCE):
+                if self.limit < self.threshold:
+                    self.limit = min(self.limit * 2, self.threshold)
+                else:
+                    self.limit = min(self.limit + 1, self.max_limit)
+            elif throughput < self.last_throughput * (1 - self.TOLERANCE):
+                self.limit = self.threshold = max(1, self.limit - 1)
+            elif self.threshold > self.limit:
+                self.threshold = self.limit
+
+            self.window_start = now
+            self.window_size = 0
+            self.window_errors = 0
+            self.last_throughput = throughput
+
+            if self.limit > previous:
+                self._notify(None)
+
+
+def _set_future_done(future: asyncio.Future) -> None:
+    """Resolve the given future if not already cancelled, from its event loop.
     """
-    
-    # Cache for connections depending on host and https
-    conn_cache: Dict[Tuple[bool, str], Union[HTTPConnection, HTTPSConnection]] = {}
+    if not future.done():
+        future.set_result(None)
 
-    # Each thread has its own buffer.
-    buffer_cap = 65536
-    buffer_back = bytearray(buffer_cap)
-    buffer = memoryview(buffer_back)
 
-    # Try to use certifi if installed, we use this context for the connections.
-    try:
-        import certifi
-        ctx = ssl.create_default_context(cafile=certifi.where())
-    except ImportError:
-        ctx = None
-    
-    # Maximum tries count or a single entry.
-    max_try_count = 3
+class _TokenBucket:
+    """Internal token bucket limiting a number of bytes per second, bytes are reserved
+    even if not enough tokens are available, the bucket then becomes negative and the
+    caller must wait for the returned delay before reading more.
+    """
 
-    # For speed calculation.
-    speed_update_interval = 0.25
-    speed_smoothing = 0.3
-    speed_last_time = 0
-    speed_last_size = 0
-    speed_current_size = 0
-    speed = 0
+    __slots__ = "rate", "capacity", "tokens", "last_time"
 
-    while True:
+    # Maximum burst, in seconds of the rate.
+    BURST = 0.25
 
-        raw_entry: Optional[_DownloadEntry] = entries_queue.get()
+    def __init__(self, rate: int) -> None:
+        self.rate = rate
+        self.capacity = rate * self.BURST
+        self.tokens = self.capacity
+        self.last_time = time.monotonic()
 
-        # None is a sentinel to stop the thread, it should be consumed ONCE.
-        if raw_entry is None:
-            break
+    def reserve(self, size: int, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+        self.last_time = now
+        self.tokens -= size
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
 
-        conn_key = (raw_entry.https, raw_entry.host)
-        entry = raw_entry.entry
 
-        # Get connection from cache or create it.
-        conn = conn_cache.get(conn_key)
-        
-        last_error: Optional[str] = None
-        last_error_origin: Optional[Exception] = None
-        try_num = 0
+class _DownloadBandwidth:
+    """Internal bandwidth limiter shared by all download slots, with a global token
+    bucket and a token bucket per host.
+    """
 
-        while True:
+    __slots__ = "lock", "max_rate", "max_host_rate", "bucket", "host_buckets"
 
-            try_num += 1
-            if try_num > max_try_count:
-                # Retrying implies that we have set an error.
-                assert last_error is not None
-                result_queue.put(DownloadResultError(thread_id, entry, last_error, last_error_origin))
-                break
+    def __init__(self, max_rate: Optional[int], max_host_rate: Optional[int]) -> None:
+        self.lock = Lock()
+        self.max_rate = max_rate
+        self.max_host_rate = max_host_rate
+        self.bucket = None if max_rate is None else _TokenBucket(max_rate)
+        self.host_buckets: Dict[str, _TokenBucket] = {}
 
-            # If there is no cached connection or the connection has been reset.
-            if conn is None:
-                if raw_entry.https:
-                    conn = HTTPSConnection(raw_entry.host, raw_entry.port, context=ctx)
-                else:
-                    conn = HTTPConnection(raw_entry.host, raw_entry.port)
-                # Cache the connection for later use.
-                conn_cache[conn_key] = conn
-            
-            # This try-except block is around all potential 
-            try:
-                
-                conn.request("GET", entry.url)
-                res = conn.getresponse()
+    def read_size(self, buffer_cap: int) -> int:
+        """Return the maximum size of a single read, given the buffer capacity, small
+        reads are needed for low rates to be smooth.
+        """
+        rates = [rate for rate in (self.max_rate, self.max_host_rate) if rate is not None]
+        if not rates:
+            return buffer_cap
+        return max(1024, min(buffer_cap, int(min(rates) * _TokenBucket.BURST)))
+
+    def reserve(self, host: str, size: int) -> float:
+        """Reserve the given number of bytes just received from the given host, and
+        return the delay to wait before reading more, in seconds.
+        """
+
+        if self.bucket is None and self.max_host_rate is None:
+            return 0.0
+
+        with self.lock:
+            now = time.monotonic()
+            delay = 0.0
+            if self.bucket is not None:
+                delay = self.bucket.reserve(size, now)
+            if self.max_host_rate is not None:
+                host_bucket = self.host_buckets.get(host)
+                if host_bucket is None:
+                    host_bucket = self.host_buckets[host] = _TokenBucket(self.max_host_rate)
+                delay = max(delay, host_bucket.reserve(size, now))
+            return delay
+
+
+class _DownloadMirrors:
+    """Internal selection of the URL to download each entry from, among its mirrors,
+    based on the smoothed latency measured for each origin (scheme, host and port). The
+    latency of an origin that has never been measured is considered null, so it gets
+    tried, and errors are accounted as a high latency.
+    """
 
-                if res.status != 200:
+    __slots__ = "lock", "latencies"
 
-                    # This loop is used to skip all bytes in the stream, 
-                    # and allow further request.
-                    while res.readinto(buffer):
-                        pass
+    SMOOTHING = 0.3
+    # Latency in seconds accounted when a request fails.
+    ERROR_LATENCY = 10.0
 
-                    if res.status == 301 or res.status == 302:
-                        # If location header is absent, consider it not found.
-                        redirect_url = res.headers.get("location")
-                        if redirect_url is not None:
-                            redirect_entry = DownloadEntry(
-                                redirect_url, 
-                                entry.dst, 
-                                size=entry.size, 
-                                sha1=entry.sha1, 
-                                name=entry.name)
-                            
-                            entries_queue.put(_DownloadEntry.from_entry(redirect_entry))
-                            break  # Abort on redirect
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.latencies: Dict[str, float] = {}
 
-                    # Any other non-200 code is considered not found and we retry...
-                    last_error = DownloadResultError.NOT_FOUND
-                    continue
-                
-                sha1 = None if entry.sha1 is None else hashlib.sha1()
-                size = 0
-
-                entry.dst.parent.mkdir(parents=True, exist_ok=True)
-                with entry.dst.open("wb") as dst_fp:
-
-                    while True:
-
-                        read_len = res.readinto(buffer)
-                        if not read_len:
-                            break
-
-                        size += read_len
-                        speed_current_size += read_len
-                        buffer_view = buffer[:read_len]
-                        if sha1 is not None:
-                            sha1.update(buffer_view)
-                        dst_fp.write(buffer_view)
-
-                        # Update speed calculation at given interval.
-                        now = time.monotonic()
-                        speed_elapsed_time = now - speed_last_time
-                        if speed_elapsed_time > speed_update_interval:
-                            speed_elapsed_size = speed_current_size - speed_last_size
-                            current_speed = speed_elapsed_size / speed_elapsed_time
-                            speed = speed_smoothing * current_speed + (1 - speed_smoothing) * speed
-                            speed_last_time = now
-                            speed_last_size = speed_current_size
-
-                        # Filled the whole buffer, send a progress update because we'll 
-                        # likely need another reading.
-                        if partial_progress and read_len == buffer_cap:
-                            result_queue.put(DownloadResultProgress(
-                                thread_id,
-                                entry,
-                                size,
-                                speed,
-                                False
-                            ))
-            
-                # If the entry should be executable, only those that can read would be
-                # able to execute it.
-                if entry.executable:
-                    prev_mode = entry.dst.stat().st_mode
-                    entry.dst.chmod(prev_mode | ((prev_mode & 0o444) >> 2))
-
-                # Checking size and sha1 if relevant, if no error we send the full 
-                # progress.
-                if entry.size is not None and size != entry.size:
-                    last_error = DownloadResultError.INVALID_SIZE
-                elif sha1 is not None and sha1.hexdigest() != entry.sha1:
-                    last_error = DownloadResultError.INVALID_SHA1
-                else:
-                    
-                    result_queue.put(DownloadResultProgress(
-                        thread_id,
-                        entry,
-                        size,
-                        speed,
-                        True
-                    ))
-
-                    # Breaking means success, to avoid unlinking the file!
-                    break
+    def latency(self, url: str) -> float:
+        return self.latencies.get(_url_origin(url), 0.0)
 
-            except (ConnectionError, OSError, HTTPException) as e:
+    def record(self, url: str, latency: Optional[float]) -> None:
+        """Record the latency of a request to the given URL, none if the request failed.
+        """
+        origin = _url_origin(url)
+        sample = self.ERROR_LATENCY if latency is None else latency
+        with self.lock:
+            previous = self.latencies.get(origin)
+            if previous is None:
+                self.latencies[origin] = sample
+            else:
+                self.latencies[origin] = self.SMOOTHING * sample + (1 - self.SMOOTHING) * previous
+
+    def select(self, raw_entry: _DownloadEntry) -> _DownloadEntry:
+        """Return the entry to download from the URL with the lowest latency, the other
+        URLs are kept as mirrors, the first URL is selected on equal latency.
+        """
+        if not raw_entry.mirrors:
+            return raw_entry
+        urls = [raw_entry.entry.url, *raw_entry.mirrors]
+        best = min(range(len(urls)), key=lambda i: self.latency(urls[i]))
+        if best == 0:
+            return raw_entry
+        return raw_entry.redirect(urls.pop(best), urls)
+
+    def failover(self, raw_entry: _DownloadEntry) -> _DownloadEntry:
+        """Return the entry to download from one of its mirrors, after the current URL
+        has failed, the current URL is not tried again.
+        """
+        urls = list(raw_entry.mirrors)
+        best = min(range(len(urls)), key=lambda i: self.latency(urls[i]))
+        return raw_entry.redirect(urls.pop(best), urls)
 
-                # On errors, we just throw away the old connection and create a new one.
-                # Raw but efficient way of resetting the potentially broken state...
-                conn.close()
-                conn = None
 
-                last_error = DownloadResultError.CONNECTION
-                last_error_origin = e
+class _DownloadRetries:
+    """Internal state of the retry policy for a download, the retry budget is shared
+    by all threads.
+    """
 
-            # We are here only when the file download has started but checks have failed,
-            # then we should remove the file.
-            try:
-                entry.dst.unlink()
-            except FileNotFoundError:
-                pass  # Not a problem if the file isn't present.
+    __slots__ = "policy", "lock", "budget"
+
+    def __init__(self, policy: RetryPolicy) -> None:
+        self.policy = policy
+        self.lock = Lock()
+        self.budget = policy.budget
+
+    def delay(self, try_num: int, error: str, retry_after: Optional[float]) -> Optional[float]:
+        """Return the delay in seconds before retrying after the given failed try, none
+        if the entry should not be retried.
+        """
+        if error not in self.policy.RETRY_CODES or try_num >= self.policy.max_tries:
+            return None
+        if self.budget is not None:
+            with self.lock:
+                if self.budget <= 0:
+                    return None
+                self.budget -= 1
+        return self.policy.delay(try_num, retry_after)
+
+
+def _status_error(status: int) -> str:
+    """Return the error code of an HTTP status that can't be accepted for a download.
+    """
+    if status in (404, 410):
+        return DownloadResultError.NOT_FOUND
+    elif status in (429, 503):
+        return DownloadResultError.THROTTLED
+    elif status >= 500 or status == 408:
+        return DownloadResultError.SERVER_ERROR
+    else:
+        return DownloadResultError.HTTP_ERROR
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse the value of a `Retry-After` header, either a delay in seconds or a date,
+    and return the delay in seconds, none if absent or invalid.
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def _url_origin(url: str) -> str:
+    """Return the scheme and network location of the given URL.
+    """
+    scheme, _, rest = url.partition("://")
+    return f"{scheme}://{rest.split('/', 1)[0]}"
+
+
+class _ConnectionPool:
+    """Internal pool of keep-alive connections, shared by all download threads, the 
+    connections are keyed by https, host and port. Idle connections are reused and the
+    number of connections opened to a single host can be limited, in such case threads
+    wait for a connection to be released.
+    """
+
+    def __init__(self, max_per_host: Optional[int]) -> None:
+        self.ctx = ssl_context()
+        self.max_per_host = max_per_host
+        self.cond = Condition()
+        self.idle: Dict[Tuple[bool, str, Optional[int]], List[Union[HTTPConnection, HTTPSConnection]]] = {}
+        self.opened: Dict[Tuple[bool, str, Optional[int]], int] = {}
+
+    def acquire(self, raw_entry: "_DownloadEntry") -> Union[HTTPConnection, HTTPSConnection]:
+        """Get an idle connection for the given entry, or create a new one if the host
+        limit allows it, if not this waits until another thread release a connection.
+        """
+
+        key = (raw_entry.https, raw_entry.host, raw_entry.port)
+
+        with self.cond:
+            while True:
+                idle = self.idle.get(key)
+                if idle:
+                    return idle.pop()
+                opened = self.opened.get(key, 0)
+                if self.max_per_host is None or opened < self.max_per_host:
+                    self.opened[key] = opened + 1
+                    break
+                self.cond.wait()
+        
+        if raw_entry.https:
+            return HTTPSConnection(raw_entry.host, raw_entry.port, context=self.ctx)
+        else:
+            return HTTPConnection(raw_entry.host, raw_entry.port)
+
+    def release(self, raw_entry: "_DownloadEntry", conn: Union[HTTPConnection, HTTPSConnection]) -> None:
+        """Give back a connection to the pool, so it can be reused by any thread. Note 
+        that closed connections can be given back because they are automatically 
+        reopened on next request.
+        """
+
+        key = (raw_entry.https, raw_entry.host, raw_entry.port)
+
+        with self.cond:
+            self.idle.setdefault(key, []).append(conn)
+            self.cond.notify()
+
+    def close(self) -> None:
+        with self.cond:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle.clear()
+            self.opened.clear()
+
+
+class _DownloadFile:
+    """Internal destination file of an entry being downloaded. The file is written 
+    under a partial sidecar file that is only moved to the entry's destination when 
+    completed and checked. This partial file is kept on connection errors, so the 
+    download can be resumed from its current size with a range request.
+
+    The SHA-1 of the entry, if known, detects a partial file that doesn't come from 
+    the same upstream file. Without SHA-1, the partial file is only resumed if it's 
+    been started by this download, with an `If-Range` header containing the validator
+    (strong ETag or Last-Modified) of the response that started it. A partial file 
+    left by a previous download, whose validator is unknown, is downloaded again.
+
+    The partial file is written through its raw descriptor, without the buffering of
+    file objects that would copy each chunk once more. It's not preallocated, because
+    its size is the resume offset, even after the process has been killed.
+    """
+
+    __slots__ = "entry", "target", "sync", "reuse", "file_lock", "locked", "part", "fd", "sha1", "size", "offset", \
+        "validator", "stale"
+
+    def __init__(self, raw_entry: _DownloadEntry, sync: "_DownloadSync") -> None:
+        self.entry = raw_entry.entry
+        self.target = raw_entry.target()
+        self.sync = sync
+        self.reuse = raw_entry.reuse
+        self.file_lock = sync.file_lock(self.target)
+        self.locked = False
+        self.part = _part_file(self.target, self.file_lock is not None)
+        self.fd: Optional[int] = None
+        self.sha1 = None
+        self.size = 0
+        self.offset = 0
+        self.validator: Optional[str] = None
+        self.stale = False
+
+    def lock(self, blocking: bool) -> bool:
+        """Acquire the inter-process lock of the entry, if enabled, return false if 
+        the lock is held by another process and this is not blocking.
+        """
+        if not self.locked:
+            if self.file_lock is not None:
+                try:
+                    if not self.file_lock.acquire(blocking):
+                        return False
+                except OSError:
+                    # The lock file can't be created, in a read-only directory for
+                    # example, the entry is then downloaded without lock.
+                    self.file_lock = None
+                    self.part = _part_file(self.target, False)
+            self.locked = True
+        return True
+    
+    def release(self) -> None:
+        """Release the inter-process lock of the entry, if acquired. Without lock, the
+        partial file is unique to this download and is removed because it can't be
+        resumed.
+        """
+        if self.locked:
+            if self.file_lock is not None:
+                self.file_lock.release()
+            else:
+                self.discard()
+            self.locked = False
+
+    def reused(self) -> bool:
+        """Once locked, check if the entry has been downloaded by another process that
+        held the lock, in such case the entry doesn't need to be downloaded.
+        """
+        entry = self.entry
+        if self.file_lock is not None and self.reuse and _check_file(self.target, entry.size, entry.sha1):
+            self.size = self.target.stat().st_size
+            self.sync.link(self.target, entry.dst)
+            return True
+        return False
+    
+    def resume_offset(self) -> int:
+        """Return the offset where the download can be resumed from, zero if there is
+        no partial file, if the partial file is already too large or if it can't be 
+        checked, neither with the SHA-1 nor with a validator.
+        """
+        if self.entry.sha1 is None and self.validator is None:
+            return 0
+        try:
+            offset = self.part.stat().st_size
+        except OSError:
+            return 0
+        if self.entry.size is not None and offset >= self.entry.size:
+            return 0
+        return offset
+
+    def request_headers(self) -> Dict[str, str]:
+        """Return the headers to send with the request of a new try, if a partial file
+        is present, a range is requested in order to resume it.
+        """
+        self.offset = self.resume_offset()
+        self.stale = False
+        if not self.offset:
+            return {}
+        headers = {"Range": f"bytes={self.offset}-"}
+        if self.entry.sha1 is None and self.validator is not None:
+            headers["If-Range"] = self.validator
+        return headers
+
+    def accept(self, status: int, content_range: Optional[str], validator: Optional[str], buffer: memoryview) -> bool:
+        """Check the response's status and content range, if the response can be used,
+        the partial file is opened and true is returned. If the response is the full 
+        file, the download restarts from the beginning and the response's validator is
+        kept for resuming it later. If the partial file can't be resumed, it's discarded
+        and the file is marked as stale, the download should restart immediately.
+        """
+
+        if status == 200:
+            self.validator = validator
+            self.open(0, buffer)
+            return True
+        elif status == 206 and self.offset and content_range is not None:
+            if content_range.startswith(f"bytes {self.offset}-"):
+                self.open(self.offset, buffer)
+                return True
+        
+        # The partial file is not resumable, if the server can't satisfy the range or
+        # returned an invalid one.
+        if status in (206, 416):
+            self.discard()
+            self.stale = self.offset != 0
+        
+        return False
+
+    def open(self, offset: int, buffer: memoryview) -> None:
+        """Open the partial file for writing at the given offset, if not zero the sha1
+        is rebuilt from the bytes already written, using the given buffer.
+        """
+
+        self.sha1 = None if self.entry.sha1 is None else hashlib.sha1()
+        self.size = 0
+
+        if offset:
+            self.fd = os.open(self.part, os.O_RDWR | getattr(os, "O_BINARY", 0))
+            with open(self.fd, "rb", buffering=0, closefd=False) as fp:
+                while self.size < offset:
+                    read_len = fp.readinto(buffer[:offset - self.size])
+                    if not read_len:
+                        break
+                    if self.sha1 is not None:
+                        self.sha1.update(buffer[:read_len])
+                    self.size += read_len
+            os.ftruncate(self.fd, self.size)
+        else:
+            self.part.parent.mkdir(parents=True, exist_ok=True)
+            self.fd = os.open(self.part, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+
+    def write(self, data) -> bool:
+        """Write the given data to the partial file, always return true because the
+        whole response is expected.
+        """
+        assert self.fd is not None, "open(...) missing"
+        if self.sha1 is not None:
+            self.sha1.update(data)
+        _write_all(self.fd, data)
+        self.size += len(data)
+        return True
+
+    def abort(self) -> None:
+        """Close the partial file after an interrupted download, the partial file is 
+        kept to be resumed, only if not empty. It's truncated to the written size, so
+        it doesn't include a partially failed write.
+        """
+        if self.fd is not None:
+            try:
+                os.ftruncate(self.fd, self.size)
+            finally:
+                os.close(self.fd)
+                self.fd = None
+            if not self.size:
+                self.discard()
+
+    def discard(self) -> None:
+        """Remove the partial file, it cannot be resumed.
+        """
+        try:
+            self.part.unlink()
+        except FileNotFoundError:
+            pass  # Not a problem if the file isn't present.
+
+    def finish(self) -> Optional[str]:
+        """Close the partial file and check its size and sha1 if relevant, if valid the 
+        file is moved to the entry's destination, if not the partial file is removed.
+
+        :return: None if successful, or the error code of the invalid check.
+        """
+
+        assert self.fd is not None, "open(...) missing"
+        try:
+            self.sync.sync_file(self.fd)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+        entry = self.entry
+
+        if entry.size is not None and self.size != entry.size:
+            self.discard()
+            return DownloadResultError.INVALID_SIZE
+        elif self.sha1 is not None and self.sha1.hexdigest() != entry.sha1:
+            self.discard()
+            return DownloadResultError.INVALID_SHA1
+        
+        _finalize_part(entry, self.part, self.target, self.sync)
+        return None
+    
+    def complete(self, 
+        thread_id: int, 
+        error: Optional[str], 
+        error_origin: Optional[Exception], 
+        speed: float
+    ) -> Optional[DownloadResult]:
+        """Return the final result of the entry after its last try.
+        """
+        self.release()
+        if error is not None:
+            return DownloadResultError(thread_id, self.entry, error, error_origin)
+        return DownloadResultProgress(thread_id, self.entry, self.size, speed, True)
+
+
+class _DownloadSegmentedFile:
+    """Internal destination file shared by all segments of a segmented entry, each 
+    segment is written at its position in the partial file that is preallocated to
+    the entry's size. The last segment to complete checks the whole file.
+    """
+
+    __slots__ = "entry", "target", "sync", "reuse", "file_lock", "locked", "reused", "part", "lock", \
+        "fd", "remaining", "written", "error", "error_origin"
+
+    def __init__(self, raw_entry: _DownloadEntry, segments_count: int, sync: "_DownloadSync") -> None:
+        self.entry = raw_entry.entry
+        self.target = raw_entry.target()
+        self.sync = sync
+        self.reuse = raw_entry.reuse
+        self.file_lock = sync.file_lock(self.target)
+        self.locked = False
+        self.reused = False
+        self.part = _part_file(self.target, self.file_lock is not None)
+        self.lock = Lock()
+        self.fd: Optional[int] = None
+        self.remaining = segments_count
+        self.written = 0
+        self.error: Optional[str] = None
+        self.error_origin: Optional[Exception] = None
+
+    def acquire(self, blocking: bool) -> bool:
+        """Acquire the inter-process lock of the entry, if enabled, this is done once by
+        the first segment, and the entry may be reused at this point.
+        """
+        if not self.lock.acquire(blocking):
+            return False
+        try:
+            if not self.locked:
+                if self.file_lock is not None:
+                    try:
+                        if not self.file_lock.acquire(blocking):
+                            return False
+                    except OSError:
+                        # Downloaded without lock, like a non-segmented entry.
+                        self.file_lock = None
+                        self.part = _part_file(self.target, False)
+                if self.file_lock is not None:
+                    entry = self.entry
+                    if self.reuse and _check_file(self.target, entry.size, entry.sha1):
+                        self.reused = True
+                        self.written = self.target.stat().st_size
+                        self.sync.link(self.target, entry.dst)
+                self.locked = True
+            return True
+        finally:
+            self.lock.release()
+
+    def open(self) -> None:
+        """Open and preallocate the partial file if not already done.
+        """
+        with self.lock:
+            if self.fd is None:
+                self.part.parent.mkdir(parents=True, exist_ok=True)
+                self.fd = os.open(self.part, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o666)
+                os.ftruncate(self.fd, self.entry.size or 0)
+                _preallocate(self.fd, self.entry.size or 0)
+
+    def write_at(self, data, pos: int) -> None:
+        """Write the given data at the given position in the partial file.
+        """
+        assert self.fd is not None, "open() missing"
+        if hasattr(os, "pwrite"):
+            os.pwrite(self.fd, data, pos)
+        else:
+            # Positional writes are not available on Windows.
+            with self.lock:
+                os.lseek(self.fd, pos, os.SEEK_SET)
+                os.write(self.fd, data)
+
+    def complete(self, size: int, error: Optional[str], error_origin: Optional[Exception]) -> bool:
+        """Mark one segment as completed, with its written size or its error, return 
+        true if this was the last segment of the file.
+        """
+        with self.lock:
+            self.written += size
+            if error is not None and self.error is None:
+                self.error = error
+                self.error_origin = error_origin
+            self.remaining -= 1
+            return self.remaining == 0
+
+    def finish(self) -> Optional[str]:
+        """Close the partial file once all segments are completed, and check its size 
+        and sha1 if relevant, if valid the file is moved to the entry's destination.
+        """
+
+        if self.fd is not None:
+            if self.error is None:
+                self.sync.sync_file(self.fd)
+            os.close(self.fd)
+            self.fd = None
+        
+        try:
+            return self._finish()
+        finally:
+            if self.locked and self.file_lock is not None:
+                self.file_lock.release()
+            self.locked = False
+    
+    def _finish(self) -> Optional[str]:
+
+        entry = self.entry
+        error = self.error
+
+        if self.reused:
+            return None
+
+        if error is None and self.written != entry.size:
+            error = DownloadResultError.INVALID_SIZE
+        elif error is None and entry.sha1 is not None:
+            sha1 = hashlib.sha1()
+            with self.part.open("rb") as fp:
+                for data in iter(lambda: fp.read(65536), b""):
+                    sha1.update(data)
+            if sha1.hexdigest() != entry.sha1:
+                error = DownloadResultError.INVALID_SHA1
+        
+        if error is not None:
+            try:
+                self.part.unlink()
+            except FileNotFoundError:
+                pass
+            return error
+        
+        _finalize_part(entry, self.part, self.target, self.sync)
+        return None
+
+
+class _DownloadSegment:
+    """Internal byte range of a segmented entry, it is downloaded like any other entry
+    but only the last segment to complete produces the final result.
+    """
+
+    __slots__ = "file", "start", "end", "pos", "skip", "size"
+
+    # Segments have no partial file of their own to resume.
+    stale = False
+
+    def __init__(self, file: _DownloadSegmentedFile, start: int, end: int) -> None:
+        self.file = file
+        self.start = start
+        self.end = end  # Inclusive
+        self.pos = start
+        self.skip = 0
+        self.size = 0
+
+    def lock(self, blocking: bool) -> bool:
+        """Acquire the inter-process lock of the segmented entry.
+        """
+        return self.file.acquire(blocking)
+    
+    def release(self) -> None:
+        """The inter-process lock is released by the last segment to complete.
+        """
+
+    def reused(self) -> bool:
+        """Check if the segmented entry has been reused once locked.
+        """
+        return self.file.reused
+
+    def request_headers(self) -> Dict[str, str]:
+        """Return the headers to send with the request of a new try, the whole segment
+        is requested again on each try.
+        """
+        self.size = 0
+        return {"Range": f"bytes={self.start}-{self.end}"}
+
+    def accept(self, status: int, content_range: Optional[str], validator: Optional[str], buffer: memoryview) -> bool:
+        """Check the response's status and content range, if the server doesn't support
+        ranges and returns the full file, only the segment's bytes are written. The 
+        validator is unused because segments always request an explicit range.
+        """
+        if status == 206 and content_range is not None and content_range.startswith(f"bytes {self.start}-"):
+            self.skip = 0
+        elif status == 200:
+            self.skip = self.start
+        else:
+            return False
+        self.pos = self.start
+        self.file.open()
+        return True
+
+    def write(self, data) -> bool:
+        """Write the given data at its position, return false if the rest of the 
+        response is not part of the segment and should not be read.
+        """
+
+        if self.skip:
+            if len(data) <= self.skip:
+                self.skip -= len(data)
+                return True
+            data = data[self.skip:]
+            self.skip = 0
+        
+        remaining = self.end + 1 - self.pos
+        wanted = len(data) <= remaining
+        if not wanted:
+            data = data[:remaining]
+        
+        self.file.write_at(data, self.pos)
+        self.pos += len(data)
+        self.size += len(data)
+        return wanted
+
+    def abort(self) -> None:
+        """The segment is retried from its start, nothing to do.
+        """
+
+    def finish(self) -> Optional[str]:
+        """Check that the whole segment has been written.
+        """
+        if self.pos != self.end + 1:
+            return DownloadResultError.INVALID_SIZE
+        return None
+
+    def complete(self, 
+        thread_id: int, 
+        error: Optional[str], 
+        error_origin: Optional[Exception], 
+        speed: float
+    ) -> Optional[DownloadResult]:
+        """Return the final result of the entry if this is the last segment to complete.
+        """
+
+        file = self.file
+        if not file.complete(self.size if error is None else 0, error, error_origin):
+            return None
+        
+        error = file.finish()
+        if error is not None:
+            return DownloadResultError(thread_id, file.entry, error, file.error_origin)
+        return DownloadResultProgress(thread_id, file.entry, file.written, speed, True)
+
+
+def _part_file(target: Path, shared: bool) -> Path:
+    """Return the partial file of the given target, if shared it has a fixed name so
+    it can be resumed by any process, this requires the inter-process lock of the 
+    target to be held. If not shared, the name is unique to this download, so other
+    processes downloading the same target don't write to the same partial file.
+    """
+    if shared:
+        return target.with_name(f"{target.name}.part")
+    return target.with_name(f"{target.name}.{uuid4().hex}.part")
+
+
+def _preallocate(fd: int, size: int) -> None:
+    """Allocate the disk space of the given file up to the given size, this avoids
+    fragmentation and reports a full disk before downloading. This is a best effort,
+    only where supported by the system and the file system.
+    """
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+
+
+def _response_validator(headers) -> Optional[str]:
+    """Return the validator of a response that can be sent back in an `If-Range` 
+    header, the strong ETag if any, or else the last modification date.
+    """
+    etag = headers.get("etag")
+    if etag is not None and not etag.startswith("W/"):
+        return etag
+    return headers.get("last-modified")
+
+
+def _write_all(fd: int, data) -> None:
+    """Write all the given data to the given file descriptor, a write may be partial.
+    """
+    written = os.write(fd, data)
+    if written < len(data):
+        data = memoryview(data)
+        while written < len(data):
+            written += os.write(fd, data[written:])
+
+
+def _finalize_part(entry: DownloadEntry, part: Path, target: Path, sync: "_DownloadSync") -> None:
+    """Move a completed and checked partial file to its target, the move is atomic so
+    the target is never seen partially written. If the target is not the destination,
+    the destination is then linked to the target.
+    """
+
+    # If the entry should be executable, only those that can read would be
+    # able to execute it.
+    if entry.executable:
+        prev_mode = part.stat().st_mode
+        part.chmod(prev_mode | ((prev_mode & 0o444) >> 2))
+
+    sync.replace(part, target)
+    sync.link(target, entry.dst)
+
+
+class _DownloadSync:
+    """Internal synchronization policy of a download, with the disk through fsync and
+    with other processes through file locks. It tracks the files that needs to be 
+    flushed at the end of the download when batched.
+    """
+
+    __slots__ = "fsync", "lock_files", "lock", "pending"
+
+    def __init__(self, fsync: str, lock_files: bool) -> None:
+        self.fsync = fsync
+        self.lock_files = lock_files
+        self.lock = Lock()
+        self.pending: List[Path] = []
+
+    def file_lock(self, file: Path) -> Optional[FileLock]:
+        """Return the inter-process lock of the given file, none if disabled.
+        """
+        if not self.lock_files:
+            return None
+        return FileLock(file.with_name(f"{file.name}.lock"))
+
+    def sync_file(self, fp) -> None:
+        """Flush the given file object or descriptor before closing it, if each file 
+        should be flushed.
+        """
+        if self.fsync == DownloadList.FSYNC_FILE:
+            if not isinstance(fp, int):
+                fp.flush()
+                fp = fp.fileno()
+            os.fsync(fp)
+
+    def replace(self, src: Path, dst: Path) -> None:
+        """Atomically rename the given file to its destination, the directory is then 
+        flushed if each file should be flushed, or the destination is kept for the 
+        batch flush.
+        """
+        os.replace(src, dst)
+        if self.fsync == DownloadList.FSYNC_FILE:
+            _fsync_dir(dst.parent)
+        elif self.fsync == DownloadList.FSYNC_BATCH:
+            with self.lock:
+                self.pending.append(dst)
+    
+    def link(self, src: Path, dst: Path) -> None:
+        """Link the given destination to the given source file, if not the same file,
+        the directory is flushed or kept for the batch flush like a rename.
+        """
+        if src == dst:
+            return
+        link_file(src, dst)
+        if self.fsync == DownloadList.FSYNC_FILE:
+            _fsync_dir(dst.parent)
+        elif self.fsync == DownloadList.FSYNC_BATCH:
+            with self.lock:
+                self.pending.append(dst)
+
+    def flush(self) -> None:
+        """Flush all pending files of the batch, and then each of their directory once.
+        """
+
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        
+        dirs = {}
+        for file in pending:
+            try:
+                fd = os.open(file, os.O_RDWR | getattr(os, "O_BINARY", 0))
+            except OSError:
+                continue  # The file may have been removed in the meantime.
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            dirs[file.parent] = None
+
+        for dir in dirs:
+            _fsync_dir(dir)
+
+
+def _fsync_dir(dir: Path) -> None:
+    """Flush the given directory entries, this ensure that a rename is persisted. This
+    is not supported on Windows, where directories can't be opened.
+    """
+    if os.name == "nt":
+        return
+    fd = os.open(dir, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _DownloadThreadCrash:
+    """Unexpected exception happening in a thread, this is the result of a bad logic
+    from programmer.
+    """
+    __slots__ = "thread_id", "origin",
+    def __init__(self, thread_id: int, origin: Optional[Exception]) -> None:
+        self.thread_id = thread_id
+        self.origin = origin
+
+
+def _download_thread_wrapper(
+    thread_id: int, 
+    entries_queue: Queue,
+    result_queue: Queue,
+    pool: _ConnectionPool,
+    progress_interval: Optional[float],
+    buffer_size: int,
+    sync: _DownloadSync,
+    concurrency: _DownloadConcurrency,
+    bandwidth: _DownloadBandwidth,
+    mirrors: _DownloadMirrors,
+    retries: _DownloadRetries
+) -> None:
+    """Wrapper for the download thread that basically ensures that any unexpected error
+    sends a signal (DownloadThreadCrash) to the master to signal the crash.
+    """
+    try:
+        _download_thread(thread_id, entries_queue, result_queue, pool, progress_interval, buffer_size, sync, concurrency, bandwidth, mirrors, retries)
+    except Exception as e:
+        result_queue.put(_DownloadThreadCrash(thread_id, e))
+    except:
+        # Really bad error, should not happen, but do we ever know...
+        result_queue.put(_DownloadThreadCrash(thread_id, None))
+        raise
+
+
+def _download_thread(
+    thread_id: int, 
+    entries_queue: Queue,
+    result_queue: Queue,
+    pool: _ConnectionPool,
+    progress_interval: Optional[float],
+    buffer_size: int,
+    sync: _DownloadSync,
+    concurrency: _DownloadConcurrency,
+    bandwidth: _DownloadBandwidth,
+    mirrors: _DownloadMirrors,
+    retries: _DownloadRetries
+) -> None:
+    """This function is internally used for multi-threaded download.
+
+    :param entries_queue: Where entries to download are received.
+    :param result_queue: Where threads send progress update.
+    :param pool: The connection pool shared by all threads.
+    :param buffer_size: The size of the read buffer of this thread.
+    :param sync: The fsync policy of completed files.
+    :param concurrency: The controller giving permits to actively download.
+    :param bandwidth: The bandwidth limiter shared by all threads.
+    :param mirrors: The selection of mirrors shared by all threads.
+    :param retries: The retry policy and budget shared by all threads.
+    """
+
+    # Each thread has its own buffer.
+    buffer_cap = buffer_size
+    buffer_back = bytearray(buffer_cap)
+    buffer = memoryview(buffer_back)
+
+    speed = _DownloadSpeed()
+
+    while True:
+
+        # Wait to be allowed to download before taking an entry, so the entry can be
+        # taken by an active thread in the meantime.
+        concurrency.acquire()
+        raw_entry: Optional[_DownloadEntry] = entries_queue.get()
+
+        # None is a sentinel to stop the thread, it should be consumed ONCE.
+        if raw_entry is None:
+            concurrency.release()
+            break
+
+        # A list of small entries to pipeline on a single connection.
+        if isinstance(raw_entry, list):
+            _download_pipeline(thread_id, raw_entry, entries_queue, result_queue, pool, buffer, sync, concurrency, bandwidth, speed)
+            concurrency.release()
+            continue
+
+        raw_entry = mirrors.select(raw_entry)
+        entry = raw_entry.entry
+
+        # Reads are smaller for small entries or if the bandwidth is limited, the same
+        # buffer is used.
+        read_buffer = buffer[:bandwidth.read_size(raw_entry.read_size(buffer_cap))]
+
+        # Wait for other processes that may be downloading the same file, if the file
+        # has been downloaded meanwhile, it's reused.
+        dl_file = raw_entry.open_file(sync)
+        try:
+            dl_file.lock(True)
+            done, error, error_origin = dl_file.reused(), None, None
+        except OSError as e:
+            done, error, error_origin = True, DownloadResultError.CONNECTION, e
+        if done:
+            result = dl_file.complete(thread_id, error, error_origin, speed.speed)
+            if result is not None:
+                result_queue.put(result)
+            concurrency.release()
+            continue
+
+        # Get a connection from the shared pool, it is kept for all tries.
+        conn = pool.acquire(raw_entry)
+        
+        last_error: Optional[str] = None
+        last_error_origin: Optional[Exception] = None
+        retry_after: Optional[float] = None
+        try_num = 0
+
+        while True:
+
+            if last_error is not None:
+
+                if raw_entry.mirrors:
+                    # Fail over to a mirror instead of retrying, the partial file is kept.
+                    entries_queue.put(mirrors.failover(raw_entry))
+                    dl_file.release()
+                    dl_file = None
+                    break
+
+                delay = retries.delay(try_num, last_error, retry_after)
+                if delay is None:
+                    break
+                time.sleep(delay)
+
+            try_num += 1
+            retry_after = None
+            
+            # This try-except block is around all potential 
+            try:
+
+                request_time = time.monotonic()
+                conn.request("GET", entry.url, headers=dl_file.request_headers())
+                res = conn.getresponse()
+                mirrors.record(entry.url, time.monotonic() - request_time)
+
+                if not dl_file.accept(res.status, res.headers.get("content-range"), _response_validator(res.headers), buffer):
+
+                    # This loop is used to skip all bytes in the stream, 
+                    # and allow further request.
+                    while res.readinto(buffer):
+                        pass
+
+                    if dl_file.stale:
+                        # The partial file has been discarded, this is not an error
+                        # and the download restarts immediately from the beginning.
+                        try_num -= 1
+                        last_error = None
+                        continue
+
+                    if res.status == 301 or res.status == 302:
+                        # If location header is absent, consider it not found.
+                        redirect_url = res.headers.get("location")
+                        if redirect_url is not None:
+                            entries_queue.put(raw_entry.redirect(redirect_url))
+                            dl_file.release()
+                            dl_file = None
+                            break  # Abort on redirect
+
+                    # Any other status is an error, that may be retried...
+                    last_error = _status_error(res.status)
+                    last_error_origin = None
+                    if last_error == DownloadResultError.THROTTLED:
+                        retry_after = _parse_retry_after(res.headers.get("retry-after"))
+                        concurrency.feed(0, True)
+                    continue
+
+                while True:
+
+                    read_len = res.readinto(read_buffer)
+                    if not read_len:
+                        # The response silently ends if the connection is closed
+                        # before the announced length, this would be considered a
+                        # wrong size instead of a resumable connection error.
+                        if res.length:
+                            raise IncompleteRead(b"", res.length)
+                        break
+
+                    speed.update(read_len)
+                    concurrency.feed(read_len)
+                    if not dl_file.write(buffer[:read_len]):
+                        # The rest of the response is not needed, the connection 
+                        # is closed because the response is not fully read.
+                        conn.close()
+                        break
+
+                    delay = bandwidth.reserve(raw_entry.host, read_len)
+                    if delay:
+                        time.sleep(delay)
+
+                    # Send a progress update, if enabled and not sent too recently.
+                    if speed.progress_due(progress_interval):
+                        result_queue.put(DownloadResultProgress(
+                            thread_id,
+                            entry,
+                            dl_file.size,
+                            speed.speed,
+                            False
+                        ))
+
+                # Checking size and sha1 if relevant, if no error the final result
+                # is sent after the loop.
+                last_error = dl_file.finish()
+                if last_error is None:
+                    break
+
+            except (ConnectionError, OSError, HTTPException) as e:
+
+                # On errors, we just close the connection, it will be reopened on next
+                # request. Raw but efficient way of resetting the potentially broken state...
+                conn.close()
+                concurrency.feed(0, True)
+                mirrors.record(entry.url, None)
+
+                # Keep the partial file in order to resume it on next try.
+                dl_file.abort()
+
+                last_error = DownloadResultError.CONNECTION
+                last_error_origin = e
+        
+        # No file if the entry has been redirected.
+        if dl_file is not None:
+            result = dl_file.complete(thread_id, last_error, last_error_origin, speed.speed)
+            if result is not None:
+                result_queue.put(result)
+
+        pool.release(raw_entry, conn)
+        concurrency.release()
+
+
+def _pipeline_entries(raw_entries: List[_DownloadEntry], depth: int) -> List[Union[_DownloadEntry, List[_DownloadEntry]]]:
+    """Internal function to group small entries of the same host in lists of at most 
+    the given depth, each list is pipelined on a single connection. A list takes the
+    place of its first entry, so the order of entries is roughly kept.
+    """
+
+    items: List[Union[_DownloadEntry, List[_DownloadEntry]]] = []
+    pipelines: Dict[Tuple[bool, str, Optional[int]], List[_DownloadEntry]] = {}
+
+    for raw_entry in raw_entries:
+        size = raw_entry.entry.size
+        if raw_entry.segment is not None or raw_entry.mirrors or size is None or size > DownloadList.PIPELINE_MAX_SIZE:
+            items.append(raw_entry)
+            continue
+        key = (raw_entry.https, raw_entry.host, raw_entry.port)
+        pipeline = pipelines.get(key)
+        if pipeline is None or len(pipeline) >= depth:
+            pipeline = pipelines[key] = []
+            items.append(pipeline)
+        pipeline.append(raw_entry)
+
+    return [item[0] if isinstance(item, list) and len(item) == 1 else item for item in items]
+
+
+class _PipelineReader(io.BufferedReader):
+    """Internal buffered reader of a connection's socket, shared by all responses of a
+    pipeline, so that bytes of the next responses buffered while reading a response
+    are not lost. It is given as the socket of each response, that can't close it.
+    """
+
+    def makefile(self, mode: str) -> "_PipelineReader":
+        return self
+    
+    def close(self) -> None:
+        pass  # Closed at the end of the pipeline.
+
+    def release(self) -> None:
+        super().close()
+
+
+def _download_pipeline(
+    thread_id: int,
+    raw_entries: List[_DownloadEntry],
+    entries_queue: Queue,
+    result_queue: Queue,
+    pool: _ConnectionPool,
+    buffer: memoryview,
+    sync: _DownloadSync,
+    concurrency: _DownloadConcurrency,
+    bandwidth: _DownloadBandwidth,
+    speed: _DownloadSpeed
+) -> None:
+    """Download the given small entries of a single host with HTTP/1.1 pipelining, all
+    requests are sent on one connection before reading the responses in order. Entries
+    that are not successfully downloaded, because of a connection error or any other
+    response, are put back in the queue to be downloaded individually, with the usual
+    redirects and retries.
+    """
+
+    # Files are locked without blocking, because other locks are held.
+    files: List[Tuple[_DownloadEntry, _DownloadFile]] = []
+    for raw_entry in raw_entries:
+        dl_file = _DownloadFile(raw_entry, sync)
+        try:
+            if not dl_file.lock(False):
+                entries_queue.put(raw_entry)
+            elif dl_file.reused():
+                result_queue.put(dl_file.complete(thread_id, None, None, speed.speed))
+            else:
+                files.append((raw_entry, dl_file))
+        except OSError as e:
+            result_queue.put(dl_file.complete(thread_id, DownloadResultError.CONNECTION, e, speed.speed))
+    
+    if not files:
+        return
+
+    conn = pool.acquire(files[0][0])
+    reader: Optional[_PipelineReader] = None
+    keep_alive = True
+    done = 0
+
+    try:
+
+        requests = []
+        for raw_entry, dl_file in files:
+            url_parsed = urllib.parse.urlsplit(raw_entry.entry.url)
+            target = url_parsed.path or "/"
+            if url_parsed.query:
+                target += f"?{url_parsed.query}"
+            requests.append((
+                f"GET {target} HTTP/1.1\r\n"
+                f"Host: {url_parsed.netloc}\r\n"
+                f"Accept-Encoding: identity\r\n"
+                + "".join(f"{k}: {v}\r\n" for k, v in dl_file.request_headers().items()) +
+                f"\r\n"
+            ).encode("iso-8859-1"))
+
+        if conn.sock is None:
+            conn.connect()
+        conn.sock.sendall(b"".join(requests))
+        reader = _PipelineReader(conn.sock.makefile("rb", buffering=0))
+
+        for raw_entry, dl_file in files:
+
+            res = HTTPResponse(reader, method="GET")  # type: ignore
+            res.begin()
+            keep_alive = not res.will_close
+
+            if not dl_file.accept(res.status, res.headers.get("content-range"), _response_validator(res.headers), buffer):
+                break
+
+            read_buffer = buffer[:bandwidth.read_size(raw_entry.read_size(len(buffer)))]
+            while True:
+                read_len = res.readinto(read_buffer)
+                if not read_len:
+                    if res.length:
+                        raise IncompleteRead(b"", res.length)
+                    break
+                speed.update(read_len)
+                concurrency.feed(read_len)
+                dl_file.write(read_buffer[:read_len])
+                delay = bandwidth.reserve(raw_entry.host, read_len)
+                if delay:
+                    time.sleep(delay)
+            
+            if dl_file.finish() is not None:
+                break
+
+            result_queue.put(dl_file.complete(thread_id, None, None, speed.speed))
+            done += 1
+
+            if not keep_alive:
+                break
+
+    except (ConnectionError, OSError, HTTPException):
+        concurrency.feed(0, True)
+        files[done][1].abort()
+        keep_alive = False
+    
+    finally:
+        if reader is not None:
+            reader.release()
+        # Remaining responses are not read, the connection can't be reused.
+        if done < len(files) or not keep_alive:
+            conn.close()
+        pool.release(files[0][0], conn)
+    
+    for raw_entry, dl_file in files[done:]:
+        dl_file.release()
+        entries_queue.put(raw_entry)
+
+
+def _download_async_thread_wrapper(
+    entries: List[_DownloadEntry],
+    entries_count: int,
+    slots_count: int,
+    result_queue: Queue,
+    progress_interval: Optional[float],
+    max_host_connections: Optional[int],
+    buffer_size: int,
+    sync: _DownloadSync,
+    concurrency: _DownloadConcurrency,
+    bandwidth: _DownloadBandwidth,
+    mirrors: _DownloadMirrors,
+    retries: _DownloadRetries
+) -> None:
+    """Wrapper for the event loop thread, any unexpected error sends a signal 
+    (DownloadThreadCrash) to the master to signal the crash.
+    """
+    try:
+        asyncio.run(_download_async(entries, entries_count, slots_count, result_queue, progress_interval, max_host_connections, buffer_size, sync, concurrency, bandwidth, mirrors, retries))
+    except Exception as e:
+        result_queue.put(_DownloadThreadCrash(0, e))
+    except:
+        result_queue.put(_DownloadThreadCrash(0, None))
+        raise
+
+
+class _AsyncConnection:
+    """Internal HTTP/1.1 connection used by the asyncio engine.
+    """
+
+    __slots__ = "reader", "writer"
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+    
+    def close(self) -> None:
+        self.writer.close()
+
+
+class _AsyncConnectionPool:
+    """Internal pool of keep-alive connections, shared by all download slots of the
+    asyncio engine, this is the equivalent of the thread's connection pool.
+    """
+
+    def __init__(self, max_per_host: Optional[int]) -> None:
+        self.ctx = ssl_context()
+        self.max_per_host = max_per_host
+        self.cond = asyncio.Condition()
+        self.idle: Dict[Tuple[bool, str, Optional[int]], List[_AsyncConnection]] = {}
+        self.opened: Dict[Tuple[bool, str, Optional[int]], int] = {}
+    
+    async def acquire(self, raw_entry: _DownloadEntry, timeout: Optional[float]) -> _AsyncConnection:
+        """Get an idle connection for the given entry, or open a new one if the host 
+        limit allows it, if not this waits until another slot release a connection.
+        """
+
+        key = (raw_entry.https, raw_entry.host, raw_entry.port)
+
+        async with self.cond:
+            while True:
+                idle = self.idle.get(key)
+                while idle:
+                    conn = idle.pop()
+                    # The server may have closed the connection while idle.
+                    if not conn.reader.at_eof():
+                        return conn
+                    conn.close()
+                    self.opened[key] -= 1
+                opened = self.opened.get(key, 0)
+                if self.max_per_host is None or opened < self.max_per_host:
+                    self.opened[key] = opened + 1
+                    break
+                await self.cond.wait()
+        
+        port = raw_entry.port or (443 if raw_entry.https else 80)
+        ssl_arg = (self.ctx or True) if raw_entry.https else None
+
+        try:
+            reader, writer = await _async_timeout(asyncio.open_connection(raw_entry.host, port, ssl=ssl_arg), timeout)
+        except:
+            await self.release(raw_entry, None)
+            raise
+
+        return _AsyncConnection(reader, writer)
+
+    async def release(self, raw_entry: _DownloadEntry, conn: Optional[_AsyncConnection]) -> None:
+        """Give back a connection to the pool, if the connection is not reusable, none
+        should be given, in such case the connection should be closed by the caller.
+        """
+
+        key = (raw_entry.https, raw_entry.host, raw_entry.port)
+
+        async with self.cond:
+            if conn is None:
+                self.opened[key] -= 1
+            else:
+                self.idle.setdefault(key, []).append(conn)
+            self.cond.notify()
+    
+    def close(self) -> None:
+        for idle in self.idle.values():
+            for conn in idle:
+                conn.close()
+        self.idle.clear()
+        self.opened.clear()
+
+
+async def _async_timeout(aw, timeout: Optional[float]):
+    """Await the given awaitable with an optional timeout, the timeout is converted to 
+    a socket timeout error, which is an OSError.
+    """
+    if timeout is None:
+        return await aw
+    try:
+        return await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        raise socket.timeout("timed out")
+
+
+async def _async_read_head(reader: asyncio.StreamReader, timeout: Optional[float]) -> Tuple[int, Dict[str, str]]:
+    """Read the status line and headers of an HTTP response, header names are lowered.
+    """
+
+    line = await _async_timeout(reader.readline(), timeout)
+    if not line:
+        raise RemoteDisconnected("remote end closed connection without response")
+    
+    parts = line.decode("iso-8859-1").split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith("HTTP/") or not parts[1].isdigit():
+        raise BadStatusLine(repr(line))
+    
+    headers = {}
+    while True:
+        line = await _async_timeout(reader.readline(), timeout)
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("iso-8859-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    return int(parts[1]), headers
+
+
+async def _async_read_body(reader: asyncio.StreamReader, headers: Dict[str, str], buffer_cap: int, timeout: Optional[float]) -> AsyncIterator[bytes]:
+    """Iterate over the chunks of body of an HTTP response, supporting content length,
+    chunked transfer encoding or reading until the connection is closed.
+    """
+
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while True:
+            line = await _async_timeout(reader.readline(), timeout)
+            try:
+                chunk_len = int(line.split(b";", 1)[0], 16)
+            except ValueError:
+                raise IncompleteRead(b"")
+            if chunk_len == 0:
+                # Skip trailers until the last empty line.
+                while (await _async_timeout(reader.readline(), timeout)) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            while chunk_len:
+                data = await _async_timeout(reader.read(min(chunk_len, buffer_cap)), timeout)
+                if not data:
+                    raise IncompleteRead(b"")
+                chunk_len -= len(data)
+                yield data
+            await _async_timeout(reader.readexactly(2), timeout)
+    
+    elif "content-length" in headers:
+        remaining = int(headers["content-length"])
+        while remaining:
+            data = await _async_timeout(reader.read(min(remaining, buffer_cap)), timeout)
+            if not data:
+                raise IncompleteRead(b"", remaining)
+            remaining -= len(data)
+            yield data
+    
+    else:
+        while True:
+            data = await _async_timeout(reader.read(buffer_cap), timeout)
+            if not data:
+                return
+            yield data
+
+
+async def _download_async(
+    entries: List[_DownloadEntry],
+    entries_count: int,
+    slots_count: int,
+    result_queue: Queue,
+    progress_interval: Optional[float],
+    max_host_connections: Optional[int],
+    buffer_size: int,
+    sync: _DownloadSync,
+    concurrency: _DownloadConcurrency,
+    bandwidth: _DownloadBandwidth,
+    mirrors: _DownloadMirrors,
+    retries: _DownloadRetries
+) -> None:
+    """Asyncio implementation of the download, all download slots are running on the 
+    current event loop and share a pool of keep-alive connections.
+    """
+
+    entries_queue: "asyncio.Queue[Optional[_DownloadEntry]]" = asyncio.Queue()
+    for raw_entry in entries:
+        entries_queue.put_nowait(raw_entry)
+    
+    # Number of entries that have no final result, when zero we stop all slots.
+    remaining = [entries_count]
+
+    def put_result(result: DownloadResult) -> None:
+        result_queue.put(result)
+        if not isinstance(result, DownloadResultProgress) or result.done:
+            remaining[0] -= 1
+            if not remaining[0]:
+                for _ in range(slots_count):
+                    entries_queue.put_nowait(None)
+                concurrency.close()
+
+    pool = _AsyncConnectionPool(max_host_connections)
+
+    try:
+        await asyncio.gather(*(
+            _download_async_slot(slot_id, entries_queue, pool, put_result, progress_interval, buffer_size, sync, concurrency, bandwidth, mirrors, retries)
+            for slot_id in range(slots_count)
+        ))
+    finally:
+        pool.close()
+
+
+async def _download_async_slot(
+    slot_id: int,
+    entries_queue: "asyncio.Queue[Optional[_DownloadEntry]]",
+    pool: _AsyncConnectionPool,
+    put_result,
+    progress_interval: Optional[float],
+    buffer_size: int,
+    sync: _DownloadSync,
+    concurrency: _DownloadConcurrency,
+    bandwidth: _DownloadBandwidth,
+    mirrors: _DownloadMirrors,
+    retries: _DownloadRetries
+) -> None:
+    """A single download slot of the asyncio engine, this is the equivalent of the 
+    download thread and follows the same logic. File operations that may block, like
+    waiting for a lock, writing, syncing and hashing files, are run in the default 
+    executor of the loop, so they don't stall the other slots.
+    """
+
+    loop = asyncio.get_running_loop()
+    buffer_cap = buffer_size
+    buffer = memoryview(bytearray(buffer_cap))
+    timeout = socket.getdefaulttimeout()
+
+    speed = _DownloadSpeed()
+
+    while True:
+
+        await concurrency.acquire_async()
+        raw_entry = await entries_queue.get()
+
+        # None is a sentinel to stop the slot, it should be consumed ONCE.
+        if raw_entry is None:
+            concurrency.release()
+            break
+
+        raw_entry = mirrors.select(raw_entry)
+        entry = raw_entry.entry
+        read_cap = bandwidth.read_size(raw_entry.read_size(buffer_cap))
+        url_parsed = urllib.parse.urlparse(entry.url)
+        target = url_parsed.path or "/"
+        if url_parsed.query:
+            target += f"?{url_parsed.query}"
+        
+        # Wait for other processes that may be downloading the same file, without 
+        # blocking the event loop, if the file has been downloaded meanwhile, it's reused.
+        dl_file = raw_entry.open_file(sync)
+        try:
+            if not dl_file.lock(False):
+                await loop.run_in_executor(None, dl_file.lock, True)
+            done, error, error_origin = await loop.run_in_executor(None, dl_file.reused), None, None
+        except OSError as e:
+            done, error, error_origin = True, DownloadResultError.CONNECTION, e
+        if done:
+            result = await loop.run_in_executor(None, dl_file.complete, slot_id, error, error_origin, speed.speed)
+            if result is not None:
+                put_result(result)
+            concurrency.release()
+            continue
+
+        last_error: Optional[str] = None
+        last_error_origin: Optional[Exception] = None
+        retry_after: Optional[float] = None
+        try_num = 0
+
+        while True:
+
+            if last_error is not None:
+
+                if raw_entry.mirrors:
+                    # Fail over to a mirror instead of retrying, the partial file is kept.
+                    entries_queue.put_nowait(mirrors.failover(raw_entry))
+                    await loop.run_in_executor(None, dl_file.release)
+                    dl_file = None
+                    break
+
+                delay = retries.delay(try_num, last_error, retry_after)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+
+            try_num += 1
+            retry_after = None
+
+            conn = None
+
+            try:
+
+                request = (
+                    f"GET {target} HTTP/1.1\r\n"
+                    f"Host: {url_parsed.netloc}\r\n"
+                    f"Accept-Encoding: identity\r\n"
+                    + "".join(f"{k}: {v}\r\n" for k, v in dl_file.request_headers().items()) +
+                    f"\r\n"
+                ).encode("iso-8859-1")
+
+                request_time = time.monotonic()
+                conn = await pool.acquire(raw_entry, timeout)
+                conn.writer.write(request)
+                await _async_timeout(conn.writer.drain(), timeout)
+
+                status, headers = await _async_read_head(conn.reader, timeout)
+                mirrors.record(entry.url, time.monotonic() - request_time)
+                body = _async_read_body(conn.reader, headers, read_cap, timeout)
+                reusable = headers.get("connection", "").lower() != "close" and \
+                    ("content-length" in headers or "transfer-encoding" in headers)
+
+                # Resuming a partial file with a SHA-1 reads it back.
+                if not await loop.run_in_executor(None, dl_file.accept, status, headers.get("content-range"), _response_validator(headers), buffer):
+
+                    # Skip all bytes in the stream, and allow further request.
+                    async for _ in body:
+                        pass
+                    
+                    if not reusable:
+                        conn.close()
+                    await pool.release(raw_entry, conn if reusable else None)
+                    conn = None
+
+                    if dl_file.stale:
+                        # The partial file has been discarded, restart immediately.
+                        try_num -= 1
+                        last_error = None
+                        continue
+
+                    if status == 301 or status == 302:
+                        redirect_url = headers.get("location")
+                        if redirect_url is not None:
+                            entries_queue.put_nowait(raw_entry.redirect(redirect_url))
+                            await loop.run_in_executor(None, dl_file.release)
+                            dl_file = None
+                            break  # Abort on redirect
+
+                    last_error = _status_error(status)
+                    last_error_origin = None
+                    if last_error == DownloadResultError.THROTTLED:
+                        retry_after = _parse_retry_after(headers.get("retry-after"))
+                        concurrency.feed(0, True)
+                    continue
+
+                async for data in body:
+
+                    read_len = len(data)
+                    speed.update(read_len)
+                    concurrency.feed(read_len)
+                    if not await loop.run_in_executor(None, dl_file.write, data):
+                        # The rest of the response is not needed.
+                        reusable = False
+                        break
+
+                    delay = bandwidth.reserve(raw_entry.host, read_len)
+                    if delay:
+                        await asyncio.sleep(delay)
+
+                    if speed.progress_due(progress_interval):
+                        put_result(DownloadResultProgress(slot_id, entry, dl_file.size, speed.speed, False))
+                
+                if not reusable:
+                    conn.close()
+                await pool.release(raw_entry, conn if reusable else None)
+                conn = None
+
+                last_error = await loop.run_in_executor(None, dl_file.finish)
+                if last_error is None:
+                    break
+
+            except (ConnectionError, OSError, HTTPException, asyncio.IncompleteReadError) as e:
+
+                # Throw away the potentially broken connection.
+                if conn is not None:
+                    conn.close()
+                    await pool.release(raw_entry, None)
+                concurrency.feed(0, True)
+                mirrors.record(entry.url, None)
+
+                # Keep the partial file in order to resume it on next try.
+                await loop.run_in_executor(None, dl_file.abort)
+
+                last_error = DownloadResultError.CONNECTION
+                last_error_origin = e
+
+        # No file if the entry has been redirected.
+        if dl_file is not None:
+            # The last segment of a segmented entry checks the whole file.
+            result = await loop.run_in_executor(None, dl_file.complete, slot_id, last_error, last_error_origin, speed.speed)
+            if result is not None:
+                put_result(result)
+
+        concurrency.release()
@@ -6,7 +6,6 @@ The NeoForge support is still unstable API.
 from urllib import parse as url_parse
 from zipfile import ZipFile
 from pathlib import Path
-from io import BytesIO
 import subprocess
 import shutil
 import json
@@ -16,7 +15,7 @@ from .standard import parse_download_entry, LIBRARIES_URL, \
     Context, VersionHandle, Version, Watcher, VersionNotFoundError
 
 from .util import calc_input_sha1, LibrarySpecifier
-from .http import http_request, HttpError
+from .http import http_request, HttpError, HttpResponse
 
 from typing import Dict, Optional, List
 
@@ -92,6 +91,11 @@ class ForgeVersion(Version):
         # Finally define the full version id.
         self.version = f"{self.prefix}-{self.forge_version}"
 
+    def _hold_metadata(self, version: VersionHandle) -> bool:
+        # The fetched version is only complete once post processed, other processes 
+        # waiting for it must not load it before.
+        return version.id == self.version and self._forge_post_info is not None
+
     def _load_version(self, version: VersionHandle, watcher: Watcher) -> bool:
         if version.id == self.version:
             return version.read_metadata_file()
@@ -123,10 +127,10 @@ class ForgeVersion(Version):
         }.get(game_version, [])
 
         # Iterate suffix and find the first install JAR that works.
-        install_jar = None
+        install_res = None
         for suffix in suffixes:
             try:
-                install_jar = request_install_jar(f"{self.forge_version}{suffix}", _repo=self._forge_repo)
+                install_res = request_install_jar(f"{self.forge_version}{suffix}", _repo=self._forge_repo)
                 break
             except HttpError as error:
                 if error.res.status != 404:
@@ -134,10 +138,12 @@ class ForgeVersion(Version):
                 # Silently ignore if the file was not found or forbidden.
                 pass
         
-        if install_jar is None:
+        if install_res is None:
             raise VersionNotFoundError(version.id)
         
-        with install_jar:
+        # The zip file doesn't close the spooled file it's given, the response does.
+        assert install_res.file is not None
+        with install_res, ZipFile(install_res.file) as install_jar:
 
             # The install profiles comes in multiples forms:
             # 
@@ -274,50 +280,68 @@ class ForgeVersion(Version):
     
     def _resolve_jar(self, watcher: Watcher) -> None:
         super()._resolve_jar(watcher)
-        self._finalize_forge(watcher)
-    
-    def _finalize_forge(self, watcher: Watcher) -> None:
-        try:
-            self._finalize_forge_internal(watcher)
-        except:
-            # We just intercept errors and remove the version metadata in case of errors,
-            # this allows us to re-run the whole install on next attempt.
-            try:
-                self._hierarchy[0].metadata_file().unlink()
-            except FileNotFoundError:
-                pass  # Not a problem if the file isn't present.
-            raise
-
-    def _finalize_forge_internal(self, watcher: Watcher) -> None:
-        """This step finalize the forge installation, after both JVM and version's JAR
-        files has been resolved. This is not always used, it depends on installer's
-        version.
-        """
 
         info = self._forge_post_info
         if info is None:
             return
         
-        assert self._jvm_path is not None, "_resolve_jvm(...) missing"
         assert self._jar_path is not None, "_resolve_jar(...) missing"
-        
-        # Download JVM files and version's JAR. This is used for finalization.
-        self._download(watcher)
 
         # Additional missing variables, the version's jar file is the same as the vanilla
         # one, so we use its path.
         info.variables["SIDE"] = "client"
         info.variables["MINECRAFT_JAR"] = str(self._jar_path.absolute())
 
-        def replace_install_args(txt: str) -> str:
-            txt = txt.format_map(info.variables)
-            # Replace the pattern [lib name] with lib path.
-            if txt[0] == "[" and txt[-1] == "]":
-                spec = LibrarySpecifier.from_str(txt[1:-1])
-                txt = str((self.context.libraries_dir / spec.file_path()).absolute())
-            elif txt[0] == "'" and txt[-1] == "'":
-                txt = txt[1:-1]
-            return txt
+        # Libraries generated by processors, like the forge client JAR, have no URL and
+        # are not yet present when resolved, they are only required once processed.
+        libraries_dir = self.context.libraries_dir.absolute()
+        for processor in info.processors:
+            for arg in (*processor.args, *processor.sha1):
+                path = Path(self._replace_install_args(info, arg))
+                if libraries_dir in path.parents:
+                    self._generated_libs.add(path)
+
+        # Files currently added are needed for post processing: JVM, version's JAR and
+        # libraries of the installer, post processing starts as soon as downloaded.
+        self._dl.set_group("forge")
+        self._dl_groups["forge"] = self._finalize_forge
+    
+    def _finalize_forge(self, watcher: Watcher, downloaded: bool) -> None:
+        try:
+            if not downloaded:
+                # The download error is raised once all other entries are downloaded.
+                self._remove_forge_metadata()
+                return
+            try:
+                self._finalize_forge_internal(watcher)
+                self._check_generated_libraries(watcher)
+            except:
+                self._remove_forge_metadata()
+                raise
+        finally:
+            # The version is complete, other processes no longer need to wait for the
+            # rest of this install.
+            self._release_metadata()
+
+    def _remove_forge_metadata(self) -> None:
+        # We just remove the version metadata in case of errors, this allows us to 
+        # re-run the whole install on next attempt.
+        try:
+            self._hierarchy[0].metadata_file().unlink()
+        except FileNotFoundError:
+            pass  # Not a problem if the file isn't present.
+
+    def _finalize_forge_internal(self, watcher: Watcher) -> None:
+        """This step finalize the forge installation, once both JVM, version's JAR and
+        installer's libraries have been downloaded. This is not always used, it depends
+        on installer's version.
+        """
+
+        info = self._forge_post_info
+        if info is None:
+            return
+        
+        assert self._jvm_path is not None, "_resolve_jvm(...) missing"
 
         for processor in info.processors:
 
@@ -354,7 +378,7 @@ class ForgeVersion(Version):
                 str(self._jvm_path.absolute()),
                 "-cp", os.pathsep.join([str(jar_path), *(str(info.libraries[lib_name].absolute()) for lib_name in processor.class_path)]),
                 main_class,
-                *(replace_install_args(arg) for arg in processor.args)
+                *(self._replace_install_args(info, arg) for arg in processor.args)
             ]
 
             watcher.handle(ForgePostProcessingEvent(task))
@@ -365,8 +389,8 @@ class ForgeVersion(Version):
             
             # If there are sha1, check them.
             for lib_name, expected_sha1 in processor.sha1.items():
-                lib_name = replace_install_args(lib_name)
-                expected_sha1 = replace_install_args(expected_sha1)
+                lib_name = self._replace_install_args(info, lib_name)
+                expected_sha1 = self._replace_install_args(info, expected_sha1)
                 with open(lib_name, "rb") as fp:
                     actual_sha1 = calc_input_sha1(fp)
                     if actual_sha1 != expected_sha1:
@@ -377,6 +401,19 @@ class ForgeVersion(Version):
 
         watcher.handle(ForgePostProcessedEvent())
 
+    def _replace_install_args(self, info: "ForgePostInfo", txt: str) -> str:
+        """Replace variables in the given processor argument, and library specifiers
+        between brackets by their path.
+        """
+        txt = txt.format_map(info.variables)
+        # Replace the pattern [lib name] with lib path.
+        if txt[0] == "[" and txt[-1] == "]":
+            spec = LibrarySpecifier.from_str(txt[1:-1])
+            txt = str((self.context.libraries_dir / spec.file_path()).absolute())
+        elif txt[0] == "'" and txt[-1] == "'":
+            txt = txt[1:-1]
+        return txt
+
 
 class ForgePostProcessor:
     """Describe the execution model of a post process.
@@ -494,13 +531,14 @@ def request_maven_versions(*, _repo: str = _FORGE_REPO) -> List[str]:
     return versions
 
 
-def request_install_jar(version: str, *, _repo: str = _FORGE_REPO) -> ZipFile:
-    """Internal function to request the installation JAR file.
+def request_install_jar(version: str, *, _repo: str = _FORGE_REPO) -> HttpResponse:
+    """Internal function to request the installation JAR file, it's streamed because 
+    it can be large. The returned response's file can be opened with `ZipFile`, but
+    the response must be closed to release the anonymous temporary file, closing the
+    zip file doesn't close it.
     """
-    res = http_request("GET", f"{_repo}/{version}/forge-{version}-installer.jar",
-        accept="application/java-archive")
-    
-    return ZipFile(BytesIO(res.data))
+    return http_request("GET", f"{_repo}/{version}/forge-{version}-installer.jar",
+        accept="application/java-archive", stream=True)
 
 
 def zip_extract_file(zf: ZipFile, entry_path: str, dst_path: Path):
@@ -2,38 +2,202 @@
 """
 
 from urllib.error import HTTPError, URLError
-from http.client import HTTPResponse
+from email.utils import parsedate_to_datetime
+from http.client import HTTPConnection, HTTPSConnection, HTTPResponse, HTTPException
+from functools import lru_cache
+from threading import Lock
+from pathlib import Path
+from uuid import uuid4
 import urllib.request
 import urllib.parse
+import tempfile
+import hashlib
 import json
+import time
+import zlib
 import ssl
+import io
+import os
 
 from . import LAUNCHER_VERSION
 
-from typing import Optional, Any, cast
+from typing import Optional, Any, Callable, Dict, Iterator, List, Tuple, Union, BinaryIO, cast
 
 
-__all__ = ["HttpResponse", "HttpError", "http_request"]
+__all__ = ["HttpResponse", "HttpError", "HttpCache", "http_request", "http_cache", "url_overrides", 
+    "override_url", "ssl_context"]
+
+
+# Base URLs overridden for all requests, URLs starting with a key are requested with 
+# this prefix replaced by the value, this is used to point launchers to a cache server.
+url_overrides: Dict[str, str] = {}
+
+
+def override_url(url: str) -> str:
+    """Return the given URL with its base URL overridden, if relevant.
+    """
+    for prefix, override in url_overrides.items():
+        if url.startswith(prefix):
+            return f"{override}{url[len(prefix):]}"
+    return url
+
+
+# The cache used for requests, none by default (see `HttpCache`).
+http_cache: "Optional[HttpCache]" = None
+
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+# Content encodings that are decoded, and accepted by default.
+DECODED_ENCODINGS = ("gzip", "x-gzip", "deflate") if brotli is None else ("gzip", "x-gzip", "deflate", "br")
+ACCEPT_ENCODING = "gzip, deflate" if brotli is None else "gzip, deflate, br"
+_DECODE_ERRORS = (zlib.error,) if brotli is None else (zlib.error, brotli.error)
+
+# Maximum size of streamed response data kept in memory, larger data is moved to a 
+# temporary file.
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+class _BrotliDecompressor:
+    """Internal brotli decompressor with the same interface as zlib's decompressors.
+    """
+
+    def __init__(self) -> None:
+        self.inner = brotli.Decompressor()
+    
+    def decompress(self, data: bytes) -> bytes:
+        return self.inner.process(data)
+    
+    def flush(self) -> bytes:
+        return b""
+
+
+def _read_chunks(res: HTTPResponse, encoding: Optional[str]) -> Iterator[bytes]:
+    """Read the whole data of the given response by chunks, while decoding it with the
+    given content encoding, that must be one of the decoded encodings, if any.
+
+    :raises HTTPException: If the data is invalid for its encoding.
+    """
+
+    data = res.read(65536)
+    if encoding is None:
+        while data:
+            yield data
+            data = res.read(65536)
+        return
+    elif encoding in ("gzip", "x-gzip"):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        # Some servers send raw deflate data, without the zlib header.
+        zlib_header = len(data) >= 2 and data[0] & 0x0F == 8 and (data[0] << 8 | data[1]) % 31 == 0
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS)
+    else:
+        decompressor = _BrotliDecompressor()
+    
+    try:
+        while data:
+            yield decompressor.decompress(data)
+            data = res.read(65536)
+        yield decompressor.flush()
+    except _DECODE_ERRORS as error:
+        raise HTTPException(f"invalid {encoding} content: {error}")
+
+
+def _spool(chunks: Iterator[bytes]) -> BinaryIO:
+    """Write the given chunks to a file, kept in memory until it exceeds the spool size,
+    then moved to an anonymous temporary file. The file is returned at its start.
+    """
+
+    file: BinaryIO = io.BytesIO()
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        if size > SPOOL_MAX_SIZE and isinstance(file, io.BytesIO):
+            tmp_file = cast(BinaryIO, tempfile.TemporaryFile())
+            tmp_file.write(file.getbuffer())
+            file = tmp_file
+        file.write(chunk)
+
+    file.seek(0)
+    return file
 
 
 class HttpResponse:
     """An HTTP response containing the status, data and received headers.
+
+    If the data has been compressed by the server with gzip, deflate or brotli (only if
+    the brotli package is installed), it's decoded while being read, the headers then 
+    no longer have the content encoding and length.
+
+    A streamed response doesn't keep its data in memory, it's spooled to the `file`
+    instead, if larger than `SPOOL_MAX_SIZE`. This file can be given directly to 
+    readers like `ZipFile` and is closed with the response.
     """
     
-    def __init__(self, res: Optional[HTTPResponse]) -> None:
+    def __init__(self, res: Optional[HTTPResponse], *, stream: bool = False) -> None:
 
         self.status = 0 if res is None else res.status
-        self.data = b"null" if res is None else res.read()
+        self.file: Optional[BinaryIO] = None
+        self._data = b"null"
         self.headers = {}
 
         if res is not None:
+
+            encoding = None
             for header_name, header_value in res.getheaders():
+                if header_name.lower() == "content-encoding":
+                    encoding = header_value.strip().lower()
                 self.headers[header_name] = header_value
+            
+            if encoding in DECODED_ENCODINGS:
+                self.headers = {k: v for k, v in self.headers.items() if k.lower() not in ("content-encoding", "content-length")}
+            else:
+                encoding = None
+            
+            if stream:
+                self.file = _spool(_read_chunks(res, encoding))
+            elif encoding is not None:
+                self._data = b"".join(_read_chunks(res, encoding))
+            else:
+                self._data = res.read()
+
+    @property
+    def data(self) -> bytes:
+        """The whole data of the response, read from the file if streamed.
+        """
+        if self.file is not None:
+            self.file.seek(0)
+            return self.file.read()
+        return self._data
+    
+    @data.setter
+    def data(self, data: bytes) -> None:
+        self.close()
+        self._data = data
+
+    def close(self) -> None:
+        """Close the file of a streamed response, its data is no longer available.
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def __enter__(self) -> "HttpResponse":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
 
     def json(self) -> Any:
         """Parse the data as JSON. This may raise a JSONDecodeError.
         """
-        return json.loads(self.data)
+        if self.file is not None:
+            self.file.seek(0)
+            return json.load(self.file)
+        return json.loads(self._data)
     
     def text(self) -> str:
         """Parse the data as UTF-8 text.
@@ -67,13 +231,26 @@ def http_request(method: str, url: str, *,
     data: Optional[bytes] = None,
     headers: Optional[dict] = None,
     accept: Optional[str] = None,
-    content_type: Optional[str] = None
+    content_type: Optional[str] = None,
+    raw_url: bool = False,
+    cache: bool = True,
+    stream: bool = False
 ) -> HttpResponse:
     """Make a synchronous HTTP request.
 
+    :param raw_url: Set to true to request the given URL as-is, without overriding its
+    base URL (see `url_overrides`).
+    :param cache: Set to false to not use the HTTP cache, if any (see `http_cache`). The
+    cache is only used for GET requests without data, authorization, range or 
+    conditional headers. 
+    :param stream: Set to true to stream a successful response's data to a file instead
+    of keeping it in memory (see `HttpResponse`), streamed requests are not cached.
     :return: The response returned should've a status of 2xx.
     :raises HttpError: An error wrapping a response that is not of status 2xx.
     """
+
+    if not raw_url:
+        url = override_url(url)
     
     if headers is None:
         headers = {}
@@ -83,18 +260,350 @@ def http_request(method: str, url: str, *,
         headers["Content-Type"] = content_type
     if "User-Agent" not in headers:
         headers["User-Agent"] = f"portablemc/{LAUNCHER_VERSION}"
+    if "Accept-Encoding" not in headers:
+        headers["Accept-Encoding"] = ACCEPT_ENCODING
 
-    try:
-        import certifi
-        ctx = ssl.create_default_context(cafile=certifi.where())
-    except ImportError:
-        ctx = None
+    if cache and not stream and http_cache is not None and method == "GET" and data is None and \
+        not any(name.lower() in HttpCache.BYPASS_HEADERS for name in headers):
+        return http_cache.request(url, headers, lambda request_headers: _request(method, url, data, request_headers, False))
+    
+    return _request(method, url, data, headers, stream)
+
+
+def _request(method: str, url: str, data: Optional[bytes], headers: dict, stream: bool) -> HttpResponse:
+    """Internal function to make the request of `http_request` without cache.
+    """
+
+    if http_cache is not None and http_cache.offline:
+        raise HttpError(HttpResponse(None), method, url, URLError("offline"))
+
+    url_parsed = urllib.parse.urlsplit(url)
+    if url_parsed.scheme in ("http", "https") and not _has_proxy(url_parsed):
+        return _client.request(method, url, data, headers, stream)
 
     try:
         req = urllib.request.Request(url, data, headers, method=method)
-        res: HTTPResponse = urllib.request.urlopen(req, context=ctx)
-        return HttpResponse(res)
+        res: HTTPResponse = urllib.request.urlopen(req, context=ssl_context())
+        return HttpResponse(res, stream=stream)
     except HTTPError as error:
         raise HttpError(HttpResponse(cast(HTTPResponse, error)), method, url, error)
     except URLError as error:
         raise HttpError(HttpResponse(None), method, url, error)
+
+
+class HttpCache:
+    """A persistent cache of HTTP responses, used by `http_request` when set as the 
+    global `http_cache`. Successful responses are stored with their freshness lifetime,
+    computed from the per-URL policies if any, or from the response's headers. Fresh
+    responses are returned without any request, outdated ones are revalidated with a
+    conditional request if they have a validator (ETag or Last-Modified).
+
+    If the server can't be reached, or returns a server error, the cached response is
+    returned even if outdated. In offline mode, cached responses are always returned,
+    no request is made at all, and other requests fail with a network error.
+    """
+
+    # Requests with such headers are not cached.
+    BYPASS_HEADERS = ("authorization", "range", "if-none-match", "if-modified-since")
+    # Maximum heuristic freshness lifetime, when the server doesn't give one.
+    MAX_HEURISTIC_AGE = 86400.0
+
+    def __init__(self, dir: Path, *, 
+        policies: Optional[Dict[str, float]] = None, 
+        offline: bool = False
+    ) -> None:
+        """
+        :param dir: The directory where responses are stored.
+        :param policies: Freshness lifetimes, in seconds, of responses to URLs starting
+        with the given prefixes, overriding the lifetime given by the server.
+        :param offline: Set to true to never make any request.
+        """
+        self.dir = dir
+        self.policies = {} if policies is None else policies
+        self.offline = offline
+
+    def request(self, url: str, headers: dict, send: Callable[[dict], HttpResponse]) -> HttpResponse:
+        """Return the response of the given URL, from the cache if possible, or with 
+        the given function that makes the request with the given headers.
+
+        :raises HttpError: From the request, if no cached response can be used.
+        """
+
+        key = hashlib.sha1(url.encode()).hexdigest()
+        record = self._load(key)
+
+        now = time.time()
+        if record is not None and (self.offline or now - record["time"] < record["max_age"]):
+            return _cached_response(record)
+
+        if record is not None:
+            headers = dict(headers)
+            if record["etag"] is not None:
+                headers["If-None-Match"] = record["etag"]
+            if record["last_modified"] is not None:
+                headers["If-Modified-Since"] = record["last_modified"]
+
+        try:
+            res = send(headers)
+        except HttpError as error:
+            if record is not None:
+                if error.res.status == 304:
+                    # Not modified, the record is fresh again with the new headers, 
+                    # except those describing the body.
+                    headers = record["headers"]
+                    for name, value in error.res.headers.items():
+                        if name.lower() not in ("content-length", "content-encoding", "transfer-encoding"):
+                            headers = {k: v for k, v in headers.items() if k.lower() != name.lower()}
+                            headers[name] = value
+                    record["headers"] = headers
+                    self._store(key, url, headers, record["data"])
+                    return _cached_response(record)
+                elif error.res.status == 0 or error.res.status >= 500:
+                    return _cached_response(record)
+            raise
+
+        if res.status == 200:
+            self._store(key, url, res.headers, res.data)
+
+        return res
+
+    def _load(self, key: str) -> Optional[dict]:
+        """Load the record of the given key, none if absent or invalid.
+        """
+        try:
+            with (self.dir / f"{key}.json").open("rt") as fp:
+                record = json.load(fp)
+            data = (self.dir / f"{key}.bin").read_bytes()
+            if len(data) != record["size"]:
+                return None  # Not the data of this record.
+            record["data"] = data
+            return record
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _store(self, key: str, url: str, headers: Dict[str, str], data: bytes) -> None:
+        """Store the given response under the given key, unless the response forbids it,
+        files are atomically replaced. Errors are ignored.
+        """
+
+        lower_headers = {name.lower(): value for name, value in headers.items()}
+        cache_control = [d.strip().lower() for d in lower_headers.get("cache-control", "").split(",")]
+        if "no-store" in cache_control:
+            return
+
+        record = {
+            "url": url,
+            "time": time.time(),
+            "max_age": self._max_age(url, lower_headers, cache_control),
+            "etag": lower_headers.get("etag"),
+            "last_modified": lower_headers.get("last-modified"),
+            "headers": headers,
+            "size": len(data),
+        }
+
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            for file, content in ((self.dir / f"{key}.bin", data), (self.dir / f"{key}.json", json.dumps(record).encode())):
+                # Unique name, because the same response may be stored by multiple threads.
+                tmp_file = file.with_name(f"{file.name}.{uuid4().hex}.tmp")
+                try:
+                    tmp_file.write_bytes(content)
+                    os.replace(tmp_file, file)
+                except:
+                    tmp_file.unlink(missing_ok=True)
+                    raise
+        except OSError:
+            pass  # The response is just not cached, in a read-only directory for example.
+
+    def _max_age(self, url: str, headers: Dict[str, str], cache_control: List[str]) -> float:
+        """Compute the freshness lifetime of a response, in seconds.
+        """
+
+        for prefix, max_age in self.policies.items():
+            if url.startswith(prefix):
+                return max_age
+        
+        if "no-cache" in cache_control:
+            return 0.0
+
+        for directive in cache_control:
+            if directive.startswith("max-age="):
+                try:
+                    return max(0.0, float(directive[8:]))
+                except ValueError:
+                    return 0.0
+        
+        date = _parse_date(headers.get("date")) or time.time()
+        expires = _parse_date(headers.get("expires"))
+        if expires is not None:
+            return max(0.0, expires - date)
+        
+        # Heuristic freshness of 10% of the time since last modification.
+        last_modified = _parse_date(headers.get("last-modified"))
+        if last_modified is not None:
+            return min(self.MAX_HEURISTIC_AGE, max(0.0, (date - last_modified) / 10))
+        
+        return 0.0
+
+
+def _cached_response(record: dict) -> HttpResponse:
+    """Internal function to construct a response from a cache record.
+    """
+    res = HttpResponse(None)
+    res.status = 200
+    res.data = record["data"]
+    res.headers = dict(record["headers"])
+    return res
+
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    """Parse an HTTP date to a timestamp, none if absent or invalid.
+    """
+    if value is None:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+@lru_cache(maxsize=None)
+def ssl_context() -> Optional[ssl.SSLContext]:
+    """Return the SSL context used for all HTTPS connections, it uses certifi if 
+    installed, the context is created once because loading certificates is slow.
+    """
+    try:
+        import certifi
+        return ssl.create_default_context(cafile=certifi.where())
+    except ImportError:
+        return None
+
+
+def _has_proxy(url_parsed: urllib.parse.SplitResult) -> bool:
+    """Return true if the given URL should be requested through a proxy configured in
+    the environment, such requests are left to urllib.
+    """
+    return url_parsed.scheme in urllib.request.getproxies() and \
+        not urllib.request.proxy_bypass(url_parsed.hostname or "")
+
+
+class _HttpClient:
+    """Internal HTTP client used by `http_request`, keep-alive connections are kept 
+    idle after each request and reused by later requests to the same origin, from any
+    thread. Redirections are followed like urllib does.
+    """
+
+    # Maximum number of idle connections kept for each origin.
+    MAX_IDLE = 4
+    # Maximum number of redirections followed for a single request.
+    MAX_REDIRECTS = 10
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.idle: Dict[Tuple[str, str], List[Union[HTTPConnection, HTTPSConnection]]] = {}
+
+    def acquire(self, scheme: str, netloc: str, reuse: bool) -> Tuple[Union[HTTPConnection, HTTPSConnection], bool]:
+        """Get an idle connection to the given origin, if allowed, or a new one. Also
+        return true if the connection is reused.
+        """
+        if reuse:
+            with self.lock:
+                idle = self.idle.get((scheme, netloc))
+                if idle:
+                    return idle.pop(), True
+        if scheme == "https":
+            return HTTPSConnection(netloc, context=ssl_context()), False
+        else:
+            return HTTPConnection(netloc), False
+
+    def release(self, scheme: str, netloc: str, conn: Union[HTTPConnection, HTTPSConnection]) -> None:
+        """Keep the given connection idle to be reused, if there is enough room.
+        """
+        with self.lock:
+            idle = self.idle.setdefault((scheme, netloc), [])
+            if len(idle) < self.MAX_IDLE:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        """Close all idle connections.
+        """
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle.clear()
+
+    def request(self, method: str, url: str, data: Optional[bytes], headers: dict, stream: bool) -> HttpResponse:
+        """Make the request, following redirections, and return the response with its
+        whole data, streamed if requested. The errors are raised as by `http_request`.
+        """
+
+        if data is not None and "Content-Type" not in headers:
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        for _ in range(self.MAX_REDIRECTS + 1):
+
+            url_parsed = urllib.parse.urlsplit(url)
+            res, http_res = self._request(method, url, url_parsed, data, headers, stream)
+            
+            location = http_res.headers.get("location") or http_res.headers.get("uri")
+            if res.status in (301, 302, 303, 307, 308) and location is not None:
+                if method in ("GET", "HEAD") or (res.status in (301, 302, 303) and method == "POST"):
+                    # Like urllib, the redirected request has no data.
+                    url = urllib.parse.urljoin(url, location)
+                    if data is not None:
+                        data = None
+                        headers = {k: v for k, v in headers.items() if k.lower() not in ("content-type", "content-length")}
+                    if method == "POST":
+                        method = "GET"
+                    continue
+            
+            if 200 <= res.status < 300:
+                return res
+            
+            break
+
+        raise HttpError(res, method, url, HTTPError(url, res.status, http_res.reason, http_res.headers, None))
+
+    def _request(self, 
+        method: str, 
+        url: str, 
+        url_parsed: urllib.parse.SplitResult, 
+        data: Optional[bytes], 
+        headers: dict,
+        stream: bool
+    ) -> Tuple[HttpResponse, HTTPResponse]:
+
+        scheme, netloc = url_parsed.scheme, url_parsed.netloc
+        target = url_parsed.path or "/"
+        if url_parsed.query:
+            target += f"?{url_parsed.query}"
+
+        # Idle connections may have been closed by the server in the meantime, so only 
+        # requests that can be sent twice are using them and retried on a new connection.
+        idempotent = method in ("GET", "HEAD", "OPTIONS")
+
+        while True:
+            conn, reused = self.acquire(scheme, netloc, idempotent)
+            try:
+                conn.request(method, target, data, headers)
+                http_res = conn.getresponse()
+                # Only successful responses are streamed, others are small.
+                res = HttpResponse(http_res, stream=stream and 200 <= http_res.status < 300)
+            except (OSError, HTTPException) as error:
+                conn.close()
+                if reused:
+                    continue
+                raise HttpError(HttpResponse(None), method, url, URLError(error))
+            
+            if http_res.will_close:
+                conn.close()
+            else:
+                self.release(scheme, netloc, conn)
+            
+            return res, http_res
+
+
+_client = _HttpClient()
@@ -14,8 +14,9 @@ import json
 import re
 import os
 
-from .download import DownloadList, DownloadEntry, DownloadResultProgress, DownloadResultError
-from .util import jvm_bin_filename, merge_dict, calc_input_sha1, LibrarySpecifier
+from .download import DownloadList, DownloadEntry, DownloadResultProgress, DownloadResultError, \
+    DownloadResultGroup, VerifyIndex, DownloadJournal
+from .util import jvm_bin_filename, merge_dict, calc_input_sha1, link_file, LibrarySpecifier, FileLock
 from .auth import AuthSession, OfflineAuthSession
 from .http import http_request, HttpError
 from . import LAUNCHER_NAME, LAUNCHER_VERSION
@@ -62,6 +63,17 @@ class Context:
         self.libraries_dir = main_dir / "libraries"
         self.jvm_dir = main_dir / "jvm"
         self.bin_dir = self.work_dir / "bin"
+        # Store of all downloaded files with known SHA-1, named by their SHA-1, files
+        # are then linked to their expected path. This is the same as assets objects.
+        self.objects_dir = self.assets_dir / "objects"
+        # Index of verified files, to avoid checking each file on each install.
+        self.verify_index_file = main_dir / "portablemc_verify.json"
+        # Journal of the current download, used to resume it if the process is killed.
+        self.download_journal_file = main_dir / "portablemc_journal.jsonl"
+        # Index of the files cached by the cache server, by URL (see `cache` module).
+        self.cache_index_dir = main_dir / "portablemc_cache"
+        # Cache of metadata HTTP responses (see `http.HttpCache`).
+        self.http_cache_dir = main_dir / "portablemc_http_cache"
 
     def get_version(self, version: str) -> "VersionHandle":
         """Get a version's handle.
@@ -128,12 +140,29 @@ class VersionHandle:
         """
         return self.dir / f"{self.id}.jar"
 
+    def metadata_lock(self) -> FileLock:
+        """This function returns the inter-process lock of the version's metadata, it is 
+        held while loading and fetching the metadata, so that processes sharing the same
+        versions directory don't fetch the same version concurrently.
+        """
+        return FileLock(self.dir.with_name(f"{self.id}.lock"))
+
     def write_metadata_file(self) -> None:
         """This function write the metadata file of the version with the internal data.
+        The file is atomically replaced, so it's never seen partially written.
         """
         self.dir.mkdir(parents=True, exist_ok=True)
-        with self.metadata_file().open("wt") as fp:
-            json.dump(self.metadata, fp)
+        # The temporary file is uniquely named and created with the default permissions,
+        # unlike mkstemp that creates it readable only by the owner.
+        metadata_file = self.metadata_file()
+        tmp_file = metadata_file.with_name(f"{metadata_file.name}.{uuid4().hex}.tmp")
+        try:
+            with tmp_file.open("xt") as fp:
+                json.dump(self.metadata, fp)
+            os.replace(tmp_file, metadata_file)
+        except:
+            tmp_file.unlink(missing_ok=True)
+            raise
 
     def read_metadata_file(self) -> bool:
         """This function reads the metadata file and updates the internal data if found.
@@ -241,6 +270,11 @@ class Version:
         self.disable_chat: bool = False
         self.quick_play: Optional[QuickPlay] = None
         self.jvm_path: Optional[Path] = None
+        self.verify_hashes: bool = False
+        self.max_download_rate: Optional[int] = None
+        self.max_host_download_rate: Optional[int] = None
+        self.mirrors: Dict[str, List[str]] = {}
+        self.download_pipeline: Optional[int] = None
         self.libraries_filters: List[Callable[[Dict[LibrarySpecifier, Library]], None]] = []
         self.fixes: Dict[str, Any] = { 
             self.FIX_LEGACY_PROXY: True, 
@@ -271,6 +305,10 @@ class Version:
         self._libs: Dict[LibrarySpecifier, Library] = {}
         self._native_libs: List[Path] = []
         self._class_libs: List[Path] = []
+        # Absolute paths of libraries generated during the download, libraries without
+        # URL are only required to be present once downloaded if their path is here.
+        self._generated_libs: Set[Path] = set()
+        self._generated_libs_missing: List[Tuple[LibrarySpecifier, Path]] = []
 
         # Logger config parsed from metadata
         self._logger_path: Optional[Path] = None
@@ -281,6 +319,11 @@ class Version:
         self._jvm_version: Optional[str] = None
 
         self._dl = DownloadList()
+        # Callbacks called once all entries of a download group are downloaded, with
+        # a boolean indicating if all entries have been successfully downloaded.
+        self._dl_groups: Dict[str, Callable[[Watcher, bool], None]] = {}
+        # Metadata locks kept held after being resolved (see `_hold_metadata`).
+        self._held_locks: List[FileLock] = []
         self._applied_fixes: Dict[str, Any] = {}
 
     def set_auth_offline(self, username: Optional[str], uuid: Optional[str]) -> None:
@@ -313,17 +356,36 @@ class Version:
         watcher = watcher or Watcher()
 
         self._dl.clear()
+        self._dl_groups.clear()
+        self._generated_libs.clear()
+        self._dl.store = self.context.objects_dir
+        index = self._dl.index = VerifyIndex(self.context.verify_index_file)
+        journal = self._dl.journal = DownloadJournal(self.context.download_journal_file)
+        self._dl.verify_hashes = self.verify_hashes
+        self._dl.max_rate = self.max_download_rate
+        self._dl.max_host_rate = self.max_host_download_rate
+        self._dl.mirrors = self.mirrors
+        self._dl.pipeline = self.download_pipeline
         self._applied_fixes.clear()
 
-        self._resolve_version(watcher)
-        self._resolve_metadata(watcher)
-        self._resolve_features(watcher)
-        self._resolve_jvm(watcher)  # JVM added here on purpose to ease implementation of ForgeVersion
-        self._resolve_jar(watcher)
-        self._resolve_assets(watcher)
-        self._resolve_libraries(watcher)
-        self._resolve_logger(watcher)
-        self._download(watcher)
+        try:
+            self._resolve_version(watcher)
+            self._resolve_metadata(watcher)
+            self._resolve_features(watcher)
+            self._resolve_jvm(watcher)  # JVM added here on purpose to ease implementation of ForgeVersion
+            self._resolve_jar(watcher)
+            self._resolve_assets(watcher)
+            self._resolve_libraries(watcher)
+            self._resolve_logger(watcher)
+            self._download(watcher)
+            self._check_generated_libraries(watcher)
+        finally:
+            # Save verified and downloaded files, even on errors, the journal is only
+            # needed if the process is killed before that.
+            index.save()
+            journal.clear()
+            self._release_metadata()
+        
         self._finalize_assets(watcher)
 
         return self._resolve_env(watcher)
@@ -352,13 +414,29 @@ class Version:
             
             watcher.handle(VersionLoadingEvent(version))
 
-            # Get version instance and load/fetch is needed.
+            # Get version instance and load/fetch is needed. This is done while holding
+            # the version's lock, if another process is fetching it we wait and then 
+            # load the version it has fetched.
             handle = self.context.get_version(version)
             fetched = False
-            if not self._load_version(handle, watcher):
-                watcher.handle(VersionFetchingEvent(version))
-                self._fetch_version(handle, watcher)
-                fetched = True
+            lock: Optional[FileLock] = handle.metadata_lock()
+            try:
+                lock.acquire()
+            except OSError:
+                # The lock file can't be created, in a read-only directory for example,
+                # the version is then loaded without lock.
+                lock = None
+            try:
+                if not self._load_version(handle, watcher):
+                    watcher.handle(VersionFetchingEvent(version))
+                    self._fetch_version(handle, watcher)
+                    fetched = True
+            finally:
+                if lock is not None:
+                    if self._hold_metadata(handle):
+                        self._held_locks.append(lock)
+                    else:
+                        lock.release()
             
             watcher.handle(VersionLoadedEvent(version, fetched))
 
@@ -374,6 +452,24 @@ class Version:
 
         self._metadata = hierarchy[0].merge()
 
+    def _hold_metadata(self, version: VersionHandle) -> bool:
+        """This function returns true if the metadata lock of the given version, just 
+        loaded or fetched, should be held until released by `_release_metadata`, instead
+        of being released immediately. This is needed when the fetched version is only 
+        complete once finalized later in the install, so other processes don't use it 
+        before. Held locks are released at the latest at the end of the install.
+
+        The default implementation returns false.
+        """
+        return False
+
+    def _release_metadata(self) -> None:
+        """Release the metadata locks held since resolved, see `_hold_metadata`.
+        """
+        for lock in self._held_locks:
+            lock.release()
+        self._held_locks.clear()
+
     def _load_version(self, version: VersionHandle, watcher: Watcher) -> bool:
         """This function is responsible for loading a version's metadata. Note that 
         implementations are free to load other things beside metadata.
@@ -464,7 +560,9 @@ class Version:
             
             client_dl = version_dls.get("client")
             if client_dl is not None:
-                self._dl.add(parse_download_entry(client_dl, self._jar_path, "metadata: /downloads/client"), verify=True)
+                jar_entry = parse_download_entry(client_dl, self._jar_path, "metadata: /downloads/client")
+                jar_entry.priority = DownloadEntry.PRIORITY_HIGH
+                self._dl.add(jar_entry, verify=True)
                 watcher.handle(JarFoundEvent())
                 return
         
@@ -566,15 +664,11 @@ class Version:
 
         if self._assets_resources_dir is not None:
             for asset_id, asset_file in self._assets.items():
-                dst_file = self._assets_resources_dir / asset_id
-                dst_file.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(str(asset_file), str(dst_file))
+                link_file(asset_file, self._assets_resources_dir / asset_id)
 
         if self._assets_virtual_dir is not None:
             for asset_id, asset_file in self._assets.items():
-                dst_file = self._assets_virtual_dir / asset_id
-                dst_file.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copyfile(str(asset_file), str(dst_file))
+                link_file(asset_file, self._assets_virtual_dir / asset_id)
 
     def _resolve_libraries(self, watcher: Watcher) -> None:
         """Step resolving libraries from version's metadata. 
@@ -590,6 +684,8 @@ class Version:
 
         watcher.handle(LibrariesResolvingEvent())
 
+        self._generated_libs_missing.clear()
+
         # Recursion order is important for libraries resolving, root libraries should
         # be placed first.
         for version in self._hierarchy[0].recurse():
@@ -705,7 +801,9 @@ class Version:
             # get a download error for such libraries.
             if lib_entry is None or not len(lib_entry.url):
                 if not lib_path.is_file():
-                    raise LibraryNotFoundError(spec)
+                    if lib_path.absolute() not in self._generated_libs:
+                        raise LibraryNotFoundError(spec)
+                    self._generated_libs_missing.append((spec, lib_path))
             else:
                 lib_entry.dst = lib_path
                 lib_entry.name = str(spec)
@@ -909,6 +1007,7 @@ class Version:
                 jvm_download_raw = jvm_file.get("downloads", {}).get("raw")
                 jvm_download_entry = parse_download_entry(jvm_download_raw, jvm_file_path, f"jvm manifest: /files/{jvm_file_path_prefix}/downloads/raw")
                 jvm_download_entry.executable = jvm_file.get("executable", False)
+                jvm_download_entry.priority = DownloadEntry.PRIORITY_HIGH
 
                 self._dl.add(jvm_download_entry, verify=True)
         
@@ -953,18 +1052,29 @@ class Version:
         watcher.handle(JvmLoadedEvent(version, JvmLoadedEvent.BUILTIN))
 
     def _download(self, watcher: Watcher) -> None:
+
+        # Existing files are hashed before, and added to download if invalid.
+        self._dl.check_hashes(os.cpu_count() or 1)
+
+        # Groups without entry to download are already complete.
+        groups = self._dl.groups()
+        for group in list(self._dl_groups):
+            if group not in groups:
+                self._dl_groups.pop(group)(watcher, True)
         
         entries_count = len(self._dl.entries)
         if not entries_count:
             return
         
-        # Note: do not create more thread than available entries.
+        # Note: do not create more thread than available entries. Only some threads
+        # are initially active, this number is then adapted to the throughput.
         threads_count = min(entries_count, (os.cpu_count() or 1) * 4)
+        concurrency = min(threads_count, os.cpu_count() or 1)
         errors = []
 
-        watcher.handle(DownloadStartEvent(threads_count, entries_count, self._dl.size))
+        watcher.handle(DownloadStartEvent(threads_count, entries_count, self._dl.size, concurrency))
 
-        for result_count, result in self._dl.download(threads_count, partial_progress=True):
+        for result_count, result in self._dl.download(threads_count, partial_progress=True, concurrency=concurrency):
             if isinstance(result, DownloadResultProgress):
                 watcher.handle(DownloadProgressEvent(
                     result.thread_id,
@@ -976,6 +1086,10 @@ class Version:
                 ))
             elif isinstance(result, DownloadResultError):
                 errors.append((result.entry, result.code, result.origin))
+            elif isinstance(result, DownloadResultGroup):
+                group_callback = self._dl_groups.pop(result.group, None)
+                if group_callback is not None:
+                    group_callback(watcher, not result.errors_count)
 
         # If errors are present, raise an error.
         if len(errors):
@@ -987,6 +1101,14 @@ class Version:
         
         watcher.handle(DownloadCompleteEvent())
 
+    def _check_generated_libraries(self, watcher: Watcher) -> None:
+        """Step checking that libraries without download URL, that were missing when 
+        resolved but generated during the download, are now present.
+        """
+        for spec, lib_path in self._generated_libs_missing:
+            if not lib_path.is_file():
+                raise LibraryNotFoundError(spec)
+
     def _resolve_env(self, watcher: Watcher) -> Environment:
         """Step for computing correct environment to run the game as configured in this 
         version's instance.
@@ -1375,11 +1497,12 @@ class JvmLoadedEvent:
         self.kind = kind
 
 class DownloadStartEvent:
-    __slots__ = "threads_count", "entries_count", "size"
-    def __init__(self, threads_count: int, entries_count: int, size: int) -> None:
+    __slots__ = "threads_count", "entries_count", "size", "concurrency"
+    def __init__(self, threads_count: int, entries_count: int, size: int, concurrency: int) -> None:
         self.threads_count = threads_count
         self.entries_count = entries_count
         self.size = size
+        self.concurrency = concurrency
 
 class DownloadProgressEvent:
     __slots__ = "thread_id", "count", "entry", "size", "speed", "done"
@@ -1403,6 +1526,9 @@ class VersionManifest:
     def __init__(self, cache_file: Optional[Path] = None) -> None:
         self.data: Optional[dict] = None
         self.cache_file = cache_file
+        # Indexes of versions by id and by type, built once when data is loaded.
+        self._versions_by_id: Dict[str, dict] = {}
+        self._versions_by_type: Dict[str, List[dict]] = {}
 
     def _ensure_data(self) -> dict:
         """Internal method that ensure that the manifest data is up-to-date.
@@ -1450,9 +1576,21 @@ class VersionManifest:
                     self.data = cache_data
                 else:
                     raise
+            
+            self._build_indexes(self.data)
 
         return self.data
 
+    def _build_indexes(self, data: dict) -> None:
+        """Internal method to index the versions of the given manifest data, the order
+        of the manifest is kept for versions of the same type.
+        """
+        self._versions_by_id.clear()
+        self._versions_by_type.clear()
+        for version_data in data["versions"]:
+            self._versions_by_id.setdefault(version_data["id"], version_data)
+            self._versions_by_type.setdefault(version_data["type"], []).append(version_data)
+
     def is_alias(self, version: str) -> bool:
         """Basic function that returns true if the given version is an release or
         snapshot alias.
@@ -1485,13 +1623,20 @@ class VersionManifest:
         :raises HttpError: Underlying HTTP error if manifest could not be requested.
         """
         version, _alias = self.filter_latest(version)
-        for version_data in self._ensure_data()["versions"]:
-            if version_data["id"] == version:
-                return version_data
-        return None
+        self._ensure_data()
+        return self._versions_by_id.get(version)
 
-    def all_versions(self) -> list:
-        return self._ensure_data()["versions"]
+    def all_versions(self, version_type: Optional[str] = None) -> list:
+        """Get all the manifest's versions metadata, in the manifest's order.
+
+        :param version_type: If given, only versions of this type are returned, like 
+        `release` or `snapshot`.
+        :raises HttpError: Underlying HTTP error if manifest could not be requested.
+        """
+        data = self._ensure_data()
+        if version_type is None:
+            return data["versions"]
+        return self._versions_by_type.get(version_type, [])
 
 
 class StandardRunner(Runner):
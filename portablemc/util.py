@@ -3,7 +3,12 @@ compatibility is not guaranteed unless explicitly specified.
 """
 
 from datetime import datetime
+from pathlib import Path
+from uuid import uuid4
 import platform
+import shutil
+import time
+import os
 
 from typing import Optional
 
@@ -51,6 +56,25 @@ def calc_input_sha1(input_stream, *, buffer_len: int = 8192) -> str:
     return h.hexdigest()
 
 
+def calc_file_sha1(file: Path) -> str:
+    """Internal function to calculate the sha1 of a file, the file is memory mapped if 
+    possible, so it's hashed in a single call, without copying it and without holding 
+    the GIL, this allows hashing many files in parallel threads.
+
+    :param file: The path of the file to hash.
+    :return: The sha1 string.
+    """
+    import hashlib
+    import mmap
+    with file.open("rb") as fp:
+        try:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return hashlib.sha1(mm).hexdigest()
+        except (OSError, ValueError):
+            # Empty files can't be mapped, and some file systems doesn't support it.
+            return calc_input_sha1(fp, buffer_len=1048576)
+
+
 def from_iso_date(raw: str) -> datetime:
     """Replacement for `datetime.fromisoformat()` which is missing from Python 3.6. This 
     function replace it if needed.
@@ -132,3 +156,171 @@ class LibrarySpecifier:
             f".{self.extension}"
         
         return "/".join([*self.group.split("."), self.artifact, self.version, file_name])
+
+
+def link_file(src: Path, dst: Path) -> None:
+    """Materialize the given source file at the given destination, without copying it if
+    possible. The file is hard linked if possible, then cloned (reflink) if supported, 
+    then symbolically linked and finally copied if all other methods are failing. The
+    destination is atomically replaced if already existing.
+
+    :param src: The source file, it should not be modified afterward.
+    :param dst: The destination path where the file is materialized.
+    """
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f"{dst.name}.{uuid4().hex}.tmp")
+
+    for method in (os.link, _reflink, _symlink, shutil.copy):
+        try:
+            method(src, tmp)
+        except (OSError, NotImplementedError):
+            try:
+                tmp.unlink()
+            except OSError:
+                pass
+            continue
+        try:
+            os.replace(tmp, dst)
+        except:
+            tmp.unlink()
+            raise
+        return
+    
+    raise OSError(f"failed to link {src} to {dst}")
+
+
+def _symlink(src: Path, dst: Path) -> None:
+    os.symlink(src.absolute(), dst)
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    """Clone the given file using copy-on-write (reflink), only supported on Linux and
+    on some file systems.
+    """
+
+    try:
+        import fcntl
+        ficlone = 0x40049409  # From linux/fs.h
+    except ImportError:
+        raise NotImplementedError
+    
+    if platform.system() != "Linux":
+        raise NotImplementedError
+
+    with src.open("rb") as src_fp, dst.open("xb") as dst_fp:
+        fcntl.ioctl(dst_fp.fileno(), ficlone, src_fp.fileno())
+    shutil.copymode(src, dst)
+
+
+class FileLock:
+    """An exclusive lock shared between processes, backed by a lock file that is 
+    created when acquired and removed when released. This is used to coordinate 
+    multiple launchers working on the same directories.
+    """
+
+    __slots__ = "path", "fd"
+
+    # Interval between two attempts, only used on Windows for blocking acquire.
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.fd: Optional[int] = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquire the lock, waiting for other processes to release it if blocking.
+
+        :param blocking: Set to false to return immediately if the lock is already held.
+        :return: True if the lock has been acquired.
+        """
+
+        assert self.fd is None, "lock already acquired"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        while True:
+
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+
+            try:
+                if not _lock_fd(fd, blocking):
+                    os.close(fd)
+                    return False
+            except BaseException:
+                os.close(fd)
+                raise
+            
+            # The lock file may have been removed and recreated by another process
+            # between our open and lock, in such case we locked a dangling file.
+            try:
+                if os.name == "nt" or os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    self.fd = fd
+                    return True
+            except FileNotFoundError:
+                pass
+            
+            os.close(fd)
+
+    def release(self) -> None:
+        """Release the lock and remove the lock file.
+        """
+
+        assert self.fd is not None, "lock not acquired"
+        fd = self.fd
+        self.fd = None
+
+        if os.name == "nt":
+            # On Windows the file can't be removed while opened, and may fail if
+            # another process is trying to lock it, this is not a problem.
+            _unlock_fd(fd)
+            os.close(fd)
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+        else:
+            # Removing before unlocking, waiting processes will detect it.
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+    
+    def __exit__(self, *args) -> None:
+        self.release()
+
+
+if os.name == "nt":
+
+    import msvcrt
+
+    def _lock_fd(fd: int, blocking: bool) -> bool:
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(FileLock.POLL_INTERVAL)
+
+    def _unlock_fd(fd: int) -> None:
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+else:
+
+    import fcntl
+
+    def _lock_fd(fd: int, blocking: bool) -> bool:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _unlock_fd(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
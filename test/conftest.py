@@ -30,3 +30,142 @@ def tmp_context(tmp_path_factory):
 
     from portablemc.standard import Context
     return Context(tmp_path_factory.mktemp("context"))
+
+class LocalHttpServer:
+    """A local HTTP/1.1 server used as a stand-in for upstream servers, files are
+    registered by path and some special behaviors can be registered too.
+    """
+
+    def __init__(self) -> None:
+
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from threading import Thread
+        import urllib.parse
+        import hashlib
+
+        self.files = {}
+        self.redirects = {}
+        self.truncates = {}
+        self.statuses = {}
+        self.encoded = {}
+        self.headers = {}
+        self.requests = []
+        self.ranges = []
+        self.if_ranges = []
+        self.accept_ranges = True
+        self.connections = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_GET(self):
+                # Requests may use the absolute form of the target.
+                path = urllib.parse.urlsplit(self.path).path
+                server.requests.append(path)
+                # Error statuses are sent once each, before serving the path.
+                statuses = server.statuses.get(path)
+                if statuses:
+                    status, headers = statuses.pop(0)
+                    self.send_response(status)
+                    for header_name, header_value in headers.items():
+                        self.send_header(header_name, header_value)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif path in server.encoded:
+                    # Encoded content, sent only if accepted by the client.
+                    encoding, data = server.encoded[path]
+                    if encoding in self.headers.get("Accept-Encoding", ""):
+                        self.send_response(200)
+                        self.send_header("Content-Encoding", encoding)
+                    else:
+                        data = server.files[path]
+                        self.send_response(200)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                elif path in server.redirects:
+                    self.send_response(302)
+                    self.send_header("Location", server.redirects[path])
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                elif path in server.files:
+                    data = server.files[path]
+                    # Files have an ETag and can be revalidated.
+                    etag = f'"{hashlib.sha1(data).hexdigest()}"'
+                    if self.headers.get("If-None-Match") == etag:
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    start, end = 0, len(data)
+                    range_header = self.headers.get("Range")
+                    server.ranges.append(range_header)
+                    # The range is ignored if the file has changed since If-Range.
+                    if_range = self.headers.get("If-Range")
+                    if if_range is not None:
+                        server.if_ranges.append(if_range)
+                    if server.accept_ranges and range_header is not None and range_header.startswith("bytes=") \
+                            and if_range in (None, etag):
+                        range_start, range_end = range_header[6:].split("-")
+                        start = int(range_start)
+                        if range_end:
+                            end = min(end, int(range_end) + 1)
+                        if start >= len(data):
+                            self.send_response(416)
+                            self.send_header("Content-Length", "0")
+                            self.end_headers()
+                            return
+                        self.send_response(206)
+                        self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+                    else:
+                        self.send_response(200)
+                    self.send_header("ETag", etag)
+                    for header_name, header_value in server.headers.get(path, {}).items():
+                        self.send_header(header_name, header_value)
+                    self.send_header("Content-Length", str(end - start))
+                    self.end_headers()
+                    # Truncated files are sent partially once, then the connection
+                    # is closed, this simulates an interrupted download.
+                    truncate = server.truncates.pop(path, None)
+                    if truncate is not None:
+                        self.wfile.write(data[start:truncate])
+                        self.wfile.flush()
+                        self.close_connection = True
+                        return
+                    try:
+                        self.wfile.write(data[start:end])
+                    except ConnectionError:
+                        pass  # The client may not read the whole response.
+                else:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def http_server():
+    """This fixture is used to start a local HTTP server for the test duration.
+    """
+    server = LocalHttpServer()
+    yield server
+    server.close()
@@ -0,0 +1,92 @@
+from threading import Thread
+import hashlib
+import pytest
+
+from portablemc.cache import CacheServer, cache_url_overrides
+from portablemc.download import DownloadEntry, DownloadList
+from portablemc.http import http_request, HttpError
+from portablemc.standard import Context
+
+
+@pytest.fixture
+def cache_server(tmp_path, http_server):
+    """Start a cache server using the local HTTP server as its only upstream host.
+    """
+    host = http_server.url[len("http://"):]
+    server = CacheServer(("127.0.0.1", 0), Context(tmp_path), hosts=[host], scheme="http")
+    Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    server.url = f"http://127.0.0.1:{server.server_port}/{host}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_cache_url_overrides():
+    assert cache_url_overrides("http://cache:8080/", ["libraries.minecraft.net"]) == {
+        "https://libraries.minecraft.net/": "http://cache:8080/libraries.minecraft.net/"
+    }
+
+
+def test_cache_server(cache_server, http_server):
+
+    data = b"hello world!"
+    object_data = b"hello object!"
+    sha1 = hashlib.sha1(object_data).hexdigest()
+    http_server.files["/manifest.json"] = data
+    http_server.files[f"/{sha1[:2]}/{sha1}"] = object_data
+    http_server.files[f"/00/{'0' * 40}"] = data
+    http_server.files[f"/v1/products/java-runtime/{'0' * 40}/all.json"] = data
+
+    # Each file is only requested once to upstream.
+    for _ in range(2):
+        assert http_request("GET", f"{cache_server.url}/manifest.json").data == data
+        assert http_request("GET", f"{cache_server.url}/{sha1[:2]}/{sha1}").data == object_data
+    assert http_server.requests == ["/manifest.json", f"/{sha1[:2]}/{sha1}"]
+    assert cache_server.blob_file(sha1).read_bytes() == object_data
+
+    # Hashes outside of content-addressed paths are not checked.
+    assert http_request("GET", f"{cache_server.url}/v1/products/java-runtime/{'0' * 40}/all.json").data == data
+
+    res = http_request("GET", f"{cache_server.url}/manifest.json", headers={"Range": "bytes=6-"})
+    assert res.status == 206
+    assert res.data == b"world!"
+
+    # Not found, invalid sha1 and unknown hosts.
+    for url in (f"{cache_server.url}/not_found.json", f"{cache_server.url}/00/{'0' * 40}", f"http://127.0.0.1:{cache_server.server_port}/example.com/"):
+        with pytest.raises(HttpError):
+            http_request("GET", url)
+
+    # Outdated files are revalidated, and not fetched again if not modified.
+    cache_server.max_age = 0
+    http_server.requests.clear()
+    http_server.ranges.clear()
+    assert http_request("GET", f"{cache_server.url}/manifest.json").data == data
+    assert http_server.ranges == []  # Not modified.
+    http_server.files["/manifest.json"] = b"modified"
+    assert http_request("GET", f"{cache_server.url}/manifest.json").data == b"modified"
+    http_server.files["/manifest.json"] = data
+    assert http_request("GET", f"{cache_server.url}/manifest.json").data == data
+    assert http_server.requests == ["/manifest.json"] * 3
+
+    # Outdated files are still served if upstream is not reachable.
+    http_server.close()
+    assert http_request("GET", f"{cache_server.url}/manifest.json").data == data
+
+
+def test_cache_server_download(tmp_path, cache_server, http_server, monkeypatch):
+
+    from portablemc import http
+
+    data = bytes(range(256)) * 64
+    http_server.files["/data.bin"] = data
+
+    monkeypatch.setitem(http.url_overrides, f"{http_server.url}/", f"{cache_server.url}/")
+
+    for name in ("first.bin", "second.bin"):
+        dl = DownloadList()
+        dl.add(DownloadEntry(f"{http_server.url}/data.bin", tmp_path / name, size=len(data)))
+        for _ in dl.download(1):
+            pass
+        assert (tmp_path / name).read_bytes() == data
+
+    assert http_server.requests == ["/data.bin"]
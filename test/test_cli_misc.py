@@ -1,3 +1,5 @@
+import pytest
+
 
 def test_format_locale_date():
 
@@ -82,3 +84,30 @@ def test_parser_and_completion():
     # Just check that it doesn't crash.
     gen_zsh_completion(args)
     gen_bash_completion(args)
+
+
+def test_type_rate():
+
+    from portablemc.cli.parse import type_rate
+    from argparse import ArgumentTypeError
+
+    assert type_rate("1200") == 1200
+    assert type_rate("500k") == 500000
+    assert type_rate("1.5M") == 1500000
+    assert type_rate("2g") == 2000000000
+
+    for invalid in ("", "k", "-5k", "0", "fast"):
+        with pytest.raises(ArgumentTypeError):
+            type_rate(invalid)
+
+
+def test_type_mirror():
+
+    from portablemc.cli.parse import type_mirror
+    from argparse import ArgumentTypeError
+
+    assert type_mirror("https://a.com/=https://b.com/a/") == ("https://a.com/", "https://b.com/a/")
+
+    for invalid in ("", "https://a.com/", "=https://b.com/", "https://a.com/="):
+        with pytest.raises(ArgumentTypeError):
+            type_mirror(invalid)
@@ -3,7 +3,7 @@ from os import path
 import pytest
 
 from portablemc.download import DownloadEntry, DownloadList, \
-    DownloadResult, DownloadResultError
+    DownloadResult, DownloadResultError, DownloadResultProgress, DownloadResultGroup
 
 
 def test_download(tmp_path):
@@ -86,3 +86,873 @@ def test_download(tmp_path):
     assert not path.isfile(wrong_size.dst)
     assert not path.isfile(not_found.dst)
     assert not path.isfile(conn_err.dst)
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_local(tmp_path, http_server, engine):
+
+    import hashlib
+
+    data = bytes(range(256)) * 1024
+    data_sha1 = hashlib.sha1(data).hexdigest()
+    http_server.files["/data.bin"] = data
+    http_server.redirects["/redirect.bin"] = "/data.bin"
+
+    ok = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "ok.bin", size=len(data), sha1=data_sha1)
+    redirect = DownloadEntry(f"{http_server.url}/redirect.bin", tmp_path / "redirect.bin", size=len(data), sha1=data_sha1)
+    wrong_sha1 = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "wrong_sha1.bin", sha1="0" * 40)
+    wrong_size = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "wrong_size.bin", size=12)
+    not_found = DownloadEntry(f"{http_server.url}/not_found.bin", tmp_path / "not_found.bin")
+
+    dl = DownloadList(engine=engine)
+    for entry in (ok, redirect, wrong_sha1, wrong_size, not_found):
+        dl.add(entry)
+
+    results = {}
+    for result_count, result in dl.download(2, partial_progress=True):
+        if isinstance(result, DownloadResultError) or result.done:
+            results[result.entry.dst] = result
+    
+    assert result_count == 5
+    assert len(results) == 5
+
+    def is_error(entry: DownloadEntry, code: str) -> bool:
+        result = results[entry.dst]
+        return isinstance(result, DownloadResultError) and result.code == code
+
+    assert is_error(wrong_sha1, DownloadResultError.INVALID_SHA1)
+    assert is_error(wrong_size, DownloadResultError.INVALID_SIZE)
+    assert is_error(not_found, DownloadResultError.NOT_FOUND)
+
+    assert ok.dst.read_bytes() == data
+    assert redirect.dst.read_bytes() == data
+    assert not wrong_sha1.dst.exists()
+    assert not wrong_size.dst.exists()
+    assert not not_found.dst.exists()
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_host_connections(tmp_path, http_server, engine):
+
+    dl = DownloadList(engine=engine)
+    for i in range(20):
+        http_server.files[f"/{i}.bin"] = bytes(i)
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / f"{i}.bin", size=i))
+
+    results = [result for _, result in dl.download(4, max_host_connections=1)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert http_server.connections == 1
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_groups(tmp_path, http_server, engine):
+
+    dl = DownloadList(engine=engine)
+    for i in range(1, 6):
+        http_server.files[f"/{i}.bin"] = bytes(i)
+
+    def add(i: int, url: str, **kwargs) -> DownloadEntry:
+        entry = DownloadEntry(f"{http_server.url}/{url}", tmp_path / f"{i}.bin", size=i, **kwargs)
+        dl.add(entry)
+        return entry
+
+    add(1, "1.bin")
+    add(2, "not_found.bin")
+    dl.set_group("first")
+    add(3, "3.bin", group="second")
+    add(4, "4.bin", group="second", priority=DownloadEntry.PRIORITY_LOW)
+    add(5, "5.bin")
+
+    assert dl.groups() == {"first", "second"}
+
+    # Entries of the first group are moved to a higher priority, group results come
+    # right after the last result of the group.
+    order = []
+    groups = {}
+    for _, result in dl.download(1):
+        if isinstance(result, DownloadResultGroup):
+            assert result.group not in groups
+            groups[result.group] = result
+            order.append(result.group)
+        else:
+            order.append(result.entry.dst.name)
+    
+    assert order == ["2.bin", "1.bin", "first", "5.bin", "3.bin", "4.bin", "second"]
+    assert groups["first"].errors_count == 1
+    assert groups["second"].errors_count == 0
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_mirrors(tmp_path, http_server, engine):
+
+    data = bytes(range(256)) * 64
+    http_server.files["/data.bin"] = data
+
+    # Nothing listens on port 1, the first mirror is not found.
+    dl = DownloadList(engine=engine, mirrors={"http://127.0.0.1:1/": [f"{http_server.url}/missing/", f"{http_server.url}/"]})
+    refused = DownloadEntry("http://127.0.0.1:1/data.bin", tmp_path / "refused.bin", size=len(data))
+    explicit = DownloadEntry(f"{http_server.url}/not_found.bin", tmp_path / "explicit.bin", size=len(data), mirrors=[f"{http_server.url}/data.bin"])
+    dl.add(refused)
+    dl.add(explicit)
+
+    results = [result for _, result in dl.download(2)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert refused.dst.read_bytes() == data
+    assert explicit.dst.read_bytes() == data
+
+
+def test_download_mirrors_select():
+
+    from portablemc.download import _DownloadEntry, _DownloadMirrors
+
+    entry = DownloadEntry("https://a.com/file", Path("file"), mirrors=["https://b.com/file", "https://c.com/file"])
+    raw_entry = _DownloadEntry.from_entry(entry)
+    raw_entry.mirrors = list(entry.mirrors)
+
+    mirrors = _DownloadMirrors()
+    assert mirrors.select(raw_entry) is raw_entry
+
+    # Unknown latencies are tried first.
+    mirrors.record("https://a.com/other", 0.2)
+    selected = mirrors.select(raw_entry)
+    assert selected.entry.url == "https://b.com/file"
+    assert selected.mirrors == ["https://a.com/file", "https://c.com/file"]
+
+    mirrors.record("https://b.com/", 0.5)
+    mirrors.record("https://c.com/", 0.1)
+    assert mirrors.select(raw_entry).entry.url == "https://c.com/file"
+
+    # Errors are accounted as high latencies.
+    mirrors.record("https://c.com/", None)
+    failover = mirrors.failover(mirrors.select(raw_entry))
+    assert failover.entry.url == "https://b.com/file"
+    assert failover.mirrors == ["https://c.com/file"]
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_retry(tmp_path, http_server, engine):
+
+    from portablemc.download import RetryPolicy
+    import time
+
+    data = bytes(range(256)) * 64
+    http_server.files["/throttled.bin"] = data
+    http_server.files["/server_error.bin"] = data
+    http_server.files["/forbidden.bin"] = data
+    http_server.statuses["/throttled.bin"] = [(429, {"Retry-After": "1"})]
+    http_server.statuses["/server_error.bin"] = [(500, {}), (502, {})]
+    http_server.statuses["/forbidden.bin"] = [(403, {})]
+
+    dl = DownloadList(engine=engine, retry=RetryPolicy(base_delay=0.01))
+    entries = {}
+    for name in ("throttled", "server_error", "forbidden", "not_found"):
+        entries[name] = DownloadEntry(f"{http_server.url}/{name}.bin", tmp_path / f"{name}.bin", size=len(data))
+        dl.add(entries[name])
+
+    start = time.monotonic()
+    results = {result.entry.dst.name: result for _, result in dl.download(4)}
+    assert time.monotonic() - start >= 1.0
+
+    assert entries["throttled"].dst.read_bytes() == data
+    assert entries["server_error"].dst.read_bytes() == data
+    assert results["forbidden.bin"].code == DownloadResultError.HTTP_ERROR
+    assert results["not_found.bin"].code == DownloadResultError.NOT_FOUND
+
+    # Client errors are never retried.
+    assert http_server.requests.count("/forbidden.bin") == 1
+    assert http_server.requests.count("/not_found.bin") == 1
+
+    # The retry budget is shared by the whole download.
+    http_server.statuses["/throttled.bin"] = [(503, {})] * 2
+    http_server.statuses["/server_error.bin"] = [(500, {})] * 2
+    dl = DownloadList(engine=engine, retry=RetryPolicy(base_delay=0.01, budget=1))
+    dl.add(DownloadEntry(f"{http_server.url}/throttled.bin", tmp_path / "a.bin", size=len(data)))
+    dl.add(DownloadEntry(f"{http_server.url}/server_error.bin", tmp_path / "b.bin", size=len(data)))
+    errors = [result.code for _, result in dl.download(1) if isinstance(result, DownloadResultError)]
+    assert sorted(errors) == [DownloadResultError.SERVER_ERROR, DownloadResultError.THROTTLED]
+
+
+def test_retry_policy():
+
+    from portablemc.download import RetryPolicy, _parse_retry_after
+    from email.utils import format_datetime
+    from datetime import datetime, timedelta, timezone
+
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=False)
+    assert [policy.delay(i) for i in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    assert policy.delay(1, 3.0) == 3.0
+    assert policy.delay(1, 60.0) == 5.0
+
+    policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+    assert all(0 <= policy.delay(3) <= 4.0 for _ in range(20))
+
+    assert _parse_retry_after(None) is None
+    assert _parse_retry_after("invalid") is None
+    assert _parse_retry_after(" 12 ") == 12.0
+    date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= _parse_retry_after(date) <= 30
+    assert _parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_concurrency(tmp_path, http_server, engine):
+
+    dl = DownloadList(engine=engine)
+    for i in range(20):
+        http_server.files[f"/{i}.bin"] = bytes(i)
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / f"{i}.bin", size=i))
+
+    # A single thread is active at start, and the download is too short to adapt.
+    results = [result for _, result in dl.download(4, concurrency=1)]
+    assert len(results) == 20
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert http_server.connections == 1
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+@pytest.mark.parametrize("host", [False, True])
+def test_download_bandwidth(tmp_path, http_server, engine, host):
+
+    import time
+
+    data = bytes(range(256)) * 1200
+    http_server.files["/data.bin"] = data
+
+    # The whole data should take ~0.35s when removing the initial burst.
+    if host:
+        dl = DownloadList(engine=engine, max_host_rate=500000)
+    else:
+        dl = DownloadList(engine=engine, max_rate=500000)
+    
+    dl.add(DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "data.bin", size=len(data)))
+
+    start = time.monotonic()
+    results = [result for _, result in dl.download(2)]
+    assert time.monotonic() - start > 0.3
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert (tmp_path / "data.bin").read_bytes() == data
+
+
+def test_download_concurrency_control():
+
+    from portablemc.download import _DownloadConcurrency
+
+    def next_window(controller: _DownloadConcurrency, size: int, error: bool = False):
+        controller.window_start -= controller.WINDOW
+        controller.feed(size, error)
+
+    controller = _DownloadConcurrency(2, 16, True)
+    assert controller.acquire(False)
+    assert controller.acquire(False)
+    assert not controller.acquire(False)
+
+    # Slow start while the throughput improves.
+    next_window(controller, 1000)
+    assert controller.limit == 4
+    assert controller.acquire(False)
+    next_window(controller, 2000)
+    assert controller.limit == 8
+    # Stagnating throughput ends the slow start.
+    next_window(controller, 2000)
+    assert controller.limit == 8
+    next_window(controller, 3000)
+    assert controller.limit == 9
+    # Dropping throughput and errors.
+    next_window(controller, 1000)
+    assert controller.limit == 8
+    next_window(controller, 1000, True)
+    assert controller.limit == 4
+
+    # Closing gives permits regardless of the limit.
+    controller.close()
+    for _ in range(10):
+        assert controller.acquire(False)
+
+
+def test_download_concurrency_async():
+
+    from portablemc.download import _DownloadConcurrency
+    from threading import Timer
+    import asyncio
+
+    controller = _DownloadConcurrency(1, 1, False)
+
+    async def acquire_all():
+        # Waiting slots are woken up by the thread releasing their permit.
+        await controller.acquire_async()
+        Timer(0.05, controller.release).start()
+        await asyncio.wait_for(controller.acquire_async(), 5)
+        # Cancelled waiting slots are forgotten.
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(controller.acquire_async(), 0.05)
+        assert not controller.async_waiters
+        Timer(0.05, controller.close).start()
+        await asyncio.wait_for(asyncio.gather(*(controller.acquire_async() for _ in range(100))), 5)
+
+    asyncio.run(acquire_all())
+    assert controller.active == 101
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_resume(tmp_path, http_server, engine):
+
+    import hashlib
+
+    data = bytes(range(256)) * 1024
+    data_sha1 = hashlib.sha1(data).hexdigest()
+    http_server.files["/interrupted.bin"] = data
+    http_server.files["/partial.bin"] = data
+    http_server.truncates["/interrupted.bin"] = 100000
+
+    interrupted = DownloadEntry(f"{http_server.url}/interrupted.bin", tmp_path / "interrupted.bin", size=len(data), sha1=data_sha1)
+    partial = DownloadEntry(f"{http_server.url}/partial.bin", tmp_path / "partial.bin", size=len(data), sha1=data_sha1)
+
+    # Partial file left by a previous run.
+    (tmp_path / "partial.bin.part").write_bytes(data[:5000])
+
+    dl = DownloadList(engine=engine)
+    dl.add(interrupted)
+    dl.add(partial)
+
+    results = [result for _, result in dl.download(1)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+
+    assert interrupted.dst.read_bytes() == data
+    assert partial.dst.read_bytes() == data
+    assert not (tmp_path / "interrupted.bin.part").exists()
+    assert not (tmp_path / "partial.bin.part").exists()
+    assert "bytes=100000-" in http_server.ranges
+    assert "bytes=5000-" in http_server.ranges
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_resume_stale(tmp_path, http_server, engine):
+
+    from portablemc.download import RetryPolicy
+    import hashlib
+
+    data = bytes(range(256)) * 64
+    http_server.files["/stale.bin"] = data
+
+    # Without size, a complete partial file is resumed and the server can't satisfy 
+    # the range, the partial file is discarded and downloaded again without error.
+    entry = DownloadEntry(f"{http_server.url}/stale.bin", tmp_path / "stale.bin", sha1=hashlib.sha1(data).hexdigest())
+    (tmp_path / "stale.bin.part").write_bytes(data)
+
+    dl = DownloadList(engine=engine, retry=RetryPolicy(max_tries=1))
+    dl.add(entry)
+
+    results = [result for _, result in dl.download(1)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert entry.dst.read_bytes() == data
+    assert http_server.ranges == [f"bytes={len(data)}-", None]
+
+
+def test_download_resume_killed(tmp_path, http_server):
+
+    import subprocess
+    import hashlib
+    import sys
+
+    data = bytes(range(256)) * 12288
+    http_server.files["/killed.bin"] = data
+    entry = DownloadEntry(f"{http_server.url}/killed.bin", tmp_path / "killed.bin", size=len(data), sha1=hashlib.sha1(data).hexdigest())
+
+    # The process is killed without any cleanup after the first megabyte, the partial 
+    # file must only contain the written bytes to be resumed.
+    script = f"""if True:
+        from portablemc.download import DownloadList, DownloadEntry, _DownloadFile
+        from pathlib import Path
+        import os
+        write = _DownloadFile.write
+        def write_then_kill(self, data):
+            write(self, data)
+            if self.size >= 1048576:
+                os._exit(1)
+            return True
+        _DownloadFile.write = write_then_kill
+        dl = DownloadList()
+        dl.add(DownloadEntry({entry.url!r}, Path({str(entry.dst)!r}), size={entry.size}))
+        for _ in dl.download(1, segment_size=None):
+            pass
+    """
+    assert subprocess.run([sys.executable, "-c", script], cwd=Path(__file__).parent.parent).returncode == 1
+
+    part_size = (tmp_path / "killed.bin.part").stat().st_size
+    assert 1048576 <= part_size < len(data)
+
+    dl = DownloadList()
+    dl.add(entry)
+    results = [result for _, result in dl.download(1, segment_size=None)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert entry.dst.read_bytes() == data
+    assert http_server.ranges[-1] == f"bytes={part_size}-"
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_resume_unchecked(tmp_path, http_server, engine):
+
+    import hashlib
+
+    data = bytes(range(256)) * 1024
+    http_server.files["/interrupted.bin"] = data
+    http_server.files["/stale.bin"] = data
+    http_server.truncates["/interrupted.bin"] = 100000
+
+    # Without SHA-1, a partial file is only resumed with the validator of the response
+    # that started it, a partial file left by a previous run is downloaded again.
+    interrupted = DownloadEntry(f"{http_server.url}/interrupted.bin", tmp_path / "interrupted.bin", size=len(data))
+    stale = DownloadEntry(f"{http_server.url}/stale.bin", tmp_path / "stale.bin", size=len(data))
+    (tmp_path / "stale.bin.part").write_bytes(b"\xff" * 5000)
+
+    dl = DownloadList(engine=engine)
+    dl.add(interrupted)
+    dl.add(stale)
+
+    results = [result for _, result in dl.download(1)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+
+    assert interrupted.dst.read_bytes() == data
+    assert stale.dst.read_bytes() == data
+    assert "bytes=100000-" in http_server.ranges
+    assert "bytes=5000-" not in http_server.ranges
+    assert http_server.if_ranges == [f'"{hashlib.sha1(data).hexdigest()}"']
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+@pytest.mark.parametrize("buffer_size", [16384, 4 * 1024 * 1024])
+def test_download_buffer_size(tmp_path, http_server, engine, buffer_size):
+
+    import hashlib
+
+    dl = DownloadList(engine=engine)
+    for i, size in enumerate((10, 100000, 3000000)):
+        data = bytes(range(256)) * (size // 256) + bytes(size % 256)
+        http_server.files[f"/{i}.bin"] = data
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / f"{i}.bin", size=size, sha1=hashlib.sha1(data).hexdigest()))
+
+    results = [result for _, result in dl.download(2, buffer_size=buffer_size, segment_size=None)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    for i in range(3):
+        assert (tmp_path / f"{i}.bin").read_bytes() == http_server.files[f"/{i}.bin"]
+
+    with pytest.raises(ValueError):
+        next(dl.download(1, buffer_size=1024), None)
+
+
+def test_download_read_size():
+
+    from portablemc.download import _DownloadEntry
+
+    def read_size(size, buffer_cap=1048576):
+        return _DownloadEntry.from_entry(DownloadEntry("https://foo.bar/file", Path("file"), size=size)).read_size(buffer_cap)
+
+    assert read_size(None) == 1048576
+    assert read_size(100) == _DownloadEntry.MIN_READ_SIZE
+    assert read_size(100000) == 100000
+    assert read_size(100000000) == 1048576
+    assert read_size(100000000, 65536) == 65536
+
+
+def test_download_pipeline(tmp_path, http_server):
+
+    import hashlib
+
+    dl = DownloadList(pipeline=8)
+    for i in range(20):
+        data = bytes(range(256)) * (i + 1)
+        http_server.files[f"/{i}.bin"] = data
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / f"{i}.bin", size=len(data), sha1=hashlib.sha1(data).hexdigest()))
+
+    results = [result for _, result in dl.download(1)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    for i in range(20):
+        assert (tmp_path / f"{i}.bin").read_bytes() == http_server.files[f"/{i}.bin"]
+    assert http_server.connections == 1
+
+    # Failed entries in a pipeline are downloaded individually.
+    http_server.files["/a.bin"] = b"a" * 100
+    http_server.redirects["/b.bin"] = "/a.bin"
+    http_server.truncates["/a.bin"] = 50
+    dl = DownloadList(pipeline=8)
+    dl.add(DownloadEntry(f"{http_server.url}/a.bin", tmp_path / "a.bin", size=100))
+    dl.add(DownloadEntry(f"{http_server.url}/b.bin", tmp_path / "b.bin", size=100))
+    dl.add(DownloadEntry(f"{http_server.url}/c.bin", tmp_path / "c.bin", size=100))
+
+    results = {result.entry.dst.name: result for _, result in dl.download(1)}
+    assert (tmp_path / "a.bin").read_bytes() == b"a" * 100
+    assert (tmp_path / "b.bin").read_bytes() == b"a" * 100
+    assert results["c.bin"].code == DownloadResultError.NOT_FOUND
+
+
+def test_pipeline_entries():
+
+    from portablemc.download import _DownloadEntry, _pipeline_entries
+
+    raw_entries = [
+        _DownloadEntry.from_entry(DownloadEntry("https://a.com/big", Path("big"), size=10000000)),
+        *(_DownloadEntry.from_entry(DownloadEntry(f"https://a.com/{i}", Path(str(i)), size=100)) for i in range(5)),
+        _DownloadEntry.from_entry(DownloadEntry("https://b.com/0", Path("b0"), size=100)),
+        _DownloadEntry.from_entry(DownloadEntry("https://a.com/unknown", Path("unknown"))),
+    ]
+
+    items = _pipeline_entries(raw_entries, 3)
+    assert items == [raw_entries[0], raw_entries[1:4], raw_entries[4:6], raw_entries[6], raw_entries[7]]
+
+
+def test_download_file(tmp_path):
+
+    from portablemc.download import _DownloadEntry, _DownloadSync
+    import hashlib
+
+    data = bytes(range(256)) * 256
+    entry = DownloadEntry("https://foo.bar/file.bin", tmp_path / "file.bin", size=len(data), sha1=hashlib.sha1(data).hexdigest())
+    sync = _DownloadSync(DownloadList.FSYNC_NONE, False)
+    buffer = memoryview(bytearray(4096))
+
+    # The partial file is truncated to the written size when interrupted.
+    dl_file = _DownloadEntry.from_entry(entry).open_file(sync)
+    dl_file.open(0, buffer)
+    dl_file.write(data[:10000])
+    dl_file.abort()
+    assert dl_file.part.stat().st_size == 10000
+    assert dl_file.resume_offset() == 10000
+
+    # Resuming rebuilds the sha1 of the bytes already written.
+    dl_file.open(dl_file.resume_offset(), buffer)
+    dl_file.write(data[10000:])
+    assert dl_file.finish() is None
+    assert entry.dst.read_bytes() == data
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+@pytest.mark.parametrize("accept_ranges", [True, False])
+def test_download_segmented(tmp_path, http_server, engine, accept_ranges):
+
+    import hashlib
+
+    data = bytes(range(256)) * 4096
+    data_sha1 = hashlib.sha1(data).hexdigest()
+    http_server.files["/big.bin"] = data
+    http_server.accept_ranges = accept_ranges
+
+    big = DownloadEntry(f"{http_server.url}/big.bin", tmp_path / "big.bin", size=len(data), sha1=data_sha1)
+    wrong_sha1 = DownloadEntry(f"{http_server.url}/big.bin", tmp_path / "wrong_sha1.bin", size=len(data), sha1="0" * 40)
+
+    dl = DownloadList(engine=engine)
+    dl.add(big)
+    dl.add(wrong_sha1)
+
+    results = [result for _, result in dl.download(4, segment_size=100000)]
+    final_results = [result for result in results if isinstance(result, DownloadResultError) or result.done]
+    assert len(final_results) == 2
+
+    # Each entry is split in 4 segments.
+    assert len(http_server.ranges) == 8
+
+    assert big.dst.read_bytes() == data
+    assert not wrong_sha1.dst.exists()
+    assert not (tmp_path / "big.bin.part").exists()
+    assert not (tmp_path / "wrong_sha1.bin.part").exists()
+    assert any(isinstance(result, DownloadResultError) and result.code == DownloadResultError.INVALID_SHA1 for result in final_results)
+
+
+@pytest.mark.parametrize("fsync", [DownloadList.FSYNC_FILE, DownloadList.FSYNC_BATCH])
+def test_download_fsync(tmp_path, http_server, fsync):
+
+    dl = DownloadList(fsync=fsync)
+    for i in range(5):
+        http_server.files[f"/{i}.bin"] = bytes(i)
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / str(i % 2) / f"{i}.bin", size=i))
+
+    results = [result for _, result in dl.download(2)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+
+    for i in range(5):
+        assert (tmp_path / str(i % 2) / f"{i}.bin").read_bytes() == bytes(i)
+        assert not (tmp_path / str(i % 2) / f"{i}.bin.part").exists()
+    
+    with pytest.raises(ValueError):
+        next(DownloadList(fsync="unknown").download(1), None)
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_lock(tmp_path, http_server, engine):
+
+    import threading
+    import hashlib
+    from portablemc.util import FileLock
+
+    data = bytes(range(256)) * 64
+    data_sha1 = hashlib.sha1(data).hexdigest()
+    http_server.files["/data.bin"] = data
+
+    entry = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "data.bin", size=len(data), sha1=data_sha1)
+
+    # Simulate another process downloading the file while holding its lock.
+    lock = FileLock(tmp_path / "data.bin.lock")
+    lock.acquire()
+
+    def other_process():
+        entry.dst.write_bytes(data)
+        lock.release()
+    
+    timer = threading.Timer(0.2, other_process)
+    timer.start()
+
+    dl = DownloadList(engine=engine)
+    dl.add(entry, verify=True)
+    results = [result for _, result in dl.download(1)]
+    timer.join()
+
+    assert len(results) == 1 and isinstance(results[0], DownloadResultProgress) and results[0].done
+    assert http_server.requests == []
+    assert not (tmp_path / "data.bin.lock").exists()
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_lock_error(tmp_path, http_server, engine, monkeypatch):
+
+    import errno
+    from portablemc.util import FileLock
+    from portablemc.download import _DownloadFile
+
+    http_server.files["/data.bin"] = b"hello"
+
+    def acquire(self, blocking: bool = True) -> bool:
+        raise OSError(errno.ENOLCK, "no locks available")
+
+    # Entries are downloaded without lock if the lock file can't be created.
+    monkeypatch.setattr(FileLock, "acquire", acquire)
+    dl = DownloadList(engine=engine)
+    dl.add(DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "data.bin"), verify=True)
+    results = [result for _, result in dl.download(1)]
+    assert len(results) == 1 and isinstance(results[0], DownloadResultProgress) and results[0].done
+    assert (tmp_path / "data.bin").read_bytes() == b"hello"
+    assert list(tmp_path.glob("*.part")) == []
+
+    def reused(self) -> bool:
+        raise PermissionError(errno.EACCES, "permission denied")
+
+    # Other file errors are results, the download is not interrupted.
+    monkeypatch.setattr(_DownloadFile, "reused", reused)
+    dl = DownloadList(engine=engine)
+    dl.add(DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "other.bin"), verify=True)
+    results = [result for _, result in dl.download(1)]
+    assert len(results) == 1 and isinstance(results[0], DownloadResultError)
+    assert results[0].code == DownloadResultError.CONNECTION
+    assert isinstance(results[0].origin, PermissionError)
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+@pytest.mark.parametrize("segment_size", [None, 4096])
+def test_download_unlocked_part(tmp_path, http_server, engine, segment_size):
+
+    import hashlib
+
+    data = bytes(range(256)) * 64
+    http_server.files["/data.bin"] = data
+
+    # Without lock, the partial file of another process is neither used nor modified.
+    other_part = tmp_path / "data.bin.part"
+    other_part.write_bytes(b"other")
+
+    dl = DownloadList(engine=engine, lock=False)
+    dl.add(DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "data.bin", size=len(data), sha1=hashlib.sha1(data).hexdigest()))
+    results = [result for _, result in dl.download(2, segment_size=segment_size)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert (tmp_path / "data.bin").read_bytes() == data
+    assert other_part.read_bytes() == b"other"
+    assert list(tmp_path.glob("*.part")) == [other_part]
+
+
+def test_download_asyncio_executor(tmp_path, http_server, monkeypatch):
+
+    import asyncio
+    from portablemc.download import _DownloadFile
+
+    for i in range(4):
+        http_server.files[f"/{i}.bin"] = bytes(range(256)) * (i + 1)
+
+    # Blocking file operations must not run in the event loop.
+    in_loop = []
+    for name in ("reused", "accept", "write", "finish", "complete"):
+        def wrapper(self, *args, _func=getattr(_DownloadFile, name)):
+            try:
+                asyncio.get_running_loop()
+                in_loop.append(_func.__name__)
+            except RuntimeError:
+                pass
+            return _func(self, *args)
+        monkeypatch.setattr(_DownloadFile, name, wrapper)
+    
+    dl = DownloadList(engine=DownloadList.ENGINE_ASYNCIO)
+    for i in range(4):
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / f"{i}.bin", size=256 * (i + 1)))
+    results = [result for _, result in dl.download(2)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert in_loop == []
+
+
+@pytest.mark.parametrize("engine", [DownloadList.ENGINE_THREAD, DownloadList.ENGINE_ASYNCIO])
+def test_download_store(tmp_path, http_server, engine):
+
+    import hashlib
+
+    data = bytes(range(256)) * 64
+    data_sha1 = hashlib.sha1(data).hexdigest()
+    http_server.files["/data.bin"] = data
+
+    store = tmp_path / "objects"
+    blob = store / data_sha1[:2] / data_sha1
+    first = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "first" / "data.bin", size=len(data), sha1=data_sha1)
+    second = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "second" / "data.bin", size=len(data), sha1=data_sha1)
+
+    dl = DownloadList(engine=engine, store=store)
+    dl.add(first, verify=True)
+    dl.add(second, verify=True)
+    results = [result for _, result in dl.download(1)]
+
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert http_server.requests == ["/data.bin"]
+    assert blob.read_bytes() == data
+    assert first.dst.read_bytes() == data
+    assert second.dst.read_bytes() == data
+
+    # Once in the store, the blob is directly linked when added.
+    third = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "third" / "data.bin", size=len(data), sha1=data_sha1)
+    dl = DownloadList(engine=engine, store=store)
+    dl.add(third, verify=True)
+    assert dl.count == 0
+    assert third.dst.read_bytes() == data
+
+
+def test_verify_index(tmp_path):
+
+    import os
+    from portablemc.download import VerifyIndex
+
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    file = data_dir / "file.bin"
+    file.write_bytes(b"hello")
+
+    index = VerifyIndex(tmp_path / "index.json")
+    assert index.verify(file, 5, None)
+    assert not index.verify(file, 6, None)
+    assert not index.verify(data_dir / "missing.bin", None, None)
+    index.update([(file, "0" * 40)])
+    assert not index.verify(file, 5, "1" * 40)
+    index.save()
+
+    # The file is not accessed while its directory is unchanged.
+    index = VerifyIndex(tmp_path / "index.json")
+    mtime = data_dir.stat().st_mtime_ns
+    file.write_bytes(b"world")
+    os.utime(data_dir, ns=(mtime, mtime))
+    os.utime(file, ns=(0, 0))
+    assert index.verify(file, 5, "0" * 40)
+
+    # Once the directory has changed, the file is checked again.
+    (data_dir / "other.bin").write_bytes(b"")
+    index = VerifyIndex(tmp_path / "index.json")
+    assert index.verify(file, 5, "1" * 40)
+    assert index.files[str(file)][3] is None
+
+    # Errors are ignored when the index can't be written.
+    index = VerifyIndex(file / "index.json")
+    index.update([(file, "0" * 40)])
+    index.save()
+    assert index.dirty
+
+
+def test_download_journal(tmp_path, http_server):
+
+    from portablemc.download import DownloadJournal
+
+    journal_file = tmp_path / "journal.jsonl"
+    dl = DownloadList(journal=DownloadJournal(journal_file))
+    for i in range(3):
+        http_server.files[f"/{i}.bin"] = bytes(i + 1)
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / f"{i}.bin", size=i + 1), verify=True)
+    http_server.truncates["/2.bin"] = 1
+    dl.retry.max_tries = 1
+
+    results = [result for _, result in dl.download(1)]
+    assert sum(isinstance(result, DownloadResultError) for result in results) == 1
+
+    # Simulate a killed process, with a truncated last line.
+    with journal_file.open("at") as fp:
+        fp.write('["done","')
+
+    journal = DownloadJournal(journal_file)
+    assert journal.state(DownloadEntry("", tmp_path / "0.bin", size=1)) == DownloadJournal.DONE
+    assert journal.state(DownloadEntry("", tmp_path / "0.bin", size=2)) is None
+    assert journal.state(DownloadEntry("", tmp_path / "2.bin", size=3)) == DownloadJournal.PLANNED
+
+    # Downloaded entries are trusted without being checked, even if removed.
+    (tmp_path / "1.bin").unlink()
+    dl = DownloadList(journal=journal)
+    for i in range(3):
+        dl.add(DownloadEntry(f"{http_server.url}/{i}.bin", tmp_path / f"{i}.bin", size=i + 1), verify=True)
+    assert [raw_entry.entry.dst.name for raw_entry in dl.entries] == ["2.bin"]
+
+    results = [result for _, result in dl.download(1)]
+    assert all(not isinstance(result, DownloadResultError) for result in results)
+    assert (tmp_path / "2.bin").read_bytes() == bytes(3)
+    assert DownloadJournal(journal_file).state(DownloadEntry("", tmp_path / "2.bin", size=3)) == DownloadJournal.DONE
+
+    # The journal is only written by the process holding its lock.
+    journal.plan([DownloadEntry("", tmp_path / "0.bin", size=1)])
+    other_journal = DownloadJournal(journal_file)
+    other_journal.plan([DownloadEntry("", tmp_path / "3.bin", size=4)])
+    other_journal.clear()
+    assert DownloadJournal(journal_file).state(DownloadEntry("", tmp_path / "0.bin", size=1)) == DownloadJournal.PLANNED
+    assert DownloadJournal(journal_file).state(DownloadEntry("", tmp_path / "3.bin", size=4)) is None
+
+    journal.clear()
+    assert not journal_file.exists()
+    assert not (tmp_path / "journal.jsonl.lock").exists()
+
+
+def test_download_check_hashes(tmp_path, http_server):
+
+    import hashlib
+
+    data = bytes(range(256)) * 64
+    data_sha1 = hashlib.sha1(data).hexdigest()
+    http_server.files["/data.bin"] = data
+
+    valid = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "valid.bin", size=len(data), sha1=data_sha1)
+    corrupted = DownloadEntry(f"{http_server.url}/data.bin", tmp_path / "corrupted.bin", size=len(data), sha1=data_sha1)
+    valid.dst.write_bytes(data)
+    corrupted.dst.write_bytes(bytes(len(data)))
+
+    dl = DownloadList(verify_hashes=True)
+    dl.add(valid, verify=True)
+    dl.add(corrupted, verify=True)
+    assert dl.count == 0
+
+    dl.check_hashes(2)
+    assert dl.count == 1
+
+    results = [result for _, result in dl.download(1)]
+    assert len(results) == 1 and results[0].entry == corrupted
+    assert corrupted.dst.read_bytes() == data
+
+
+def test_download_results_merge():
+
+    from portablemc.download import _merge_results
+
+    entry = DownloadEntry("http://localhost/", Path("test"))
+    p0 = DownloadResultProgress(0, entry, 10, 0.0, False)
+    p1 = DownloadResultProgress(1, entry, 10, 0.0, False)
+    p0_next = DownloadResultProgress(0, entry, 20, 0.0, False)
+    d0 = DownloadResultProgress(0, entry, 30, 0.0, True)
+    e1 = DownloadResultError(1, entry, DownloadResultError.NOT_FOUND, None)
+
+    assert _merge_results([p0]) == [p0]
+    assert _merge_results([p0, p1, p0_next]) == [p1, p0_next]
+    assert _merge_results([p0, p1, d0, p0_next]) == [p1, d0, p0_next]
+    assert _merge_results([p1, e1, p0]) == [e1, p0]
@@ -0,0 +1,184 @@
+import pytest
+import json
+import hashlib
+import io
+
+from portablemc.http import http_request, HttpError, HttpCache, _client
+import portablemc.http
+
+
+def test_http_request(http_server):
+
+    http_server.files["/file.json"] = b'{"foo": "bar"}'
+    http_server.redirects["/redirect.json"] = "/file.json"
+
+    _client.close()
+    for _ in range(3):
+        res = http_request("GET", f"{http_server.url}/file.json")
+        assert res.status == 200
+        assert res.json() == {"foo": "bar"}
+
+    assert http_request("GET", f"{http_server.url}/redirect.json").json() == {"foo": "bar"}
+    assert http_server.requests == ["/file.json"] * 3 + ["/redirect.json", "/file.json"]
+
+    # All requests are made on the same keep-alive connection.
+    assert http_server.connections == 1
+
+    with pytest.raises(HttpError) as error:
+        http_request("GET", f"{http_server.url}/not_found.json")
+    assert error.value.res.status == 404
+
+
+def test_http_request_connection(http_server):
+
+    http_server.files["/file.json"] = b"{}"
+
+    _client.close()
+    http_request("GET", f"{http_server.url}/file.json")
+
+    # Idle connections closed meanwhile are replaced by new connections.
+    for idle in _client.idle.values():
+        for conn in idle:
+            conn.sock.close()
+
+    assert http_request("GET", f"{http_server.url}/file.json").json() == {}
+    assert http_server.connections == 2
+
+    url = http_server.url
+    http_server.close()
+    _client.close()
+    with pytest.raises(HttpError) as error:
+        http_request("GET", f"{url}/file.json")
+    assert error.value.res.status == 0
+    assert isinstance(error.value.reason.reason, OSError)
+
+
+def test_http_request_encoding(http_server):
+
+    import zlib
+    import gzip
+
+    data = b'{"foo": "bar", "list": [' + b",".join(b"%d" % i for i in range(10000)) + b"]}"
+    deflate_raw = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    for path, encoding, encoded in (
+        ("/gzip.json", "gzip", gzip.compress(data)),
+        ("/deflate.json", "deflate", zlib.compress(data)),
+        ("/deflate_raw.json", "deflate", deflate_raw.compress(data) + deflate_raw.flush()),
+        ("/invalid.json", "gzip", data),
+    ):
+        http_server.files[path] = data
+        http_server.encoded[path] = (encoding, encoded)
+
+    for path in ("/gzip.json", "/deflate.json", "/deflate_raw.json"):
+        res = http_request("GET", f"{http_server.url}{path}")
+        assert res.data == data
+        assert not any(name.lower() in ("content-encoding", "content-length") for name in res.headers)
+
+    # Encodings can be refused.
+    assert http_request("GET", f"{http_server.url}/gzip.json", headers={"Accept-Encoding": "identity"}).data == data
+
+    with pytest.raises(HttpError) as error:
+        http_request("GET", f"{http_server.url}/invalid.json")
+    assert error.value.res.status == 0
+
+
+def test_http_request_stream(http_server, monkeypatch):
+
+    import gzip
+
+    monkeypatch.setattr(portablemc.http, "SPOOL_MAX_SIZE", 1000)
+
+    small_data = b'{"foo": "bar"}'
+    large_data = b'{"list": [' + b",".join(b"%d" % i for i in range(10000)) + b"]}"
+    http_server.files["/small.json"] = small_data
+    http_server.files["/large.json"] = large_data
+    http_server.files["/large_gzip.json"] = large_data
+    http_server.encoded["/large_gzip.json"] = ("gzip", gzip.compress(large_data))
+
+    for path, data in (("/small.json", small_data), ("/large.json", large_data), ("/large_gzip.json", large_data)):
+        with http_request("GET", f"{http_server.url}{path}", stream=True) as res:
+            assert res.file is not None
+            assert res.file.read() == data
+            assert res.data == data
+            assert res.json() == json.loads(data)
+        assert res.file is None
+    
+    # Large data is spooled to a temporary file, small data is kept in memory.
+    res = http_request("GET", f"{http_server.url}/large.json", stream=True)
+    assert not isinstance(res.file, io.BytesIO)
+    res = http_request("GET", f"{http_server.url}/small.json", stream=True)
+    assert isinstance(res.file, io.BytesIO)
+
+    with pytest.raises(HttpError) as error:
+        http_request("GET", f"{http_server.url}/not_found.json", stream=True)
+    assert error.value.res.file is None
+
+
+def test_http_cache(tmp_path, http_server, monkeypatch):
+
+    cache = HttpCache(tmp_path / "cache", policies={f"{http_server.url}/policy/": 3600, f"{http_server.url}/always/": 0})
+    monkeypatch.setattr(portablemc.http, "http_cache", cache)
+
+    http_server.files["/fresh.json"] = b'{"fresh": true}'
+    http_server.files["/revalidated.json"] = b'{"revalidated": true}'
+    http_server.files["/policy/file.json"] = b'{"policy": true}'
+    http_server.files["/always/file.json"] = b'{"always": true}'
+    http_server.headers["/fresh.json"] = {"Cache-Control": "max-age=3600"}
+    http_server.headers["/revalidated.json"] = {"Cache-Control": "no-cache"}
+    http_server.headers["/always/file.json"] = {"Cache-Control": "max-age=3600"}
+
+    for _ in range(2):
+        for path in ("/fresh.json", "/revalidated.json", "/policy/file.json", "/always/file.json"):
+            assert http_request("GET", f"{http_server.url}{path}").data == http_server.files[path]
+    
+    # Fresh responses are not requested again, others are revalidated, policies are
+    # used over the server's headers.
+    assert http_server.requests == ["/fresh.json", "/revalidated.json", "/policy/file.json", "/always/file.json", 
+        "/revalidated.json", "/always/file.json"]
+
+    # Conditional requests and requests without cache are not cached.
+    http_request("GET", f"{http_server.url}/fresh.json", cache=False)
+    http_request("GET", f"{http_server.url}/fresh.json", headers={"Range": "bytes=0-"})
+    assert http_server.requests[6:] == ["/fresh.json"] * 2
+
+    # Outdated responses are used if the server can't be reached.
+    http_server.statuses["/revalidated.json"] = [(503, {})]
+    assert http_request("GET", f"{http_server.url}/revalidated.json").data == http_server.files["/revalidated.json"]
+
+    with pytest.raises(HttpError) as error:
+        http_request("GET", f"{http_server.url}/not_found.json")
+    assert error.value.res.status == 404
+
+    # In offline mode, no request is made.
+    cache.offline = True
+    requests_count = len(http_server.requests)
+    assert http_request("GET", f"{http_server.url}/revalidated.json").data == http_server.files["/revalidated.json"]
+    with pytest.raises(HttpError) as error:
+        http_request("GET", f"{http_server.url}/not_cached.json")
+    assert error.value.res.status == 0
+    assert len(http_server.requests) == requests_count
+
+
+def test_http_cache_store(tmp_path):
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = HttpCache(tmp_path / "cache")
+    url = "http://localhost/file.json"
+    key = hashlib.sha1(url.encode()).hexdigest()
+    data = b'{"foo": "bar"}' * 1000
+
+    # The same response can be stored by multiple threads at once.
+    with ThreadPoolExecutor(8) as executor:
+        for future in [executor.submit(cache._store, key, url, {"ETag": '"1"'}, data) for _ in range(64)]:
+            future.result()
+    
+    record = cache._load(key)
+    assert record is not None and record["data"] == data
+    assert sorted(file.name for file in cache.dir.iterdir()) == [f"{key}.bin", f"{key}.json"]
+
+    # Responses are not cached if the directory can't be written.
+    (tmp_path / "file").write_bytes(b"")
+    cache = HttpCache(tmp_path / "file" / "cache")
+    cache._store(key, url, {}, data)
+    assert cache._load(key) is None
@@ -1,9 +1,14 @@
 """Functional tests of the game's installation.
 """
 
+from zipfile import ZipFile
 from pathlib import Path
+from io import BytesIO
+import hashlib
 import shutil
 import pytest
+import json
+import os
 
 from portablemc.standard import Context, Version, VersionManifest, TooMuchParentsError, \
     JarNotFoundError
@@ -117,3 +122,71 @@ def test_install_error(tmp_context: Context,
 
     with pytest.raises(test_error, match=test_match):
         version.install()
+
+
+@pytest.mark.skipif(os.name == "nt", reason="the fake JVM is a shell script")
+def test_install_forge_processors(tmp_path: Path, http_server):
+    """Testing that libraries generated by forge processors, without download URL, are
+    not required before processors are run, this doesn't require network.
+    """
+
+    context = Context(tmp_path / "main")
+
+    # The fake JVM run by processors writes the file given as last argument, the 
+    # metadata lock of the forge version must be held while processing.
+    lock_file = context.versions_dir / "forge-1.0-1.0.lock"
+    jvm_file = tmp_path / "java"
+    jvm_file.write_text(f'#!/bin/sh\ntest -f "{lock_file}" || exit 1\nfor arg; do out="$arg"; done\nmkdir -p "$(dirname "$out")"\nprintf forge > "$out"\n')
+    jvm_file.chmod(0o755)
+
+    client_data = b"client"
+    http_server.files["/client.jar"] = client_data
+
+    parent = context.get_version("test-forge-parent")
+    parent.metadata = {
+        "id": parent.id,
+        "mainClass": "net.minecraft.client.main.Main",
+        "downloads": {"client": {"url": f"{http_server.url}/client.jar", "size": len(client_data), 
+            "sha1": hashlib.sha1(client_data).hexdigest()}},
+        "libraries": [],
+    }
+    parent.write_metadata_file()
+
+    processor_jar = BytesIO()
+    with ZipFile(processor_jar, "w") as zf:
+        zf.writestr("META-INF/MANIFEST.MF", "Main-Class: test.Processor\n")
+
+    install_jar = BytesIO()
+    with ZipFile(install_jar, "w") as zf:
+        zf.writestr("install_profile.json", json.dumps({
+            "json": "/version.json",
+            "processors": [{"jar": "test:processor:1.0", "args": ["--output", "{PATCHED}"]}],
+            "libraries": [{"name": "test:processor:1.0", "downloads": {"artifact": {"url": ""}}}],
+            "data": {"PATCHED": {"client": "[test:forge:1.0:client]"}},
+        }))
+        zf.writestr("version.json", json.dumps({
+            "inheritsFrom": parent.id,
+            "mainClass": "test.Main",
+            "libraries": [{"name": "test:forge:1.0:client", "downloads": {"artifact": {"url": ""}}}],
+        }))
+        zf.writestr("maven/test/processor/1.0/processor-1.0.jar", processor_jar.getvalue())
+    
+    http_server.files["/1.0-1.0/forge-1.0-1.0-installer.jar"] = install_jar.getvalue()
+
+    version = ForgeVersion("1.0-1.0", context=context, _forge_repo=http_server.url)
+    version.manifest.get_version = lambda version: None
+    version.jvm_path = jvm_file
+    version._resolve_assets = lambda watcher: setattr(version, "_assets_index_version", "test")
+    version._finalize_assets = lambda watcher: None
+
+    # The lock is released once post processed, before the end of the install.
+    download = version._download
+    def download_then_check(watcher):
+        download(watcher)
+        assert not lock_file.exists()
+    version._download = download_then_check
+
+    version.install()
+
+    assert (context.libraries_dir / "test/forge/1.0/forge-1.0-client.jar").read_bytes() == b"forge"
+    assert not lock_file.exists()
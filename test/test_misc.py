@@ -1,4 +1,5 @@
 import pytest
+import os
 
 
 def test_sha1():
@@ -88,3 +89,105 @@ def test_library_specifier():
     assert spec.extension == "txt"
     assert str(spec) == "foo.bar:baz:0.1.0:classifier@txt"
     assert spec.file_path() == "foo/bar/baz/0.1.0/baz-0.1.0-classifier.txt"
+
+
+def test_file_lock(tmp_path):
+
+    from portablemc.util import FileLock
+
+    path = tmp_path / "dir" / "file.lock"
+    lock = FileLock(path)
+    other = FileLock(path)
+
+    assert lock.acquire()
+    assert path.exists()
+    assert not other.acquire(blocking=False)
+    lock.release()
+    assert not path.exists()
+
+    with other:
+        assert not lock.acquire(blocking=False)
+    assert lock.acquire(blocking=False)
+    lock.release()
+
+
+def test_link_file(tmp_path):
+
+    from portablemc.util import link_file
+
+    src = tmp_path / "src.txt"
+    src.write_text("hello world!")
+
+    dst = tmp_path / "dir" / "dst.txt"
+    link_file(src, dst)
+    assert dst.read_text() == "hello world!"
+
+    # The destination is replaced if existing.
+    src.unlink()
+    src.write_text("bye world!")
+    link_file(src, dst)
+    assert dst.read_text() == "bye world!"
+    assert sorted(p.name for p in dst.parent.iterdir()) == ["dst.txt"]
+
+
+def test_file_sha1(tmp_path):
+
+    from portablemc.util import calc_file_sha1
+
+    file = tmp_path / "file.txt"
+    file.write_bytes(b"hello world!")
+    assert calc_file_sha1(file) == "430ce34d020724ed75a196dfc2ad67c77772d169"
+    file.write_bytes(b"")
+    assert calc_file_sha1(file) == "da39a3ee5e6b4b0d3255bfef95601890afd80709"
+
+
+def test_version_manifest(tmp_path, http_server, monkeypatch):
+
+    from portablemc.standard import VersionManifest, VERSION_MANIFEST_URL
+    import portablemc.http
+    import json
+
+    versions = [
+        {"id": "1.20-pre1", "type": "snapshot", "url": "", "time": "", "releaseTime": ""},
+        {"id": "1.19", "type": "release", "url": "", "time": "", "releaseTime": ""},
+        {"id": "1.18", "type": "release", "url": "", "time": "", "releaseTime": ""},
+    ]
+    http_server.files["/version_manifest.json"] = json.dumps({
+        "latest": {"release": "1.19", "snapshot": "1.20-pre1"},
+        "versions": versions,
+    }).encode()
+    monkeypatch.setitem(portablemc.http.url_overrides, VERSION_MANIFEST_URL, f"{http_server.url}/version_manifest.json")
+
+    manifest = VersionManifest(tmp_path / "version_manifest.json")
+    assert manifest.get_version("1.18") == versions[2]
+    assert manifest.get_version("release") == versions[1]
+    assert manifest.get_version("1.17") is None
+    assert manifest.all_versions() == versions
+    assert manifest.all_versions("release") == versions[1:]
+    assert manifest.all_versions("old_alpha") == []
+
+    # Indexes are built from the cached manifest if not modified.
+    http_server.statuses["/version_manifest.json"] = [(304, {})]
+    manifest = VersionManifest(tmp_path / "version_manifest.json")
+    assert manifest.get_version("1.20-pre1") == versions[0]
+    assert len(http_server.requests) == 2
+
+
+@pytest.mark.skipif(os.name == "nt", reason="posix permissions")
+def test_version_metadata_file(tmp_path):
+
+    from portablemc.standard import Context
+
+    handle = Context(tmp_path).get_version("test")
+    handle.metadata = {"id": "test"}
+    
+    umask = os.umask(0o022)
+    try:
+        handle.write_metadata_file()
+    finally:
+        os.umask(umask)
+
+    # The metadata file is readable by other users sharing the directory.
+    assert handle.metadata_file().stat().st_mode & 0o777 == 0o644
+    assert handle.read_metadata_file() and handle.metadata == {"id": "test"}
+    assert list(handle.dir.iterdir()) == [handle.metadata_file()]